@@ -0,0 +1,117 @@
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+_worker = {}
+_fork_lock = threading.Lock()
+
+
+def trace_routes(graph, predecessors, rows, origins, destinations, pair_edge, values):
+    """
+    Sums per-edge `values` (list of arrays) along the routes from each
+    origin to its destination, walking all predecessor chains at once.
+    Route i follows row `rows[i]` of `predecessors`. Unreachable routes
+    get NaN.
+    """
+    current = destinations.copy()
+    totals = [np.zeros(len(destinations)) for _ in values]
+    active = current != origins
+    while active.any():
+        previous = predecessors[rows[active], current[active]]
+        reachable = previous >= 0
+        lost = np.flatnonzero(active)[~reachable]
+        for total in totals:
+            total[lost] = np.nan
+        active[lost] = False
+
+        moving = np.flatnonzero(active)
+        previous = previous[reachable]
+        edges = pair_edge[graph.pair_index(previous, current[moving])]
+        for total, value in zip(totals, values):
+            total[moving] += value[edges]
+        current[moving] = previous
+        active[moving] = previous != origins[moving]
+    return totals
+
+
+def route_from_origins(graph, matrix, pair_edge, origins, destinations, meters_covered):
+    """
+    Routes for (origin, destination) node index pairs, with one one-to-many
+    Dijkstra per distinct origin.
+    """
+    unique_origins, rows = np.unique(origins, return_inverse=True)
+    _, predecessors = dijkstra(matrix, directed=True, indices=unique_origins, return_predecessors=True)
+    return trace_routes(graph, predecessors, rows, origins, destinations, pair_edge,
+                        [graph.length, meters_covered])
+
+
+def _worker_state(graph, alpha, meters_covered):
+    weights, pair_edge = graph.pair_weights(graph.edge_weights(alpha, meters_covered))
+    return {
+        "graph": graph,
+        "matrix": graph.matrix(weights),
+        "pair_edge": pair_edge,
+        "meters_covered": graph.meters_covered if meters_covered is None else meters_covered,
+    }
+
+
+def _init_worker(graph, alpha, meters_covered):
+    _worker.update(_worker_state(graph, alpha, meters_covered))
+
+
+def _route_chunk(chunk, state=None):
+    state = state or _worker
+    origins, destinations = chunk
+    return route_from_origins(
+        state["graph"], state["matrix"], state["pair_edge"],
+        origins, destinations, state["meters_covered"])
+
+
+def route_pairs(graph, origins, destinations, alpha=0.0, meters_covered=None,
+                processes=1, origins_per_chunk=32):
+    """
+    Length and meters covered of the cheapest route for every
+    (origin, destination) pair of node ids in a `CSRGraph`.
+
+    Pairs are grouped by origin so one one-to-many search serves all of an
+    origin's destinations. Chunks of origins are spread over a process pool
+    whose workers share the read-only graph and weights, inherited from
+    this process where processes are forked.
+    """
+    origins = graph.node_index(origins)
+    destinations = graph.node_index(destinations)
+
+    order = np.argsort(origins, kind="stable")
+    _, first = np.unique(origins[order], return_index=True)
+    bounds = np.append(first[::origins_per_chunk], len(order))
+    chunks = [order[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    tasks = [(origins[chunk], destinations[chunk]) for chunk in chunks]
+
+    if processes == 1:
+        state = _worker_state(graph, alpha, meters_covered)
+        results = [_route_chunk(task, state) for task in tasks]
+    elif "fork" in mp.get_all_start_methods():
+        # forked workers inherit the graph and weights built here (copy on
+        # write) instead of unpickling a copy each
+        with _fork_lock:
+            _worker.clear()
+            _worker.update(_worker_state(graph, alpha, meters_covered))
+            try:
+                with ProcessPoolExecutor(processes or os.cpu_count(), mp_context=mp.get_context("fork")) as pool:
+                    results = list(pool.map(_route_chunk, tasks))
+            finally:
+                _worker.clear()
+    else:
+        with ProcessPoolExecutor(processes or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(graph, alpha, meters_covered)) as pool:
+            results = list(pool.map(_route_chunk, tasks))
+
+    length = np.full(len(origins), np.nan)
+    covered = np.full(len(origins), np.nan)
+    for chunk, (chunk_length, chunk_covered) in zip(chunks, results):
+        length[chunk] = chunk_length
+        covered[chunk] = chunk_covered
+    return length, covered
@@ -0,0 +1,204 @@
+import hashlib
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(__file__)
+MISSING = object()
+
+
+def hash_gdf(gdf):
+    """
+    Content hash of a GeoDataFrame (geometry, attributes, index and CRS).
+    """
+    h = hashlib.sha1()
+    h.update(str(gdf.crs).encode())
+    h.update(b"".join(gdf.geometry.to_wkb().values))
+    attributes = gdf.drop(columns=gdf.geometry.name)
+    h.update(",".join(map(str, attributes.columns)).encode())
+    h.update(pd.util.hash_pandas_object(attributes, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+class ShadowCache(object):
+    """
+    On-disk cache of shadow GeoDataFrames with size-bounded LRU eviction.
+
+    Entries are keyed by the content of the casting geometries and the sun
+    position rounded to `precision` decimal degrees. Recency is tracked with
+    the file modification time, so the cache survives between processes.
+    """
+    def __init__(self, path=None, max_bytes=2 * 1024**3, precision=2):
+        self.path = path if path else os.path.join(ROOT_DIR, "..", "data", "cache", "shadows")
+        self.max_bytes = max_bytes
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, gdf, azimuth, altitude, **params):
+        azimuth = round(math.degrees(azimuth), self.precision)
+        altitude = round(math.degrees(altitude), self.precision)
+        params = ",".join(f"{k}={params[k]}" for k in sorted(params))
+        sun = f"{azimuth:.{self.precision}f}_{altitude:.{self.precision}f}"
+        return hashlib.sha1(f"{hash_gdf(gdf)}|{sun}|{params}".encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".pkl")
+
+    def get(self, key):
+        path = self._file(key)
+        try:
+            shadows = pd.read_pickle(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            # truncated or unreadable entry: drop it and recompute
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return shadows
+
+    def put(self, key, shadows):
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shadows.to_pickle(f)
+            os.replace(tmp_path, self._file(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+
+def file_stamp(path):
+    """
+    (path, mtime, size) of a file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, TypeError):
+        return None
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+class RouteCache(object):
+    """
+    In-memory memo of route results with LRU and TTL eviction.
+
+    Entries are keyed by the snapped source and target nodes, alpha rounded
+    to `alpha_step`, the shade time bucket (`time_step` hours) and a network
+    version, which changes when the network or shade files change. A lookup
+    with a new version drops every entry. `get` returns `MISSING` when
+    there is no live entry, so None can be cached (e.g. no route).
+    """
+    def __init__(self, max_entries=100000, ttl=3600, alpha_step=0.05, time_step=1.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.alpha_step = alpha_step
+        self.time_step = time_step
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def quantize_alpha(self, alpha):
+        return round(round(alpha / self.alpha_step) * self.alpha_step, 6)
+
+    def bucket(self, hour):
+        """
+        Start of the time bucket of an hour of day (None stays None).
+        """
+        if hour is None:
+            return None
+        return math.floor(hour / self.time_step) * self.time_step
+
+    def key(self, source, target, alpha, hour, kind="route"):
+        return (kind, source, target, self.quantize_alpha(alpha), self.bucket(hour))
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                    self.evictions += 1
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+        }
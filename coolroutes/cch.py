@@ -0,0 +1,321 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+LEAF_SIZE = 64
+
+
+def nested_dissection(x, y, src, dst, leaf_size=LEAF_SIZE):
+    """
+    Metric-independent contraction order from geometric nested dissection:
+    node sets are split at the median of their wider coordinate axis, the
+    smaller side's boundary becomes the separator and is ordered after both
+    halves. `src`/`dst` are the undirected edges (node indices).
+    Returns the node indices from lowest to highest rank.
+    """
+    order = []
+    side = np.zeros(len(x), dtype=np.int8)
+
+    def dissect(nodes, edges):
+        if len(nodes) <= leaf_size:
+            order.extend(nodes.tolist())
+            return
+        px, py = x[nodes], y[nodes]
+        coord = px if np.ptp(px) >= np.ptp(py) else py
+        split = np.median(coord)
+        in_a = coord < split
+        if in_a.all() or not in_a.any():
+            in_a = np.zeros(len(nodes), dtype=bool)
+            in_a[np.argsort(coord, kind="stable")[:len(nodes) // 2]] = True
+
+        side[nodes] = ~in_a
+        side_src = side[src[edges]]
+        side_dst = side[dst[edges]]
+        cut = side_src != side_dst
+        boundary_a = np.unique(np.where(side_src[cut] == 0, src[edges][cut], dst[edges][cut]))
+        boundary_b = np.unique(np.where(side_src[cut] == 1, src[edges][cut], dst[edges][cut]))
+        separator = boundary_a if len(boundary_a) <= len(boundary_b) else boundary_b
+
+        removed = np.isin(nodes, separator)
+        a_nodes = nodes[in_a & ~removed]
+        b_nodes = nodes[~in_a & ~removed]
+        kept = ~(np.isin(src[edges], separator) | np.isin(dst[edges], separator))
+        dissect(a_nodes, edges[kept & ~cut & (side_src == 0)])
+        dissect(b_nodes, edges[kept & ~cut & (side_src == 1)])
+        order.extend(separator.tolist())
+
+    dissect(np.arange(len(x)), np.arange(len(src)))
+    return np.array(order, dtype=np.int32)
+
+
+class CCH(object):
+    """
+    Customizable contraction hierarchy over a `CSRGraph`.
+
+    The node order (nested dissection on node coordinates), the chordal
+    supergraph of upward arcs and its lower triangles depend only on the
+    topology; they are built once and persisted with `save`. `customize`
+    then applies any edge weight vector (e.g. `graph.edge_weights(alpha,
+    shade.column(hour))`) with one vectorized pass per elimination tree
+    level, and `query` runs the elimination tree search between two nodes.
+
+    Everything below works on ranks (position in the order); `order` maps
+    ranks back to graph node indices. Queries only read the customized
+    state, so they can run from several threads at once.
+    """
+    def __init__(self, graph, order, up_indptr, up_indices, arc_entry,
+                 triangle_level_ptr, triangles, parent):
+        self.graph = graph
+        self.order = order
+        self.rank = np.empty_like(order)
+        self.rank[order] = np.arange(len(order), dtype=order.dtype)
+        self.up_indptr = up_indptr
+        self.up_indices = up_indices
+        self.arc_entry = arc_entry
+        self.triangle_level_ptr = triangle_level_ptr
+        self.triangles = triangles
+        self.parent = parent
+
+        n = len(order)
+        self.arc_tail = np.repeat(np.arange(n, dtype=np.int32), np.diff(up_indptr))
+        self._arc_keys = self.arc_tail.astype(np.int64) * n + up_indices
+        self._parent = parent.tolist()
+
+        # elimination tree depth (parents rank above their children), and
+        # that of every arc's head: a node's ancestors have distinct depths
+        depth = [0] * n
+        for v in range(n - 1, -1, -1):
+            if self._parent[v] >= 0:
+                depth[v] = depth[self._parent[v]] + 1
+        self.depth = np.array(depth, dtype=np.int32)
+        self._head_depth = self.depth[up_indices]
+        self.weights = None
+        self.base_edge = None
+        self._children = None
+        self._base_edge = None
+
+    @classmethod
+    def build(cls, graph, leaf_size=LEAF_SIZE):
+        n = graph.n_nodes
+        src = np.repeat(np.arange(n, dtype=np.int32), np.diff(graph.indptr))
+        dst = graph.indices
+        once = src < dst
+        src, dst = src[once], dst[once]
+
+        order = nested_dissection(graph.x, graph.y, src, dst, leaf_size)
+        rank = np.empty(n, dtype=np.int32)
+        rank[order] = np.arange(n, dtype=np.int32)
+
+        # chordal completion: contracting a node makes its upward neighbours
+        # a clique, which is carried up to the lowest of them
+        up = [set() for _ in range(n)]
+        for a, b in zip(rank[src].tolist(), rank[dst].tolist()):
+            if a < b:
+                up[a].add(b)
+            else:
+                up[b].add(a)
+        parent = np.full(n, -1, dtype=np.int32)
+        for v in range(n):
+            if up[v]:
+                w = min(up[v])
+                parent[v] = w
+                up[w] |= up[v] - {w}
+
+        up = [sorted(s) for s in up]
+        up_indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in up], out=up_indptr[1:])
+        up_indices = np.fromiter((w for s in up for w in s), dtype=np.int32, count=up_indptr[-1])
+
+        arc_tail = np.repeat(np.arange(n, dtype=np.int32), np.diff(up_indptr))
+        # CSR entry of the original edge behind each arc, -1 for fill-in arcs
+        tail, head = order[arc_tail], order[up_indices]
+        entry = np.minimum(graph.pair_index(tail, head), len(graph.indices) - 1)
+        exists = (graph.indptr[tail] <= entry) & (entry < graph.indptr[tail + 1]) & \
+                 (graph.indices[entry] == head)
+        arc_entry = np.where(exists, entry, -1)
+
+        # lower triangles (x, v, w) as arc ids (x-v, x-w, v-w), grouped by
+        # the height of x in the elimination tree
+        height = np.zeros(n, dtype=np.int32)
+        for v in range(n):
+            if parent[v] >= 0:
+                height[parent[v]] = max(height[parent[v]], height[v] + 1)
+
+        keys = arc_tail.astype(np.int64) * n + up_indices
+        xs, lower, upper = [], [], []
+        for v in range(n):
+            start, end = up_indptr[v], up_indptr[v + 1]
+            if end - start < 2:
+                continue
+            i, j = np.triu_indices(end - start, 1)
+            xs.append(np.full(len(i), v, dtype=np.int32))
+            lower.append(start + i)
+            upper.append(start + j)
+        if xs:
+            xs, lower, upper = np.concatenate(xs), np.concatenate(lower), np.concatenate(upper)
+        else:
+            xs = lower = upper = np.zeros(0, dtype=np.int64)
+        top = np.searchsorted(keys, up_indices[lower].astype(np.int64) * n + up_indices[upper])
+
+        level = height[xs]
+        by_level = np.argsort(level, kind="stable")
+        triangles = np.stack([lower, upper, top])[:, by_level].astype(np.int64)
+        triangle_level_ptr = np.searchsorted(level[by_level], np.arange(height.max() + 2))
+
+        return cls(graph, order, up_indptr, up_indices, arc_entry,
+                   triangle_level_ptr, triangles, parent)
+
+    def save(self, path):
+        np.savez(path,
+                 n_nodes=self.graph.n_nodes,
+                 n_arcs=len(self.graph.indices),
+                 order=self.order,
+                 up_indptr=self.up_indptr,
+                 up_indices=self.up_indices,
+                 arc_entry=self.arc_entry,
+                 triangle_level_ptr=self.triangle_level_ptr,
+                 triangles=self.triangles,
+                 parent=self.parent)
+
+    @classmethod
+    def load(cls, path, graph):
+        with np.load(path) as data:
+            arrays = {k: data[k] for k in data.files}
+        counts = (int(arrays.pop("n_nodes", -1)), int(arrays.pop("n_arcs", -1)))
+        if counts != (graph.n_nodes, len(graph.indices)):
+            raise ValueError(f"Hierarchy {path} was built for {counts[0]} nodes and {counts[1]} arcs, "
+                             f"the graph has {graph.n_nodes} and {len(graph.indices)}")
+        return cls(graph, **arrays)
+
+    def customize(self, edge_weights):
+        """
+        Applies per-edge weights (rows of the network GeoDataFrame).
+        """
+        pair_weights, pair_edge = self.graph.pair_weights(np.asarray(edge_weights, dtype=np.float64))
+        has_edge = self.arc_entry >= 0
+        base = np.full(len(self.up_indices), np.inf)
+        base[has_edge] = pair_weights[self.arc_entry[has_edge]]
+        self.base_edge = np.full(len(self.up_indices), -1, dtype=np.int64)
+        self.base_edge[has_edge] = pair_edge[self.arc_entry[has_edge]]
+
+        weights = base.copy()
+        lower, upper, top = self.triangles
+        for start, end in zip(self.triangle_level_ptr[:-1], self.triangle_level_ptr[1:]):
+            if start < end:
+                np.minimum.at(weights, top[start:end], weights[lower[start:end]] + weights[upper[start:end]])
+
+        # the two lower arcs of every arc that is cheaper through a triangle
+        through = weights[lower] + weights[upper]
+        shortcut = (through == weights[top]) & (through < base[top])
+        child_lower = np.full(len(self.up_indices), -1, dtype=np.int64)
+        child_upper = np.full(len(self.up_indices), -1, dtype=np.int64)
+        child_lower[top[shortcut]] = lower[shortcut]
+        child_upper[top[shortcut]] = upper[shortcut]
+        self._children = list(zip(child_lower.tolist(), child_upper.tolist()))
+        self._base_edge = self.base_edge.tolist()
+        self.weights = weights
+        return self
+
+    def ancestors(self, rank):
+        parent = self._parent
+        chain = [rank]
+        while parent[chain[-1]] >= 0:
+            chain.append(parent[chain[-1]])
+        return np.array(chain)
+
+    def _up_arcs(self, nodes):
+        lo, hi = self.up_indptr[nodes], self.up_indptr[nodes + 1]
+        sizes = hi - lo
+        return np.repeat(lo - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+
+    def _chain_graph(self, s_chain, t_only):
+        """
+        Upward arcs of the ancestor chain of s followed by the part of the
+        chain of t below their lowest common ancestor, as a sparse matrix
+        over those positions. Every arc leaving a chain node ends in that
+        chain, so heads are placed by their depth alone, and arcs come
+        grouped by tail, so the matrix is assembled without sorting.
+        """
+        nodes = np.concatenate([s_chain, t_only])
+        arcs = self._up_arcs(nodes)
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+        np.cumsum(self.up_indptr[nodes + 1] - self.up_indptr[nodes], out=indptr[1:])
+
+        head_depth = self._head_depth[arcs]
+        indices = len(s_chain) - 1 - head_depth
+        if len(t_only):
+            t_arcs = slice(indptr[len(s_chain)], None)
+            shared_depth = self.depth[t_only[-1]] - 1
+            t_depth = self.depth[t_only[0]]
+            indices[t_arcs] = np.where(head_depth[t_arcs] > shared_depth,
+                                       len(s_chain) + t_depth - head_depth[t_arcs], indices[t_arcs])
+        return nodes, csr_matrix((self.weights[arcs], indices, indptr), shape=(len(nodes), len(nodes)))
+
+    def _unpack(self, arcs, forward):
+        """
+        Edge rows along arcs, each travelled tail to head if `forward`.
+        An arc through triangle x (lower arc x-v, upper arc x-w) is v-x-w.
+        """
+        edges = []
+        stack = list(zip(arcs[::-1], forward[::-1]))
+        while stack:
+            arc, forward = stack.pop()
+            lower, upper = self._children[arc]
+            if lower < 0:
+                edges.append(self._base_edge[arc])
+            elif forward:
+                stack += [(upper, True), (lower, False)]
+            else:
+                stack += [(lower, True), (upper, False)]
+        return edges
+
+    def search_space(self, source, target):
+        """
+        Number of arcs a query between two node ids relaxes.
+        """
+        s, t = self.rank[self.graph.node_index([source, target])]
+        nodes = np.union1d(self.ancestors(s), self.ancestors(t))
+        return int(np.sum(self.up_indptr[nodes + 1] - self.up_indptr[nodes]))
+
+    def query(self, source, target):
+        """
+        Edge rows (in travel order) of the cheapest route between two node
+        ids under the current customization, and its cost. Returns
+        (None, inf) if the nodes are not connected.
+        """
+        if self.weights is None:
+            raise ValueError("The hierarchy has no weights, call customize() first")
+        s, t = self.rank[self.graph.node_index([source, target])]
+
+        # both upward search spaces are elimination tree ancestor chains,
+        # which meet at the lowest common ancestor and share the rest
+        s_chain, t_chain = self.ancestors(s), self.ancestors(t)
+        if s_chain[-1] != t_chain[-1]:
+            # different elimination trees: no path
+            return None, np.inf
+        top = min(len(s_chain), len(t_chain))
+        below = s_chain[::-1][:top] != t_chain[::-1][:top]
+        shared = below.argmax() if below.any() else top
+        t_only = t_chain[:len(t_chain) - shared]
+
+        nodes, matrix = self._chain_graph(s_chain, t_only)
+        t_position = len(s_chain) if len(t_only) else len(s_chain) - len(t_chain)
+        dist, previous = dijkstra(matrix, directed=True, indices=[0, t_position], return_predecessors=True)
+        meet = np.arange(len(s_chain) - shared, len(s_chain))
+        total = dist[0, meet] + dist[1, meet]
+        best = total.argmin()
+        if not np.isfinite(total[best]):
+            return None, np.inf
+
+        paths = []
+        for row in (0, 1):
+            path = [meet[best]]
+            while previous[row, path[-1]] >= 0:
+                path.append(previous[row, path[-1]])
+            paths.append(path)
+        nodes = nodes[paths[0][::-1] + paths[1][1:]]
+
+        a, b = nodes[:-1], nodes[1:]
+        arcs = np.searchsorted(self._arc_keys, np.minimum(a, b).astype(np.int64) * len(self.order) + np.maximum(a, b))
+        edges = self._unpack(arcs.tolist(), (a < b).tolist())
+        return np.array(edges, dtype=np.int64), float(total[best])
@@ -1,5 +1,4 @@
 import math
-import pybdshadow
 import geopandas as gpd
 import shapely
 from shapely import affinity
@@ -14,13 +13,17 @@ from suncalc import get_position
 import osmnx as ox
 import googlemaps
 import datetime
+import hashlib
 import pathlib
 import os
+from coolroutes import shadows, overlay, snapping, graph, batch, pareto, timedep, cch, osm, zonal
+from coolroutes.shadematrix import ShadeMatrix
+from coolroutes.cache import MISSING, file_stamp
 
 ROOT_DIR = os.path.dirname(__file__)
 
 class Geometry(object):
-    def __init__(self, bbox=None):
+    def __init__(self, bbox=None, cache=None):
         if bbox:
             self.bbox = bbox
         else:
@@ -40,6 +43,8 @@ class Geometry(object):
         self.crs = 4326
         self.gdf = None
         self.path = None
+        self.source = None
+        self.cache = cache
 
     def get_sun_position(self, date):
         lon1, lat1, lon2, lat2  = self.gdf.bounds.mean()
@@ -51,21 +56,70 @@ class Geometry(object):
         self.azimuth = sun_position["azimuth"]
         self.altitude = sun_position["altitude"]
 
+    def get_shadows_lattice(self, dates, lattice, **params):
+        """
+        Shadows for many timestamps, computed once per cell of a `SunLattice`
+        and shared between all timestamps snapping to that cell. Returns the
+        shadows per timestamp and a report with each timestamp's cell and
+        angular error (degrees). Timestamps with the sun below the horizon
+        are reported but get no shadows.
+        """
+        cells = {}
+        report = []
+        for date in dates:
+            try:
+                self.get_sun_position(date)
+            except ValueError:
+                report.append({"date": date, "cell": None})
+                continue
+            cell, cell_azimuth, cell_altitude, error = lattice.snap(self.azimuth, self.altitude)
+            cells.setdefault(cell, []).append(date)
+            report.append({
+                "date": date,
+                "azimuth": self.azimuth,
+                "altitude": self.altitude,
+                "cell": cell,
+                "cell_azimuth": cell_azimuth,
+                "cell_altitude": cell_altitude,
+                "error": error,
+            })
+
+        shadows_by_date = {}
+        for cell, cell_dates in cells.items():
+            self.azimuth, self.altitude = lattice.center(cell)
+            cell_shadows = self.cached_shadows(lambda: self.compute_shadows(**params), **params)
+            for date in cell_dates:
+                shadows_by_date[date] = cell_shadows
+        return shadows_by_date, pd.DataFrame(report)
+
+    def cached_shadows(self, compute, **params):
+        if self.cache is None:
+            return compute()
+
+        key = self.cache.key(self.gdf, self.azimuth, self.altitude, kind=type(self).__name__, **params)
+        shadows = self.cache.get(key)
+        if shadows is None:
+            shadows = compute()
+            self.cache.put(key, shadows)
+        return shadows
+
     def save_geojson(self, path = None):
         path = path if path else self.path
         self.gdf.to_file(ROOT_DIR+path, driver="GeoJSON")
         
     def load_geojson(self, input_path):
         if input_path:
+            self.source = input_path
             self.gdf = gpd.read_file(input_path)
             return self
 
-        self.gdf = gpd.read_file(ROOT_DIR+self.path)
+        self.source = ROOT_DIR+self.path
+        self.gdf = gpd.read_file(self.source)
         return self
 
 class Trees(Geometry):
-    def __init__(self, bbox=None):
-        super().__init__(bbox)
+    def __init__(self, bbox=None, cache=None):
+        super().__init__(bbox, cache)
         self.path = "/../model/trees.geojson"
 
     def load_municipality_dataset(self, input_path="data/tree_basiss.json"):
@@ -148,10 +202,16 @@ class Trees(Geometry):
         shade = shapely.ops.unary_union([shade, trunk])
         return shade
 
-    def get_shadows(self, date, precision=4, details=0.4):
+    def get_shadows(self, date, precision=4, details=0.4, vectorized=True):
         self.get_sun_position(date)
+        return self.cached_shadows(lambda: self.compute_shadows(vectorized), vectorized=vectorized)
+
+    def compute_shadows(self, vectorized=True):
         trees_mercator = self.gdf.to_crs(epsg=3857)
-        shadows_geom = trees_mercator.apply(lambda row: self.tree_shade(row), axis=1)
+        if vectorized:
+            shadows_geom = shadows.trees_shadows(trees_mercator, self.azimuth, self.altitude)
+        else:
+            shadows_geom = trees_mercator.apply(lambda row: self.tree_shade(row), axis=1)
         shadows_gdf = gpd.GeoDataFrame(
             crs='epsg:3857', 
             geometry=gpd.GeoSeries(shadows_geom)
@@ -159,50 +219,58 @@ class Trees(Geometry):
         return shadows_gdf
 
 class Buildings(Geometry):
-    def __init__(self, bbox=None):
-        super().__init__(bbox)
+    def __init__(self, bbox=None, cache=None):
+        super().__init__(bbox, cache)
         self.path = "/../model/buildings.geojson"
-
-    def get_buildings_elevation(self, poly, n=100):
-        minx, miny, maxx, maxy = poly.geometry.bounds
-        x = np.random.uniform(minx, maxx, n)
-        y = np.random.uniform(miny, maxy, n)
-
-        df = pd.DataFrame()
-        df['points'] = list(zip(x,y))
-        df['points'] = df['points'].apply(Point)
-        gdf_points = gpd.GeoDataFrame(df, geometry='points').set_crs(4326)
-        gdf_poly = gpd.GeoDataFrame(geometry=gpd.GeoSeries(poly))
-        
-        spatial_join = gpd.tools.sjoin(gdf_points, gdf_poly, predicate="within", how='left')
-        sample_points = gdf_points[spatial_join.index_right == "geometry"].to_crs(epsg=25832).points.values
-        sample_points = [(p.x, p.y) for p in sample_points]
-        heights = list(self.CHM_data.sample(sample_points, 1))
-        return np.median(heights)
+        self.CHM_path = "./data/DHM/CPH_CHM.tif"
 
     def load_osm(self):
         tags = {"building": True}
         gdf = ox.geometries.geometries_from_bbox(*self.bbox.values(), tags=tags)
         gdf = gdf.reset_index()[["osmid", "geometry"]].set_index("osmid")
+        return self.set_footprints(gdf)
+
+    def load_osm_extract(self, path):
+        """
+        Like `load_osm`, from a local .osm / .osm.pbf extract.
+        """
+        return self.set_footprints(osm.building_footprints(path, self.bbox))
 
-        self.CHM_data = rasterio.open("./data/DHM/CPH_CHM.tif")
-        gdf["height"] = gdf.apply(self.get_buildings_elevation, axis=1)
+    def set_footprints(self, gdf):
+        gdf["height"] = zonal.zonal_percentiles(self.CHM_path, gdf, [50])[50]
     
         self.crs = gdf.crs
         self.gdf = gdf
         return self
 
-    def get_shadows(self, date):
+    def get_shadows(self, date, processes=1):
+        self.get_sun_position(date)
+        return self.cached_shadows(lambda: self.compute_shadows(processes))
+
+    def compute_shadows(self, processes=1):
         gdf_copy = self.gdf.copy()
         gdf_copy['building_id'] = gdf_copy.index 
-        shadows = pybdshadow.bdshadow_sunlight(gdf_copy, date)
-        shadows = shadows.set_crs(crs=self.crs)
-        return shadows
+        if processes != 1:
+            shadows_gdf = shadows.building_shadows_parallel(gdf_copy, self.azimuth, self.altitude, processes)
+        else:
+            shadows_gdf = shadows.building_shadows(gdf_copy, self.azimuth, self.altitude)
+        shadows_gdf = shadows_gdf.set_crs(crs=self.crs)
+        return shadows_gdf
 
 class Network(Geometry):
-    def __init__(self, bbox=None):
-        super().__init__(bbox)
+    def __init__(self, bbox=None, cache=None, route_cache=None):
+        super().__init__(bbox, cache)
         self.path = r"/../model/bike_network.geojson"
+        self.snap_index = None
+        self.shade = None
+        self._profiles = {}
+        self.hierarchy = None
+        self.route_cache = route_cache
+        self._graph_hash = None
+        self._shade_stamp = None
+        self._shade_key = None
+        self._graph = None
+        self._graph_key = None
 
     def load_osm(self):
         bbox = (self.bbox["y_max"],
@@ -249,17 +317,291 @@ class Network(Geometry):
 
         self.gdf = lines_mercator.to_crs(self.crs)
         return self
+
+    def load_osm_extract(self, path):
+        """
+        Like `load_osm`, from a local .osm / .osm.pbf extract streamed in two
+        passes, with the bike/walk/drive and access filters applied while
+        parsing.
+        """
+        self.source = path
+        self.gdf = osm.network_edges(path, bbox=self.bbox).to_crs(self.crs)
+        return self
+
+    def apply_shadows(self, shadows):
+        self.gdf["meters_covered"] = overlay.meters_covered(self.gdf, shadows)
+        return self
     
-    def get_shortest_route(self, start_point, end_point):
-        G = nx.from_pandas_edgelist(self.gdf, 'u', 'v', edge_attr=True, edge_key='osmid')
-        start_point, _ = min(G.edges(), key=lambda n: G.edges[n]['geometry'].distance(start_point))
-        end_point, _ = min(G.edges(), key=lambda n: G.edges[n]['geometry'].distance(end_point))
-        path = nx.shortest_path(G, start_point, end_point, weight=lambda u, v, d: d["length"])
-
-        path_subgraph = nx.subgraph(G, path)
-        path_edges = list(path_subgraph.edges())
-        path_gdf = gpd.GeoDataFrame([G.get_edge_data(edge[0], edge[1]) for edge in path_edges], geometry='geometry', crs=self.crs)
-        return path_gdf
+    def get_snap_index(self):
+        if self.snap_index is None or self.snap_index.gdf is not self.gdf:
+            self.snap_index = snapping.SnapIndex(self.gdf)
+        return self.snap_index
+
+    def graph_key(self):
+        """
+        Content hash of the gdf columns the graph is built from, so in-place
+        edits of the weights rebuild it too.
+        """
+        h = hashlib.sha1()
+        for column in ("u", "v", "length", "meters_covered"):
+            if column in self.gdf:
+                h.update(column.encode())
+                h.update(np.ascontiguousarray(self.gdf[column].to_numpy()).tobytes())
+        return h.hexdigest()
+
+    def get_graph(self):
+        if self.gdf is None and self._graph is not None:
+            # loaded with `load_graph`, nothing to rebuild it from
+            return self._graph
+        key = self.graph_key()
+        if self._graph_key != key:
+            self._graph = graph.CSRGraph.from_gdf(self.gdf)
+            self._graph_key = key
+        return self._graph
+
+    def save_graph(self, path):
+        self.get_graph().save(path)
+
+    def load_graph(self, path):
+        self._graph = graph.CSRGraph.load(path)
+        self._graph_key = self.graph_key() if self.gdf is not None else None
+        return self
+
+    def get_hierarchy(self, path=None):
+        """
+        Contraction hierarchy of the network graph. The (metric independent)
+        hierarchy is read from `path` if it exists, and built and saved
+        there otherwise.
+        """
+        if self.hierarchy is None or self.hierarchy.graph is not self.get_graph():
+            if path is not None and os.path.exists(path):
+                self.hierarchy = cch.CCH.load(path, self.get_graph())
+            else:
+                self.hierarchy = cch.CCH.build(self.get_graph())
+                if path is not None:
+                    self.hierarchy.save(path)
+        return self.hierarchy
+
+    def customize(self, alpha=0.0, hour=None, path=None):
+        """
+        Applies the weights for an alpha and shade hour to the hierarchy,
+        after which `get_fast_route` answers queries for them.
+        """
+        weights = self.get_graph().edge_weights(alpha, self.get_meters_covered(hour))
+        self.get_hierarchy(path).customize(weights)
+        return self
+
+    def get_fast_route(self, start_point, end_point):
+        if self.hierarchy is None or self.hierarchy.graph is not self.get_graph():
+            raise ValueError("No hierarchy for the current network, call customize() first")
+        start_point, end_point = self.get_snap_index().snap_to_node([start_point, end_point])
+        path, _ = self.hierarchy.query(start_point, end_point)
+        if path is None:
+            raise ValueError("No route between given points")
+        return self.gdf.iloc[path]
+
+    def load_shade(self, path):
+        self.shade = ShadeMatrix(path)
+        self._profiles = {}
+        self._shade_key = None
+        self.check_shade()
+        return self
+
+    def check_shade(self):
+        """
+        Makes sure the shade matrix rows are the network edges in order
+        (by u, v and osmid, or by count for a graph loaded without a gdf).
+        """
+        key = (id(self.gdf), id(self._graph))
+        if self._shade_key == key:
+            return
+        if self.gdf is not None:
+            self.shade.check_edges(self.gdf)
+        elif self._graph is not None and len(self._graph.length) != len(self.shade.edges):
+            raise ValueError(f"Shade matrix {self.shade.path} has {len(self.shade.edges)} edges, "
+                             f"the graph {len(self._graph.length)}")
+        self._shade_key = key
+
+    def get_shade_profile(self, source="total"):
+        self.check_shade()
+        if source not in self._profiles:
+            self._profiles[source] = timedep.ShadeProfile.from_matrix(self.shade, source)
+        return self._profiles[source]
+
+    def get_meters_covered(self, hour=None, source="total"):
+        """
+        Meters covered of every edge at a shade time bin, or interpolated
+        between bins for any other time of day.
+        """
+        if hour is None:
+            return None
+        self.check_shade()
+        if str(hour) in self.shade.times:
+            return np.asarray(self.shade.column(hour, source))
+        hours = np.full(len(self.shade.edges), timedep.hour_of_day(hour))
+        profile = self.get_shade_profile(source)
+        return self.shade.edges["length"] * profile.at(np.arange(len(hours)), hours)
+
+    def get_version(self):
+        """
+        Identifies the routing data: the graph content and the network and
+        shade files on disk. Route cache entries only live as long as it.
+        """
+        graph = self.get_graph()
+        if self._graph_hash is None or self._graph_hash[0] is not graph:
+            h = hashlib.sha1()
+            for array in (graph.node_ids, graph.indptr, graph.indices, graph.length, graph.meters_covered):
+                h.update(np.ascontiguousarray(array).tobytes())
+            self._graph_hash = (graph, h.hexdigest())
+
+        shade_stamp = None
+        if self.shade is not None:
+            shade_stamp = (file_stamp(os.path.join(self.shade.path, "shade.npy")),
+                           file_stamp(os.path.join(self.shade.path, "meta.json")))
+            if shade_stamp != self._shade_stamp:
+                self._profiles = {}
+                self._shade_stamp = shade_stamp
+        return (self._graph_hash[1], file_stamp(self.source), shade_stamp)
+
+    def time_bucket(self, hour):
+        """
+        Hour the routes for `hour` are computed at: the start of its route
+        cache time bucket, or `hour` itself without a route cache.
+        """
+        if hour is None or self.route_cache is None:
+            return hour
+        return self.route_cache.bucket(timedep.hour_of_day(hour))
+
+    def get_route_edges(self, source, target, alpha=0.0, hour=None):
+        """
+        Edge rows of the cheapest route between two node ids, or None.
+        With a `route_cache`, alpha and hour are quantized to its buckets
+        and results are memoized.
+        """
+        cache = self.route_cache
+        if cache is None:
+            return self.get_graph().shortest_path(source, target, alpha, self.get_meters_covered(hour))
+
+        hour = self.time_bucket(hour)
+        version = self.get_version()
+        key = cache.key(source, target, alpha, hour)
+        edges = cache.get(key, version)
+        if edges is MISSING:
+            edges = self.get_graph().shortest_path(
+                source, target, cache.quantize_alpha(alpha), self.get_meters_covered(hour))
+            cache.put(key, edges, version)
+        return edges
+
+    def get_routes(self, pairs, alpha=0.0, hour=None, processes=1):
+        """
+        Length and meters covered of the routes between many
+        (origin, destination) node id pairs, as arrays.
+        """
+        pairs = np.asarray(pairs)
+        cache = self.route_cache
+        if cache is None:
+            return batch.route_pairs(
+                self.get_graph(), pairs[:, 0], pairs[:, 1], alpha,
+                self.get_meters_covered(hour), processes)
+
+        hour = self.time_bucket(hour)
+        version = self.get_version()
+        keys = [cache.key(o, d, alpha, hour, kind="totals") for o, d in pairs.tolist()]
+        results = [cache.get(key, version) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is MISSING]
+        if missing:
+            length, covered = batch.route_pairs(
+                self.get_graph(), pairs[missing, 0], pairs[missing, 1], cache.quantize_alpha(alpha),
+                self.get_meters_covered(hour), processes)
+            for i, result in zip(missing, zip(length, covered)):
+                results[i] = result
+                cache.put(keys[i], result, version)
+        length, covered = zip(*results) if results else ((), ())
+        return np.array(length, dtype=float), np.array(covered, dtype=float)
+
+    def get_route_between(self, source, target, alpha=0.0, hour=None):
+        """
+        Like `get_route_edges`, between two points snapped onto edges (rows
+        of `SnapIndex.nearest_edges`), given as (u, v, edge, fraction); see
+        `CSRGraph.shortest_path_between`. Cached on the snapped edges and
+        positions.
+        """
+        cache = self.route_cache
+        if cache is None:
+            return self.get_graph().shortest_path_between(source, target, alpha, self.get_meters_covered(hour))
+
+        hour = self.time_bucket(hour)
+        version = self.get_version()
+        key = cache.key(source[2:], target[2:], alpha, hour, kind="between")
+        route = cache.get(key, version)
+        if route is MISSING:
+            route = self.get_graph().shortest_path_between(
+                source, target, cache.quantize_alpha(alpha), self.get_meters_covered(hour))
+            cache.put(key, route, version)
+        return route
+
+    def get_shortest_route(self, start_point, end_point, alpha=0.0, meters_covered=None, hour=None):
+        """
+        Edge rows of the cheapest route between two points. The route starts
+        and ends where the points snap onto their nearest edges: the first
+        and last rows are cut there, with `length` (and `meters_covered`)
+        scaled to the part travelled.
+        """
+        snapped = self.get_snap_index().nearest_edges([start_point, end_point])
+        source, target = snapped[["u", "v", "edge", "fraction"]].itertuples(index=False, name=None)
+        if meters_covered is None:
+            result = self.get_route_between(source, target, alpha, hour)
+        else:
+            result = self.get_graph().shortest_path_between(source, target, alpha, meters_covered)
+        if result is None:
+            raise ValueError("No route between given points")
+        path, head, tail = result
+
+        route = self.gdf.iloc[path].copy()
+        lines = self.get_snap_index().lines
+        # a route along a single edge has head == tail
+        for position, (start, end) in dict([(0, head), (len(route) - 1, tail)]).items():
+            cut = shapely.ops.substring(lines[path[position]], start, end, normalized=True)
+            route.iloc[position, route.columns.get_loc(route.geometry.name)] = gpd.GeoSeries(
+                [cut], crs=snapping.METRIC_CRS).to_crs(route.crs).iloc[0]
+            for column in ("length", "meters_covered"):
+                if column in route:
+                    route.iloc[position, route.columns.get_loc(column)] *= abs(end - start)
+        return route
+
+    def get_pareto_routes(self, start_point, end_point, meters_covered=None, epsilon=0.0, hour=None):
+        """
+        Pareto front of (length, sun-exposed length) routes between two
+        points, shortest first, with the shade of the loaded shade matrix at
+        `hour` if given. `pareto.route_for_alpha` picks the route
+        `get_shortest_route` would return for a given alpha.
+        """
+        start_point, end_point = self.get_snap_index().snap_to_node([start_point, end_point])
+        if meters_covered is None:
+            meters_covered = self.get_meters_covered(hour)
+        front = pareto.pareto_front(self.get_graph(), start_point, end_point, meters_covered, epsilon)
+        if not front:
+            raise ValueError("No route between given points")
+        return front
+
+    def get_time_dependent_route(self, start_point, end_point, departure, alpha=0.0,
+                                 speed=timedep.CYCLING_SPEED, source="total"):
+        """
+        Like `get_shortest_route`, but with each edge's shade taken from the
+        loaded shade matrix at the time the rider reaches it. The route gets
+        the entry `hour` and interpolated `meters_covered` of every edge.
+        """
+        start_point, end_point = self.get_snap_index().snap_to_node([start_point, end_point])
+        profile = self.get_shade_profile(source)
+        result = timedep.time_dependent_route(
+            self.get_graph(), profile, start_point, end_point, departure, alpha, speed)
+        if result is None:
+            raise ValueError("No route between given points")
+        path, hours = result
+        route = self.gdf.iloc[path].copy()
+        route["hour"] = hours
+        route["meters_covered"] = route["length"].values * profile.at(path, hours)
+        return route
     
     def get_google_route(self, start_point, end_point):
         with open("./data/googlemaps_API") as f:
@@ -0,0 +1,224 @@
+import numpy as np
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+METRIC_CRS = 25832
+MIN_WEIGHT = 1e-3
+
+
+def segment_weight(length, meters_covered, alpha):
+    """
+    Array form of `planning.segment_weight`.
+    """
+    return (1 - alpha) * length + alpha * (length - meters_covered)
+
+
+class CSRGraph(object):
+    """
+    Undirected network in compressed sparse row form, built from a network
+    GeoDataFrame (u, v, osmid, length, geometry) without networkx.
+
+    Nodes are renumbered to int32 indices (`node_ids` holds the OSM ids).
+    Every edge contributes an arc in both directions; parallel arcs between
+    the same nodes share one CSR entry, which takes the cheapest arc for the
+    weights in use. Per-edge arrays (`length`, `meters_covered`) follow the
+    rows of the source GeoDataFrame.
+    """
+    def __init__(self, node_ids, indptr, indices, arc_edge, pair_start, length,
+                 meters_covered, x=None, y=None):
+        self.node_ids = node_ids
+        self.indptr = indptr
+        self.indices = indices
+        self.arc_edge = arc_edge
+        self.pair_start = pair_start
+        self.length = length
+        self.meters_covered = meters_covered
+        self.x = x
+        self.y = y
+        self._pair_keys = None
+
+    @classmethod
+    def from_gdf(cls, gdf):
+        u, v = gdf["u"].values, gdf["v"].values
+        node_ids = np.unique(np.concatenate([u, v]))
+        ui = np.searchsorted(node_ids, u).astype(np.int32)
+        vi = np.searchsorted(node_ids, v).astype(np.int32)
+
+        edges = np.arange(len(gdf), dtype=np.int32)
+        src = np.concatenate([ui, vi])
+        dst = np.concatenate([vi, ui])
+        arc_edge = np.concatenate([edges, edges])
+
+        order = np.lexsort((dst, src))
+        src, dst, arc_edge = src[order], dst[order], arc_edge[order]
+        is_new = np.ones(len(src), dtype=bool)
+        is_new[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        pair_start = np.append(np.flatnonzero(is_new), len(src)).astype(np.int32)
+
+        indices = dst[is_new]
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int32)
+        np.cumsum(np.bincount(src[is_new], minlength=len(node_ids)), out=indptr[1:])
+
+        length = gdf["length"].values.astype(np.float32)
+        if "meters_covered" in gdf:
+            meters_covered = gdf["meters_covered"].values.astype(np.float32)
+        else:
+            meters_covered = np.zeros(len(gdf), dtype=np.float32)
+
+        # node coordinates from the line endpoints (lines run from u to v)
+        lines = np.asarray(gdf.to_crs(METRIC_CRS).geometry.values)
+        points = np.concatenate([shapely.get_point(lines, 0), shapely.get_point(lines, -1)])
+        coords = np.empty((len(node_ids), 2))
+        coords[np.concatenate([ui, vi])] = shapely.get_coordinates(points)
+
+        return cls(node_ids, indptr, indices, arc_edge, pair_start, length,
+                   meters_covered, coords[:, 0], coords[:, 1])
+
+    def save(self, path):
+        np.savez(path,
+                 node_ids=self.node_ids,
+                 indptr=self.indptr,
+                 indices=self.indices,
+                 arc_edge=self.arc_edge,
+                 pair_start=self.pair_start,
+                 length=self.length,
+                 meters_covered=self.meters_covered,
+                 x=self.x,
+                 y=self.y)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{k: data[k] for k in data.files})
+
+    @property
+    def n_nodes(self):
+        return len(self.node_ids)
+
+    def node_index(self, node_ids):
+        node_ids = np.asarray(node_ids)
+        index = np.searchsorted(self.node_ids, node_ids)
+        index = np.minimum(index, self.n_nodes - 1)
+        if not np.all(self.node_ids[index] == node_ids):
+            raise KeyError("Node not in network")
+        return index.astype(np.int32)
+
+    def edge_weights(self, alpha=0.0, meters_covered=None):
+        meters_covered = self.meters_covered if meters_covered is None else meters_covered
+        weights = segment_weight(self.length, np.asarray(meters_covered, dtype=np.float32), alpha)
+        return np.maximum(weights, MIN_WEIGHT)
+
+    @property
+    def arc_source(self):
+        """
+        Source node index of every arc (in `arc_edge` order).
+        """
+        entry_source = np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.indptr))
+        return np.repeat(entry_source, np.diff(self.pair_start))
+
+    def pair_weights(self, edge_weights):
+        """
+        Weight of every CSR entry and the edge row it comes from.
+        """
+        return self.reduce_arcs(edge_weights[self.arc_edge])
+
+    def reduce_arcs(self, arc_weights):
+        """
+        Like `pair_weights`, for weights given per arc rather than per edge.
+        """
+        starts = self.pair_start[:-1]
+        weights = np.minimum.reduceat(arc_weights, starts)
+
+        sizes = np.diff(self.pair_start)
+        is_min = arc_weights == np.repeat(weights, sizes)
+        pairs = np.repeat(np.arange(len(starts)), sizes)
+        _, first = np.unique(pairs[is_min], return_index=True)
+        return weights, self.arc_edge[np.flatnonzero(is_min)[first]]
+
+    def matrix(self, weights):
+        return csr_matrix((weights, self.indices, self.indptr), shape=(self.n_nodes, self.n_nodes))
+
+    def pair_index(self, a, b):
+        """
+        CSR entries of the arcs a[i] -> b[i] (node indices).
+        """
+        if self._pair_keys is None:
+            src = np.repeat(np.arange(self.n_nodes, dtype=np.int64), np.diff(self.indptr))
+            self._pair_keys = src * self.n_nodes + self.indices
+        keys = np.asarray(a, dtype=np.int64) * self.n_nodes + np.asarray(b, dtype=np.int64)
+        return np.searchsorted(self._pair_keys, keys)
+
+    def path_nodes(self, predecessors, source, target):
+        path = [target]
+        while path[-1] != source:
+            previous = predecessors[path[-1]]
+            if previous < 0:
+                return None
+            path.append(previous)
+        return np.array(path[::-1], dtype=np.int32)
+
+    def shortest_path(self, source, target, alpha=0.0, meters_covered=None):
+        """
+        Edge rows (in travel order) of the cheapest route between two node
+        ids, weighting edges by `segment_weight` with the given alpha.
+        Returns None if the nodes are not connected.
+        """
+        source, target = self.node_index([source, target])
+        weights, pair_edge = self.pair_weights(self.edge_weights(alpha, meters_covered))
+        _, predecessors = dijkstra(
+            self.matrix(weights), directed=True, indices=source, return_predecessors=True)
+
+        nodes = self.path_nodes(predecessors, source, target)
+        if nodes is None:
+            return None
+        return pair_edge[self.pair_index(nodes[:-1], nodes[1:])]
+
+    def shortest_path_between(self, source, target, alpha=0.0, meters_covered=None):
+        """
+        Like `shortest_path`, between two points on edges instead of two
+        nodes. source and target are (u, v, edge, fraction) of the points,
+        as in the rows of `SnapIndex.nearest_edges`. The route runs from the
+        source point along its edge to the node it leaves by, and from the
+        node it arrives at along the target edge to the target point; the
+        part of an edge costs that fraction of the edge's weight.
+
+        Returns the edge rows in travel order and the stretch travelled of
+        the first and of the last edge, each as (from, to) fractions of the
+        edge from u, or None if the points are not connected.
+        """
+        (source_u, source_v, source_edge, source_at), (target_u, target_v, target_edge, target_at) = source, target
+        source_u, source_v, target_u, target_v = self.node_index([source_u, source_v, target_u, target_v])
+        edge_weights = self.edge_weights(alpha, meters_covered)
+        weights, pair_edge = self.pair_weights(edge_weights)
+
+        # two extra nodes for the points, joined to the ends of their edges
+        start, end = self.n_nodes, self.n_nodes + 1
+        extra = {}
+        for a, b, weight in [
+                (start, source_u, source_at * edge_weights[source_edge]),
+                (start, source_v, (1 - source_at) * edge_weights[source_edge]),
+                (target_u, end, target_at * edge_weights[target_edge]),
+                (target_v, end, (1 - target_at) * edge_weights[target_edge])]:
+            extra[a, b] = min(weight, extra.get((a, b), np.inf))
+        if source_edge == target_edge:
+            extra[start, end] = abs(source_at - target_at) * edge_weights[source_edge]
+
+        (rows, columns), data = zip(*extra.keys()), list(extra.values())
+        entry_source = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+        matrix = csr_matrix(
+            (np.concatenate([weights, data]),
+             (np.concatenate([entry_source, rows]), np.concatenate([self.indices, columns]))),
+            shape=(self.n_nodes + 2, self.n_nodes + 2))
+        _, predecessors = dijkstra(matrix, directed=True, indices=start, return_predecessors=True)
+
+        nodes = self.path_nodes(predecessors, start, end)
+        if nodes is None:
+            return None
+        if len(nodes) == 2:
+            return np.array([source_edge]), (source_at, target_at), (source_at, target_at)
+        nodes = nodes[1:-1]
+        middle = pair_edge[self.pair_index(nodes[:-1], nodes[1:])]
+        head = (source_at, 0.0 if nodes[0] == source_u else 1.0)
+        tail = (0.0 if nodes[-1] == target_u else 1.0, target_at)
+        return np.concatenate([[source_edge], middle, [target_edge]]).astype(np.int64), head, tail
@@ -0,0 +1,269 @@
+import bz2
+import gzip
+from array import array
+from xml.etree.ElementTree import iterparse
+import numpy as np
+import geopandas as gpd
+import shapely
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+try:
+    import osmium
+except ImportError:
+    osmium = None
+
+METRIC_CRS = 25832
+NODE_CHUNK = 1_000_000
+
+ACCESS_RESTRICTED = {"no", "private", "permit", "delivery", "destination", "customers"}
+
+# the osmnx network type filters used by `Network.load_osm`
+DRIVE_EXCLUDED = {"abandoned", "bridleway", "bus_guideway", "construction", "corridor", "cycleway",
+                  "elevator", "escalator", "footway", "path", "pedestrian", "planned", "platform",
+                  "proposed", "raceway", "service", "steps", "track"}
+DRIVE_SERVICE_EXCLUDED = {"alley", "driveway", "emergency_access", "parking", "parking_aisle", "private"}
+BIKE_EXCLUDED = {"abandoned", "bus_guideway", "construction", "corridor", "elevator", "escalator",
+                 "footway", "motor", "planned", "platform", "proposed", "raceway", "steps"}
+WALK_INCLUDED = {"footway", "unclassified", "pedestrian", "living_street", "service", "path"}
+
+
+def _matches(value, words):
+    # osmnx filters are Overpass regexes, which match substrings
+    return value is not None and any(word in value for word in words)
+
+
+def is_drive(tags):
+    return not (_matches(tags.get("highway"), DRIVE_EXCLUDED)
+                or tags.get("area") == "yes"
+                or _matches(tags.get("access"), {"private"})
+                or _matches(tags.get("motor_vehicle"), {"no"})
+                or _matches(tags.get("motorcar"), {"no"})
+                or _matches(tags.get("service"), DRIVE_SERVICE_EXCLUDED))
+
+
+def is_bike(tags):
+    return not (_matches(tags.get("highway"), BIKE_EXCLUDED)
+                or tags.get("area") == "yes"
+                or _matches(tags.get("access"), {"private"})
+                or _matches(tags.get("bicycle"), {"no"})
+                or _matches(tags.get("service"), {"private"}))
+
+
+def is_walk(tags):
+    return _matches(tags.get("highway"), WALK_INCLUDED)
+
+
+def is_routable(tags):
+    """
+    Bike, walk or drive way with public access.
+    """
+    if "highway" not in tags or tags.get("access") in ACCESS_RESTRICTED:
+        return False
+    return is_bike(tags) or is_walk(tags) or is_drive(tags)
+
+
+def is_building(tags):
+    return tags.get("building", "no") != "no"
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _xml_elements(path, tag):
+    with _open(path) as f:
+        context = iterparse(f, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event == "end" and elem.tag in ("node", "way", "relation"):
+                if elem.tag == tag:
+                    yield elem
+                root.clear()
+
+
+def read_ways(path):
+    """
+    Streams (way id, node refs, tags) from an .osm (XML, optionally gzip or
+    bz2 compressed) or, with pyosmium installed, an .osm.pbf file.
+    """
+    if path.endswith(".pbf"):
+        if osmium is None:
+            raise ImportError("Reading .osm.pbf files requires pyosmium (pip install osmium)")
+        for way in osmium.FileProcessor(path, osmium.osm.WAY):
+            yield way.id, [n.ref for n in way.nodes], {t.k: t.v for t in way.tags}
+        return
+    for elem in _xml_elements(path, "way"):
+        refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+        tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+        yield int(elem.get("id")), refs, tags
+
+
+def read_nodes(path):
+    """
+    Streams (node id, lon, lat) from an OSM file.
+    """
+    if path.endswith(".pbf"):
+        if osmium is None:
+            raise ImportError("Reading .osm.pbf files requires pyosmium (pip install osmium)")
+        for node in osmium.FileProcessor(path, osmium.osm.NODE):
+            yield node.id, node.location.lon, node.location.lat
+        return
+    for elem in _xml_elements(path, "node"):
+        yield int(elem.get("id")), float(elem.get("lon")), float(elem.get("lat"))
+
+
+def nodes_in_bbox(path, bbox):
+    """
+    Sorted ids of the nodes inside `bbox` (the `Geometry.bbox` dict); nodes
+    outside it are dropped as they stream past.
+    """
+    inside, ids, lons, lats = [], array("q"), array("d"), array("d")
+
+    def flush():
+        lon, lat = np.frombuffer(lons, dtype=np.float64), np.frombuffer(lats, dtype=np.float64)
+        hit = (lon >= bbox["x_min"]) & (lon <= bbox["x_max"]) & (lat >= bbox["y_min"]) & (lat <= bbox["y_max"])
+        inside.append(np.frombuffer(ids, dtype=np.int64)[hit])
+
+    for node_id, lon, lat in read_nodes(path):
+        ids.append(node_id)
+        lons.append(lon)
+        lats.append(lat)
+        if len(ids) >= NODE_CHUNK:
+            flush()
+            ids, lons, lats = array("q"), array("d"), array("d")
+    flush()
+    return np.unique(np.concatenate(inside))
+
+
+def collect_ways(path, keep, inside=None):
+    """
+    First pass: node refs of the ways whose tags pass `keep`, as flat arrays
+    (way ids, offsets into refs, refs). With `inside` (sorted node ids) ways
+    without a node among them are dropped as they stream past.
+    """
+    way_ids, offsets, refs = array("q"), array("q", [0]), array("q")
+    for way_id, way_refs, tags in read_ways(path):
+        if len(way_refs) >= 2 and keep(tags):
+            if inside is not None:
+                position = np.minimum(np.searchsorted(inside, way_refs), len(inside) - 1)
+                if not len(inside) or not (inside[position] == way_refs).any():
+                    continue
+            way_ids.append(way_id)
+            refs.extend(way_refs)
+            offsets.append(len(refs))
+    return np.frombuffer(way_ids, dtype=np.int64), np.frombuffer(offsets, dtype=np.int64), \
+        np.frombuffer(refs, dtype=np.int64)
+
+
+def node_coordinates(path, node_ids):
+    """
+    Second pass: (lon, lat) of the sorted unique `node_ids`; NaN for nodes
+    missing from the file. Nodes are matched in chunks, so memory is bounded
+    by the nodes that are needed.
+    """
+    coords = np.full((len(node_ids), 2), np.nan)
+    ids, lons, lats = array("q"), array("d"), array("d")
+
+    def flush():
+        chunk = np.frombuffer(ids, dtype=np.int64)
+        position = np.minimum(np.searchsorted(node_ids, chunk), len(node_ids) - 1)
+        found = node_ids[position] == chunk
+        coords[position[found], 0] = np.frombuffer(lons, dtype=np.float64)[found]
+        coords[position[found], 1] = np.frombuffer(lats, dtype=np.float64)[found]
+
+    for node_id, lon, lat in read_nodes(path):
+        ids.append(node_id)
+        lons.append(lon)
+        lats.append(lat)
+        if len(ids) >= NODE_CHUNK:
+            flush()
+            ids, lons, lats = array("q"), array("d"), array("d")
+    if len(ids) and len(node_ids):
+        flush()
+    return coords
+
+
+def way_coordinates(path, refs):
+    node_ids = np.unique(refs)
+    coords = node_coordinates(path, node_ids)
+    return coords[np.searchsorted(node_ids, refs)]
+
+
+def network_edges(path, keep=is_routable, bbox=None, largest_component=True):
+    """
+    Edge GeoDataFrame (u, v, osmid, length, geometry in EPSG:4326) of the
+    routable ways in an OSM extract, read in two streaming passes.
+
+    Ways are split at every node shared with another way and at their ends,
+    so each edge runs between two intersections (or dead ends). Every way
+    segment gives one (undirected) edge. With `bbox` (the `Geometry.bbox`
+    dict) a first pass collects the nodes inside it, only ways with a node
+    inside are read and only edges intersecting it are kept.
+    """
+    inside = nodes_in_bbox(path, bbox) if bbox is not None else None
+    way_ids, offsets, refs = collect_ways(path, keep, inside)
+    coords = way_coordinates(path, refs)
+
+    way_of = np.repeat(np.arange(len(way_ids)), np.diff(offsets))
+    _, inverse, counts = np.unique(refs, return_inverse=True, return_counts=True)
+    split = counts[inverse] > 1
+    split[offsets[:-1]] = True
+    split[offsets[1:] - 1] = True
+
+    starts = np.flatnonzero(split)
+    same_way = way_of[starts[:-1]] == way_of[starts[1:]]
+    first, last = starts[:-1][same_way], starts[1:][same_way]
+
+    sizes = last - first + 1
+    vertex = np.repeat(first - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+    edge_of_vertex = np.repeat(np.arange(len(first)), sizes)
+    complete = np.bincount(edge_of_vertex, np.isnan(coords[vertex, 0]), len(first)) == 0
+    lines = shapely.linestrings(coords[vertex], indices=edge_of_vertex)
+
+    gdf = gpd.GeoDataFrame({
+        "u": refs[first],
+        "v": refs[last],
+        "osmid": way_ids[way_of[first]],
+    }, geometry=lines, crs=4326)[complete]
+    gdf = gdf[gdf["u"] != gdf["v"]]
+
+    if bbox is not None:
+        gdf = gdf[gdf.intersects(shapely.box(bbox["x_min"], bbox["y_min"], bbox["x_max"], bbox["y_max"]))]
+
+    if largest_component and len(gdf):
+        node_ids, index = np.unique(np.concatenate([gdf["u"].values, gdf["v"].values]), return_inverse=True)
+        u, v = index[:len(gdf)], index[len(gdf):]
+        adjacency = coo_matrix((np.ones(len(gdf)), (u, v)), shape=(len(node_ids), len(node_ids)))
+        _, labels = connected_components(adjacency, directed=False)
+        gdf = gdf[labels[u] == np.bincount(labels).argmax()]
+
+    gdf = gdf.reset_index(drop=True)
+    gdf["length"] = gdf.to_crs(METRIC_CRS).length + 0.01
+    return gdf[["u", "v", "osmid", "geometry", "length"]]
+
+
+def building_footprints(path, bbox=None):
+    """
+    Building polygons (closed ways tagged building=*) of an OSM extract,
+    indexed by osmid, in EPSG:4326. Multipolygon relations are not read.
+    With `bbox`, only buildings with a corner inside it are kept.
+    """
+    inside = nodes_in_bbox(path, bbox) if bbox is not None else None
+    way_ids, offsets, refs = collect_ways(path, is_building, inside)
+    closed = (refs[offsets[:-1]] == refs[offsets[1:] - 1]) & (np.diff(offsets) >= 4)
+    coords = way_coordinates(path, refs)
+
+    way_of = np.repeat(np.arange(len(way_ids)), np.diff(offsets))
+    keep = closed[way_of]
+    missing = np.bincount(way_of, np.isnan(coords[:, 0]), len(way_ids)) > 0
+    keep &= ~missing[way_of]
+    ways = np.flatnonzero(closed & ~missing)
+
+    rings = shapely.linearrings(coords[keep], indices=np.searchsorted(ways, way_of[keep]))
+    gdf = gpd.GeoDataFrame({"osmid": way_ids[ways]}, geometry=shapely.polygons(rings), crs=4326)
+    return gdf.set_index("osmid")
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import shapely
+
+METRIC_CRS = 25832
+
+
+def line_segments(lines):
+    """
+    Every straight segment of `lines` as a linestring of its own, with the
+    line it belongs to and the position of its start along that line.
+    """
+    parts, part_owner = shapely.get_parts(lines, return_index=True)
+    coords, part = shapely.get_coordinates(parts, return_index=True)
+    starts = np.flatnonzero(part[:-1] == part[1:])
+    lengths = np.hypot(*(coords[starts + 1] - coords[starts]).T)
+    starts, lengths = starts[lengths > 0], lengths[lengths > 0]
+    owner = part_owner[part[starts]]
+
+    travelled = np.cumsum(lengths) - lengths
+    first = np.r_[True, owner[1:] != owner[:-1]]
+    offset = travelled - travelled[first][np.cumsum(first) - 1]
+    segments = shapely.linestrings(np.stack([coords[starts], coords[starts + 1]], axis=1))
+    return segments, owner, offset
+
+
+def covered_intervals(lines, polygons):
+    """
+    Stretches of `lines` covered by `polygons`, as positions along the line.
+
+    Lines are split into their straight segments first, so a position is
+    never ambiguous, even on closed or self-touching lines. Candidate pairs
+    come from one bulk STRtree query and each segment is only clipped
+    against its own candidates. Returns (line_index, start, end) arrays, one
+    row per covered piece; pieces of different polygons may overlap.
+    """
+    segments, segment_owner, offset = line_segments(lines)
+    tree = shapely.STRtree(polygons)
+    segment_idx, polygon_idx = tree.query(segments, predicate="intersects")
+    if len(segment_idx) == 0:
+        empty = np.array([], dtype=float)
+        return np.array([], dtype=int), empty, empty
+
+    pieces = shapely.intersection(segments[segment_idx], polygons[polygon_idx])
+
+    # flatten multi-part and mixed results down to single linestrings
+    parts, first = shapely.get_parts(pieces, return_index=True)
+    parts, second = shapely.get_parts(parts, return_index=True)
+    segment = segment_idx[first[second]]
+    is_line = shapely.get_type_id(parts) == 1
+    parts, segment = parts[is_line], segment[is_line]
+
+    a = shapely.line_locate_point(segments[segment], shapely.get_point(parts, 0))
+    b = shapely.line_locate_point(segments[segment], shapely.get_point(parts, -1))
+    return segment_owner[segment], offset[segment] + np.minimum(a, b), offset[segment] + np.maximum(a, b)
+
+
+def union_length(owner, start, end, n):
+    """
+    Total length per owner of the union of its [start, end] intervals, so
+    overlapping shadows are only counted once.
+    """
+    covered = np.zeros(n)
+    if len(owner) == 0:
+        return covered
+
+    df = pd.DataFrame({"owner": owner, "start": start, "end": end}).sort_values(["owner", "start"])
+    reached = df.groupby("owner")["end"].cummax()
+    reached_before = reached.groupby(df["owner"]).shift(1).fillna(-np.inf)
+    gain = (df["end"] - np.maximum(df["start"], reached_before)).clip(lower=0)
+    np.add.at(covered, df["owner"].values, gain.values)
+    return covered
+
+
+def meters_covered(edges, shadows):
+    """
+    Length in meters (EPSG:25832) of each edge lying in the union of the
+    shadows. `edges` is a GeoDataFrame/GeoSeries of lines, `shadows` a
+    GeoSeries (or GeoDataFrame) of polygons.
+    """
+    lines = np.asarray(edges.to_crs(METRIC_CRS).geometry.values)
+    polygons = np.asarray(shadows.to_crs(METRIC_CRS).geometry.values)
+    polygons = polygons[~shapely.is_empty(polygons) & ~shapely.is_missing(polygons)]
+    # reprojection can leave slivers self-intersecting
+    invalid = ~shapely.is_valid(polygons)
+    polygons[invalid] = shapely.make_valid(polygons[invalid])
+
+    owner, start, end = covered_intervals(lines, polygons)
+    covered = union_length(owner, start, end, len(lines))
+    return pd.Series(np.minimum(covered, shapely.length(lines)), index=edges.index)
@@ -0,0 +1,91 @@
+import heapq
+from collections import namedtuple
+import numpy as np
+from scipy.sparse.csgraph import dijkstra
+
+ParetoRoute = namedtuple("ParetoRoute", ["length", "exposed", "edges"])
+
+
+def lower_bounds(graph, target, edge_cost):
+    """
+    Cheapest cost from every node to `target` for one per-edge cost.
+    """
+    weights, _ = graph.pair_weights(edge_cost)
+    return dijkstra(graph.matrix(weights), directed=True, indices=target)
+
+
+def pareto_front(graph, source, target, meters_covered=None, epsilon=0.0):
+    """
+    All Pareto-optimal (length, sun-exposed length) routes between two node
+    ids of a `CSRGraph`, found in one bi-objective label-setting search.
+
+    Labels are settled in lexicographic (length, exposed) order of their
+    A* keys, with lower bounds to the target for both objectives, so a label
+    is dominated exactly when its exposure is no better than the last label
+    settled at the same node. With `epsilon` > 0 labels within a factor of
+    (1 + epsilon) in exposure are treated as dominated, which bounds the
+    label sets at the cost of an approximate front.
+
+    Returns a list of `ParetoRoute` sorted by length (shortest first).
+    """
+    source, target = graph.node_index([source, target])
+    meters_covered = graph.meters_covered if meters_covered is None else meters_covered
+    length = graph.length.astype(np.float64)
+    exposed = np.maximum(length - np.asarray(meters_covered, dtype=np.float64), 0)
+
+    length_bound = lower_bounds(graph, target, length)
+    exposed_bound = lower_bounds(graph, target, exposed)
+    if not np.isfinite(length_bound[source]):
+        return []
+
+    factor = 1.0 + epsilon
+    best_exposed = np.full(graph.n_nodes, np.inf)
+    indptr, indices = graph.indptr, graph.indices
+    pair_start, arc_edge = graph.pair_start, graph.arc_edge
+
+    # label i: (node, parent label, edge taken, length, exposed)
+    labels = [(source, -1, -1, 0.0, 0.0)]
+    heap = [(length_bound[source], exposed_bound[source], 0)]
+    front = []
+    while heap:
+        _, _, label = heapq.heappop(heap)
+        node, _, _, label_length, label_exposed = labels[label]
+        if label_exposed * factor >= best_exposed[node]:
+            continue
+        if (label_exposed + exposed_bound[node]) * factor >= best_exposed[target]:
+            continue
+        best_exposed[node] = label_exposed
+        if node == target:
+            front.append(label)
+            continue
+
+        for entry in range(indptr[node], indptr[node + 1]):
+            neighbour = indices[entry]
+            for edge in arc_edge[pair_start[entry]:pair_start[entry + 1]]:
+                next_exposed = label_exposed + exposed[edge]
+                if next_exposed * factor >= best_exposed[neighbour]:
+                    continue
+                next_length = label_length + length[edge]
+                labels.append((neighbour, label, edge, next_length, next_exposed))
+                heapq.heappush(heap, (next_length + length_bound[neighbour],
+                                      next_exposed + exposed_bound[neighbour],
+                                      len(labels) - 1))
+
+    routes = []
+    for label in front:
+        _, _, _, route_length, route_exposed = labels[label]
+        edges = []
+        while labels[label][1] >= 0:
+            edges.append(labels[label][2])
+            label = labels[label][1]
+        routes.append(ParetoRoute(route_length, route_exposed, np.array(edges[::-1], dtype=np.int32)))
+    return routes
+
+
+def route_for_alpha(front, alpha):
+    """
+    The route of a Pareto front minimizing `segment_weight` summed over the
+    route, i.e. (1 - alpha) * length + alpha * exposed.
+    """
+    costs = [(1 - alpha) * route.length + alpha * route.exposed for route in front]
+    return front[int(np.argmin(costs))]
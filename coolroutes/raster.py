@@ -0,0 +1,256 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import rasterio
+from rasterio import features
+from rasterio.windows import Window
+from coolroutes.cache import file_stamp
+
+# strips of striped TIFFs are read and cached in groups of about this size
+STRIP_GROUP_BYTES = 1024**2
+
+
+class BlockCache(object):
+    """
+    LRU cache of decoded raster blocks, bounded by bytes and shared by all
+    readers. Blocks are keyed by ((path, mtime, size), band, block row,
+    block column), so a rewritten file never serves stale blocks.
+    """
+    def __init__(self, max_bytes=512 * 1024**2):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self._blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = block
+            self.bytes += block.nbytes
+            while self.bytes > self.max_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "blocks": len(self._blocks),
+            "bytes": self.bytes,
+        }
+
+
+DEFAULT_CACHE = BlockCache()
+
+
+def byte_order(path):
+    """
+    numpy byte order character of a TIFF file ('<' or '>'), or None.
+    """
+    with open(path, "rb") as f:
+        return {b"II": "<", b"MM": ">"}.get(f.read(2))
+
+
+def contiguous_offset(src, band=1):
+    """
+    File offset of a band stored uncompressed as one contiguous run of
+    strips (so it can be memory-mapped), or None.
+    """
+    if src.compression is not None or src.driver != "GTiff" or src.count != 1:
+        return None
+    block_height, block_width = src.block_shapes[band - 1]
+    if block_width != src.width:
+        return None
+    first = src.get_tag_item("BLOCK_OFFSET_0_0", "TIFF", bidx=band)
+    last_row = (src.height - 1) // block_height
+    last = src.get_tag_item(f"BLOCK_OFFSET_0_{last_row}", "TIFF", bidx=band)
+    if first is None or last is None:
+        return None
+    row_bytes = src.width * np.dtype(src.dtypes[band - 1]).itemsize
+    if int(last) - int(first) != last_row * block_height * row_bytes:
+        return None
+    return int(first)
+
+
+class RasterReader(object):
+    """
+    Read access to one band of a raster through the shared `BlockCache`.
+
+    Windows and points are served from cached blocks, so consumers reading
+    the same area (building heights, tree heights, crown masks) decode each
+    block once. Strips of striped files are grouped into larger blocks. Bulk
+    point sampling groups the points by block. With `mmap`, uncompressed
+    striped GeoTIFFs are memory-mapped instead, in the file's byte order. Reads outside
+    the raster give nodata (NaN for float rasters without nodata).
+    """
+    def __init__(self, path, band=1, cache=None, mmap=False):
+        self.path = path
+        self.band = band
+        self.cache = cache if cache is not None else DEFAULT_CACHE
+        self.src = rasterio.open(path)
+        self.stamp = file_stamp(path) or (path,)
+        self.block_height, self.block_width = self.src.block_shapes[band - 1]
+        self.dtype = np.dtype(self.src.dtypes[band - 1])
+        if self.block_width == self.src.width:
+            # cache groups of strips rather than single (often 1-row) strips
+            strip_bytes = self.block_height * self.src.width * self.dtype.itemsize
+            self.block_height *= max(1, STRIP_GROUP_BYTES // strip_bytes)
+        nodata = self.src.nodatavals[band - 1]
+        if nodata is None and self.dtype.kind == "f":
+            nodata = np.nan
+        self.nodata = nodata
+        self._lock = threading.Lock()
+
+        self.array = None
+        offset = contiguous_offset(self.src, band) if mmap else None
+        order = byte_order(path) if offset is not None else None
+        if order is not None:
+            self.array = np.memmap(path, dtype=self.dtype.newbyteorder(order), mode="r",
+                                   offset=offset, shape=(self.src.height, self.src.width))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.src.close()
+
+    @property
+    def transform(self):
+        return self.src.transform
+
+    @property
+    def crs(self):
+        return self.src.crs
+
+    @property
+    def bounds(self):
+        return self.src.bounds
+
+    @property
+    def meta(self):
+        return self.src.meta
+
+    @property
+    def shape(self):
+        return self.src.height, self.src.width
+
+    def window_transform(self, window):
+        return self.src.window_transform(window)
+
+    def block(self, row, col):
+        key = (self.stamp, self.band, row, col)
+        block = self.cache.get(key)
+        if block is None:
+            window = Window(col * self.block_width, row * self.block_height,
+                            min(self.block_width, self.src.width - col * self.block_width),
+                            min(self.block_height, self.src.height - row * self.block_height))
+            with self._lock:
+                block = self.src.read(self.band, window=window)
+            block.flags.writeable = False
+            self.cache.put(key, block)
+        return block
+
+    def read_window(self, window, masked=False):
+        """
+        Pixels of an integer window, which may extend past the raster.
+        """
+        col_off, row_off = int(window.col_off), int(window.row_off)
+        height, width = int(window.height), int(window.width)
+        fill = 0 if self.nodata is None else self.nodata
+        out = np.full((height, width), fill, dtype=np.result_type(self.dtype, np.min_scalar_type(fill)))
+
+        r0, c0 = max(row_off, 0), max(col_off, 0)
+        r1, c1 = min(row_off + height, self.src.height), min(col_off + width, self.src.width)
+        if r0 < r1 and c0 < c1:
+            if self.array is not None:
+                out[r0 - row_off:r1 - row_off, c0 - col_off:c1 - col_off] = self.array[r0:r1, c0:c1]
+            else:
+                for row in range(r0 // self.block_height, (r1 - 1) // self.block_height + 1):
+                    for col in range(c0 // self.block_width, (c1 - 1) // self.block_width + 1):
+                        block = self.block(row, col)
+                        br, bc = row * self.block_height, col * self.block_width
+                        sr0, sr1 = max(r0, br), min(r1, br + block.shape[0])
+                        sc0, sc1 = max(c0, bc), min(c1, bc + block.shape[1])
+                        out[sr0 - row_off:sr1 - row_off, sc0 - col_off:sc1 - col_off] = \
+                            block[sr0 - br:sr1 - br, sc0 - bc:sc1 - bc]
+        if masked:
+            return np.ma.masked_invalid(out) if self.nodata is None or np.isnan(fill) \
+                else np.ma.masked_equal(out, fill)
+        return out
+
+    def window_from_bounds(self, left, bottom, right, top):
+        """
+        Smallest integer window covering the bounds.
+        """
+        (row_start, col_start) = rasterio.transform.rowcol(self.transform, left, top, op=np.floor)
+        (row_stop, col_stop) = rasterio.transform.rowcol(self.transform, right, bottom, op=np.ceil)
+        return Window(col_start, row_start, max(col_stop - col_start, 1), max(row_stop - row_start, 1))
+
+    def sample(self, xs, ys):
+        """
+        Values at many points (raster CRS), reading each block once.
+        """
+        cols, rows = ~self.transform * (np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64))
+        rows, cols = np.floor(rows).astype(np.int64), np.floor(cols).astype(np.int64)
+        fill = 0 if self.nodata is None else self.nodata
+        values = np.full(len(rows), fill, dtype=np.result_type(self.dtype, np.min_scalar_type(fill)))
+        inside = np.flatnonzero((rows >= 0) & (rows < self.src.height) & (cols >= 0) & (cols < self.src.width))
+        if self.array is not None:
+            values[inside] = self.array[rows[inside], cols[inside]]
+            return values
+
+        block_row, block_col = rows[inside] // self.block_height, cols[inside] // self.block_width
+        block_id = block_row * (self.src.width // self.block_width + 1) + block_col
+        order = np.argsort(block_id, kind="stable")
+        _, first = np.unique(block_id[order], return_index=True)
+        for group in np.split(order, first[1:]):
+            if not len(group):
+                continue
+            row, col = block_row[group[0]], block_col[group[0]]
+            block = self.block(row, col)
+            points = inside[group]
+            values[points] = block[rows[points] - row * self.block_height, cols[points] - col * self.block_width]
+        return values
+
+    def mask(self, shapes, all_touched=False):
+        """
+        Like `rasterio.mask.mask(..., crop=True, filled=False)` for one band:
+        the masked pixels of the window covering `shapes` (within the
+        raster), and its transform.
+        """
+        bounds = np.array([shape.bounds for shape in shapes])
+        window = self.window_from_bounds(bounds[:, 0].min(), bounds[:, 1].min(),
+                                         bounds[:, 2].max(), bounds[:, 3].max())
+        window = window.intersection(Window(0, 0, self.src.width, self.src.height))
+        transform = self.window_transform(window)
+        data = self.read_window(window, masked=True)
+        outside = features.geometry_mask(shapes, data.shape, transform, all_touched=all_touched)
+        return np.ma.array(data, mask=np.ma.getmaskarray(data) | outside), transform
+
+
+def open_raster(path, band=1, cache=None, mmap=False):
+    return RasterReader(path, band, cache, mmap)
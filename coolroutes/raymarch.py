@@ -0,0 +1,137 @@
+import math
+import numpy as np
+import rasterio
+from rasterio import Affine
+from rasterio.enums import Resampling
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+from coolroutes import sun
+
+
+def shift(array, rows, cols, fill=-np.inf):
+    """
+    `array` moved by (rows, cols) pixels, so that result[i, j] == array[i + rows, j + cols].
+    """
+    out = np.full_like(array, fill)
+    h, w = array.shape
+    if abs(rows) >= h or abs(cols) >= w:
+        return out
+    out[max(0, -rows):h - max(0, rows), max(0, -cols):w - max(0, cols)] = \
+        array[max(0, rows):h - max(0, -rows), max(0, cols):w - max(0, -cols)]
+    return out
+
+
+def shade_mask(surface, azimuth, altitude, cell_size, max_rise=None):
+    """
+    Boolean shade of a surface model (e.g. the DSM) for one sun position.
+
+    Every pixel marches towards the sun one pixel at a time (along the
+    dominant axis) and is shaded if any surface sample rises above the sun
+    ray. All pixels march together, so each step is one array operation.
+    Marching stops once the ray is higher than the largest height
+    difference in the array, capped at `max_rise` meters.
+    """
+    surface = np.where(np.isnan(surface), -np.inf, surface).astype(np.float32)
+    valid = np.isfinite(surface)
+    if not valid.any():
+        return np.zeros(surface.shape, dtype=bool)
+
+    # direction towards the sun in (row, col), rows growing southwards
+    d_row, d_col = math.cos(azimuth), -math.sin(azimuth)
+    step = 1 / max(abs(d_row), abs(d_col))
+    rise_per_step = math.tan(altitude) * cell_size * step
+
+    rise = float(surface[valid].max() - surface[valid].min())
+    if max_rise is not None:
+        rise = min(rise, max_rise)
+    n_steps = int(math.ceil(rise / rise_per_step))
+
+    horizon = np.full(surface.shape, -np.inf, dtype=np.float32)
+    for k in range(1, n_steps + 1):
+        rows = int(round(k * step * d_row))
+        cols = int(round(k * step * d_col))
+        np.maximum(horizon, shift(surface, rows, cols) - k * rise_per_step, out=horizon)
+    return (horizon > surface) & valid
+
+
+def block_mean(array, factor):
+    h, w = array.shape
+    return array.reshape(h // factor, factor, w // factor, factor).mean(axis=(1, 3))
+
+
+def shade_raster(dsm_path, output_path, azimuth, altitude, resolution=None,
+                 oversample=1, block_size=1024, max_height=100.0,
+                 resampling=Resampling.average):
+    """
+    Writes the shade of the surface model at `dsm_path` to `output_path`.
+
+    The DSM is processed in windowed blocks, each read with a halo wide
+    enough for `max_height` meters of occluder to cast into the block.
+    `resolution` (meters) resamples the DSM; with `oversample` > 1 shade is
+    computed on a finer grid and averaged, giving a float32 shade fraction
+    per output pixel instead of a 0/1 mask.
+    """
+    with rasterio.open(dsm_path) as src:
+        resolution = resolution if resolution else src.res[0]
+        cell_size = resolution / oversample
+        scale = cell_size / src.res[0]
+
+        width = int(math.ceil(src.width / scale))
+        height = int(math.ceil(src.height / scale))
+        halo = int(math.ceil(max_height / math.tan(altitude) / cell_size)) + 1
+        block = block_size * oversample
+
+        profile = src.profile.copy()
+        profile.update({
+            "driver": "GTiff",
+            "count": 1,
+            "width": int(math.ceil(width / oversample)),
+            "height": int(math.ceil(height / oversample)),
+            "transform": src.transform * Affine.scale(resolution / src.res[0]),
+            "dtype": "float32" if oversample > 1 else "uint8",
+            "nodata": None,
+            "tiled": True,
+            "blockxsize": 256,
+            "blockysize": 256,
+            "compress": "deflate",
+        })
+
+        with rasterio.open(output_path, "w", **profile) as dst:
+            for row in range(0, height, block):
+                for col in range(0, width, block):
+                    h = min(block, height - row)
+                    w = min(block, width - col)
+                    h, w = -(-h // oversample) * oversample, -(-w // oversample) * oversample
+
+                    window = Window(
+                        (col - halo) * scale, (row - halo) * scale,
+                        (w + 2 * halo) * scale, (h + 2 * halo) * scale)
+                    surface = src.read(
+                        1, window=window,
+                        out_shape=(h + 2 * halo, w + 2 * halo),
+                        boundless=True, masked=True,
+                        resampling=resampling)
+                    surface = surface.astype(np.float32).filled(np.nan)
+
+                    mask = shade_mask(surface, azimuth, altitude, cell_size, max_rise=max_height)
+                    mask = mask[halo:halo + h, halo:halo + w]
+
+                    if oversample > 1:
+                        data = block_mean(mask.astype(np.float32), oversample)
+                    else:
+                        data = mask.astype(np.uint8)
+
+                    out_window = Window(col // oversample, row // oversample, data.shape[1], data.shape[0])
+                    out_window = out_window.intersection(Window(0, 0, profile["width"], profile["height"]))
+                    dst.write(data[:out_window.height, :out_window.width], 1, window=out_window)
+    return output_path
+
+
+def shade_raster_at(dsm_path, output_path, date, **kwargs):
+    """
+    `shade_raster` for the sun position at `date` over the raster centre.
+    """
+    with rasterio.open(dsm_path) as src:
+        left, bottom, right, top = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+    azimuth, altitude = sun.position(date, (left + right) / 2, (bottom + top) / 2)
+    return shade_raster(dsm_path, output_path, azimuth, altitude, **kwargs)
@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+import numpy as np
+from shapely.geometry import Point
+from coolroutes import geometry
+from coolroutes.cache import RouteCache
+
+LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)  # ms
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class LatencyHistogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, ms):
+        self.counts[np.searchsorted(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def as_dict(self):
+        labels = [f"<={b}" for b in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "buckets_ms": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else None,
+            "max_ms": self.max,
+        }
+
+
+def parse_point(value):
+    try:
+        lon, lat = (float(x) for x in value.split(","))
+    except ValueError:
+        raise HTTPError(400, f"Invalid point '{value}', expected lon,lat")
+    return Point(lon, lat)
+
+
+def _float_or_none(values):
+    return [None if np.isnan(x) else float(x) for x in values]
+
+
+class RoutingService(object):
+    """
+    Serves routes from a warm `Network` (graph, snap index and shade table
+    loaded once). Searches run on a bounded thread pool; identical requests
+    that arrive while one is being computed share its result, and requests
+    beyond `max_pending` are turned away with a 503. Latencies are kept per
+    endpoint as histograms and published at /metrics.
+
+    Endpoints (points are lon,lat in WGS84; `time` is an hour, a shade bin
+    label or a timestamp, `alpha` the shade weight):
+        GET  /route?from=..&to=..&alpha=..&time=..
+        POST /batch-route  {"pairs": [[[lon, lat], [lon, lat]], ...], "alpha": .., "time": ..}
+        GET  /snap?point=..[&point=..]
+        GET  /metrics
+    """
+    def __init__(self, network, workers=4, max_pending=64):
+        self.network = network
+        self.pool = ThreadPoolExecutor(workers)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.coalesced = 0
+        self.inflight = {}
+        self.histograms = {}
+        self._covered = {}
+
+    def warm(self):
+        """
+        Builds everything the network would otherwise build lazily (graph,
+        snap index, version hash, shade profile), so the worker threads only
+        read shared state.
+        """
+        network = self.network
+        network.get_graph().pair_index([0], [0])
+        network.get_snap_index()
+        network.get_version()
+        if network.shade is not None:
+            network.get_shade_profile()
+        return self
+
+    def check_time(self, when):
+        if when is not None and self.network.shade is None:
+            raise HTTPError(400, "no shade table loaded")
+
+    def meters_covered(self, when):
+        if when is None or self.network.shade is None:
+            return None
+        key = str(when)
+        covered = self._covered.get(key)
+        if covered is None:
+            covered = np.asarray(self.network.get_meters_covered(when), dtype=np.float32)
+            if len(self._covered) >= 32:
+                self._covered.clear()
+            self._covered[key] = covered
+        return covered
+
+    # -- searches (run on the pool) ------------------------------------
+
+    def route(self, start, end, alpha, when):
+        nodes = self.network.get_snap_index().snap_to_node([start, end], crs=4326)
+        edges = self.network.get_route_edges(nodes[0], nodes[1], alpha, when)
+        if edges is None:
+            raise HTTPError(404, "No route between given points")
+        route = self.network.gdf.iloc[edges].to_crs(4326)
+        covered = self.meters_covered(when)
+        # without a time, the graph's meters covered (zero without a shade column)
+        covered = self.network.get_graph().meters_covered[edges] if covered is None else covered[edges]
+        return {
+            "length": float(route["length"].sum()),
+            "meters_covered": float(np.sum(covered)),
+            "route": json.loads(route[["u", "v", "length", "geometry"]].to_json()),
+        }
+
+    def batch_route(self, pairs, alpha, when):
+        points = [parse_point(f"{p[0]},{p[1]}") for pair in pairs for p in pair]
+        nodes = self.network.get_snap_index().snap_to_node(points, crs=4326)
+        length, covered = self.network.get_routes(np.stack([nodes[::2], nodes[1::2]], axis=1), alpha, when)
+        return {"length": _float_or_none(length), "meters_covered": _float_or_none(covered)}
+
+    def snap(self, points):
+        snapped = self.network.get_snap_index().nearest_edges(points, crs=4326)
+        nodes = np.where(snapped["fraction"] <= 0.5, snapped["u"], snapped["v"])
+        return [{"node": int(node), "u": int(row.u), "v": int(row.v),
+                 "osmid": str(row.osmid), "distance": float(row.distance)}
+                for node, row in zip(nodes, snapped.itertuples())]
+
+    # -- request handling --------------------------------------------
+
+    async def submit(self, key, function, *args):
+        """
+        Runs `function` on the pool, or joins the identical request already
+        running.
+        """
+        if key in self.inflight:
+            self.coalesced += 1
+            return await asyncio.shield(self.inflight[key])
+        if self.pending >= self.max_pending:
+            raise HTTPError(503, "Too many pending requests")
+        self.pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self.pool, function, *args)
+        self.inflight[key] = future
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if self.inflight.get(key) is future:
+                del self.inflight[key]
+            self.pending -= 1
+
+    async def dispatch(self, method, path, query, body):
+        params = dict(query)
+        alpha = float(params.get("alpha", 0.0))
+        when = params.get("time")
+        key = (path, tuple(sorted(query)), body)
+
+        if path == "/route":
+            if "from" not in params or "to" not in params:
+                raise HTTPError(400, "'from' and 'to' are required")
+            self.check_time(when)
+            # route and report meters covered at the same (bucketed) hour
+            when = self.network.time_bucket(when)
+            return await self.submit(key, self.route, parse_point(params["from"]),
+                                     parse_point(params["to"]), alpha, when)
+        if path == "/batch-route":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            try:
+                request = json.loads(body)
+                pairs = request["pairs"]
+            except (ValueError, KeyError):
+                raise HTTPError(400, "Expected a JSON body with 'pairs'")
+            when = request.get("time", when)
+            self.check_time(when)
+            when = self.network.time_bucket(when)
+            return await self.submit(key, self.batch_route, pairs, float(request.get("alpha", alpha)), when)
+        if path == "/snap":
+            points = [parse_point(value) for name, value in query if name == "point"]
+            if not points:
+                raise HTTPError(400, "'point' is required")
+            return await self.submit(key, self.snap, points)
+        if path == "/metrics":
+            return {
+                "pending": self.pending,
+                "coalesced": self.coalesced,
+                "route_cache": self.network.route_cache.stats() if self.network.route_cache else None,
+                "latency": {name: h.as_dict() for name, h in self.histograms.items()},
+            }
+        raise HTTPError(404, f"Unknown endpoint {path}")
+
+    async def handle(self, reader, writer):
+        started = time.perf_counter()
+        path = None
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            if len(request_line) != 3:
+                raise HTTPError(400, "Malformed request line")
+            method, target, _ = request_line
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            url = urlsplit(target)
+            path = url.path.rstrip("/") or "/"
+            status, payload = 200, await self.dispatch(method, path, parse_qsl(url.query), body)
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except (ValueError, KeyError) as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": repr(e)}
+
+        data = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+        if path is not None and path != "/metrics":
+            self.histograms.setdefault(path, LatencyHistogram()).observe(
+                (time.perf_counter() - started) * 1000)
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local shade routing service")
+    parser.add_argument("--network", default="./data/cph/sidewalks.geojson")
+    parser.add_argument("--shade", default=None, help="ShadeMatrix directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-pending", type=int, default=64)
+    args = parser.parse_args()
+
+    network = geometry.Network(route_cache=RouteCache()).load_geojson(args.network)
+    if args.shade:
+        network.load_shade(args.shade)
+    service = RoutingService(network, args.workers, args.max_pending).warm()
+    print(f"Serving on http://{args.host}:{args.port}")
+    asyncio.run(service.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import json
+import os
+import numpy as np
+
+SOURCES = ["total", "tree"]
+
+
+class ShadeMatrix(object):
+    """
+    Meters covered per edge, time bin and shade source, stored as a float32
+    array of shape (edges, times, sources) in `shade.npy` and memory-mapped
+    on load. Edges are indexed by (u, v, osmid) in `edges.npy` (along with
+    their length), time bins and sources are listed in `meta.json`.
+    """
+    def __init__(self, path, mode="r"):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.times = meta["times"]
+        self.sources = meta["sources"]
+        self.data = np.load(os.path.join(path, "shade.npy"), mmap_mode=mode)
+        self.edges = np.load(os.path.join(path, "edges.npy"), mmap_mode="r")
+        self._lookup = None
+
+    @classmethod
+    def create(cls, path, edges, times, sources=SOURCES):
+        """
+        Allocates an empty (zero) matrix for the edges of a network GeoDataFrame.
+        """
+        os.makedirs(path, exist_ok=True)
+        times = [str(t) for t in times]
+        osmid = np.array([str(x) for x in edges["osmid"]])
+        index = np.empty(len(edges), dtype=[
+            ("u", "i8"), ("v", "i8"), ("osmid", osmid.dtype), ("length", "f8")])
+        index["u"] = edges["u"].values
+        index["v"] = edges["v"].values
+        index["osmid"] = osmid
+        index["length"] = edges["length"].values if "length" in edges else np.nan
+        np.save(os.path.join(path, "edges.npy"), index)
+
+        np.lib.format.open_memmap(
+            os.path.join(path, "shade.npy"), mode="w+", dtype=np.float32,
+            shape=(len(edges), len(times), len(sources))).flush()
+
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"times": times, "sources": list(sources)}, f)
+        return cls(path, mode="r+")
+
+    @classmethod
+    def from_dict_columns(cls, path, gdf, times, sources=SOURCES):
+        """
+        Converts the per-hour dict columns written by earlier versions of
+        `experiments/tod_calculations.py` ({'total': ..., 'tree': ...}).
+        """
+        matrix = cls.create(path, gdf, times, sources)
+        for time in matrix.times:
+            values = gdf[time].apply(lambda x: json.loads(x) if isinstance(x, str) else x)
+            for source in matrix.sources:
+                matrix.write(time, source, values.apply(lambda x: x[source]).values)
+        matrix.flush()
+        return matrix
+
+    def _position(self, time, source):
+        return self.times.index(str(time)), self.sources.index(source)
+
+    def column(self, time, source="total"):
+        """
+        Meters covered of all edges for one time bin, as a view into the map.
+        """
+        t, s = self._position(time, source)
+        return self.data[:, t, s]
+
+    def write(self, time, source, values):
+        t, s = self._position(time, source)
+        self.data[:, t, s] = values
+
+    def flush(self):
+        self.data.flush()
+
+    def check_edges(self, edges):
+        """
+        Raises a ValueError unless the rows are the edges of a network
+        GeoDataFrame, in its order.
+        """
+        same = len(edges) == len(self.edges) \
+            and np.array_equal(edges["u"].values, self.edges["u"]) \
+            and np.array_equal(edges["v"].values, self.edges["v"]) \
+            and np.array_equal([str(x) for x in edges["osmid"]], self.edges["osmid"])
+        if not same:
+            raise ValueError(f"Shade matrix {self.path} does not match the network edges (u, v, osmid)")
+
+    def row(self, u, v, osmid):
+        if self._lookup is None:
+            keys = zip(self.edges["u"].tolist(), self.edges["v"].tolist(), self.edges["osmid"].tolist())
+            self._lookup = {key: i for i, key in enumerate(keys)}
+        return self._lookup[(u, v, str(osmid))]
+
+    def profile(self, u, v, osmid, source="total"):
+        """
+        Meters covered of one edge over all time bins.
+        """
+        return self.data[self.row(u, v, osmid), :, self.sources.index(source)]
@@ -0,0 +1,365 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+import pandas as pd
+import pybdshadow
+import geopandas as gpd
+import shapely
+
+TRUNK_RADIUS = 0.3
+TRUNK_SEGMENTS = 16 # trunk outline segments per quarter circle, as in Trees.tree_shade
+TREE_CHUNK = 16384 # trees outlined at a time
+
+
+def sun_offset(azimuth, altitude):
+    """
+    Translation (dx, dy) of a shadow cast by an object 1 m high.
+    """
+    distance = 1 / math.tan(altitude)
+    return np.array([distance * math.sin(azimuth), distance * math.cos(azimuth)])
+
+
+def cross(a, b):
+    return a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+
+
+def dot(a, b):
+    return a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1]
+
+
+def ring_neighbours(counts):
+    """
+    For rings of `counts` vertices stored one after the other: the ring of
+    every vertex, the first vertex of every ring and the next and previous
+    vertex of every vertex along its ring.
+    """
+    ring = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    position = np.arange(len(ring)) - starts[ring]
+    following = starts[ring] + (position + 1) % counts[ring]
+    preceding = starts[ring] + (position - 1) % counts[ring]
+    return ring, starts, following, preceding
+
+
+def first_minimum(values, ring, starts):
+    """
+    Smallest value of every ring and the first vertex holding it.
+    """
+    smallest = np.minimum.reduceat(values, starts)
+    hits = np.flatnonzero(values == smallest[ring])
+    return smallest, hits[np.diff(ring[hits], prepend=-1) != 0]
+
+
+def translate(geometries, offsets):
+    """
+    Copies of geometries, each moved by its own (dx, dy).
+    """
+    coords, index = shapely.get_coordinates(geometries, return_index=True)
+    return shapely.set_coordinates(np.array(geometries, dtype=object), coords + offsets[index])
+
+
+def crown_rings(crowns, shrink):
+    """
+    Vertices of simple crown polygons and of their inner trees, the crowns
+    buffered inwards by `shrink`.
+
+    Returns the crown vertices counterclockwise without the closing one, the
+    matching inner tree vertices, the crown of every vertex, the outward
+    normals of the edges before and after every vertex, the crown centroids
+    and a mask of the crowns the inner trees are exact for. Inwards, a convex
+    polygon's buffer has every edge moved in by the distance, so each vertex
+    moves along its corner bisector; this holds while no edge shrinks away.
+    """
+    counts = shapely.get_num_coordinates(crowns) - 1
+    coords = np.delete(shapely.get_coordinates(crowns), np.cumsum(counts + 1) - 1, axis=0)
+    ring, starts, following, preceding = ring_neighbours(counts)
+
+    # shoelace area and centroid, relative to each ring's first vertex
+    local = coords - coords[starts][ring]
+    terms = cross(local, local[following])
+    area = np.add.reduceat(terms, starts) / 2
+    centroids = coords[starts] + np.add.reduceat((local + local[following]) * terms[:, None], starts) / (6 * area[:, None])
+
+    position = np.arange(len(coords)) - starts[ring]
+    coords = coords[np.where(area[ring] < 0, starts[ring] + counts[ring] - 1 - position, np.arange(len(coords)))]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        edges = coords[following] - coords
+        edges /= np.linalg.norm(edges, axis=1)[:, None]
+        after = np.column_stack([edges[:, 1], -edges[:, 0]])
+        before = after[preceding]
+        bisectors = (before + after) / (1 + dot(before, after))[:, None]
+    inner = coords - shrink[ring, None] * bisectors
+
+    valid = np.isfinite(inner).all(axis=1)
+    valid &= cross(edges[preceding], edges) >= -1e-9
+    valid &= dot(inner[following] - inner, edges) > 0
+    return coords, inner, ring, before, after, centroids, np.logical_and.reduceat(valid, starts)
+
+
+def layer_hulls(layers, before, after, tolerance=1e-6):
+    """
+    Hull of three translated copies of a convex counterclockwise ring.
+
+    layers: (m, 3, 2) every ring vertex in each copy
+    before, after: (m, 2) outward normals of the edges around every vertex
+
+    Vertex i of every copy supports its copy in the directions between the
+    normals of its two edges, so there the hull runs through whichever copy
+    of vertex i reaches furthest. Two copies swap the lead at most once in
+    those directions: the hull passes the copy leading at the first
+    direction, the third copy if it leads where those two swap, and the copy
+    leading at the last direction. Returns the hull vertices in order and the
+    ring vertex each came from.
+    """
+    rows = np.arange(len(layers))
+
+    def leader(normal, turn):
+        # leading copy at `normal`, ties going to the one leading once turned towards `turn`
+        reach = dot(layers, normal[:, None])
+        tied = reach >= reach.max(axis=1)[:, None] - tolerance
+        return np.where(tied, dot(layers, turn[:, None]), -np.inf).argmax(axis=1)
+
+    first = leader(before, np.column_stack([-before[:, 1], before[:, 0]]))
+    last = leader(after, np.column_stack([after[:, 1], -after[:, 0]]))
+    third = np.where(first != last, 3 - first - last, first)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        swap = layers[rows, first] - layers[rows, last]
+        swap = np.column_stack([-swap[:, 1], swap[:, 0]]) / np.linalg.norm(swap, axis=1)[:, None]
+    reach = dot(layers, swap[:, None])
+    passes = reach[rows, third] > reach[rows, first] + tolerance
+
+    # vertices between collinear edges add nothing to the hull
+    corner = cross(before, after) > 1e-12
+    copies = np.column_stack([first, third, last])
+    keep = np.column_stack([corner, corner & (first != last) & passes, corner & (first != last)])
+    vertex, step = np.nonzero(keep)
+    return layers[vertex, copies[vertex, step]], vertex
+
+
+def trunk_unions(rings, counts, bases, tips, radius=TRUNK_RADIUS):
+    """
+    Unions of convex counterclockwise rings with trunks, the segments from
+    base to tip buffered by radius.
+
+    When the tip disc lies inside the ring and the base disc outside it, the
+    two sides of the trunk each leave the ring through one edge; the union
+    swaps the stretch of ring between them for the trunk's sides and base
+    cap. Returns the union rings and counts, and a mask of the rings where
+    the trunk lies any other way, which are returned unchanged.
+    """
+    ring, starts, following, _ = ring_neighbours(counts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        edges = rings[following] - rings
+        edges /= np.linalg.norm(edges, axis=1)[:, None]
+        axis = bases - tips
+        axis /= np.linalg.norm(axis, axis=1)[:, None]
+    inward = np.column_stack([-edges[:, 1], edges[:, 0]])
+    side = np.column_stack([-axis[:, 1], axis[:, 0]])
+
+    def depth(points):
+        return np.minimum.reduceat(dot(inward, points[ring] - rings), starts)
+    tip_inside = depth(tips) >= radius
+    base_depth = depth(bases)
+    protruding = tip_inside & (base_depth < -radius)
+    unresolved = ~(tip_inside & (base_depth >= radius)) & ~protruding
+
+    approach = dot(inward, axis[ring])
+    crossings = []
+    for sign in (1, -1):
+        start = tips + sign * radius * side
+        with np.errstate(invalid="ignore", divide="ignore"):
+            reach = np.where(approach < 0, dot(inward, start[ring] - rings) / -approach, np.inf)
+        distance, edge = first_minimum(reach, ring, starts)
+        crossings.append((start + distance[:, None] * axis, edge - starts))
+    (left, left_edge), (right, right_edge) = crossings
+
+    # left crossing, ring vertices up to the right crossing, right crossing, cap
+    kept = np.where(protruding, (right_edge - left_edge - 1) % counts + 1, 0)
+    cap = np.linspace(-np.pi / 2, np.pi / 2, 2 * TRUNK_SEGMENTS + 1)
+    sizes = np.where(protruding, kept + 2 + len(cap), counts)
+    offsets = np.cumsum(sizes) - sizes
+    result = np.empty((sizes.sum(), 2))
+
+    plain = ~protruding[ring]
+    result[(offsets - starts)[ring[plain]] + np.flatnonzero(plain)] = rings[plain]
+
+    rows = np.flatnonzero(protruding)
+    result[offsets[rows]] = left[rows]
+    owner = np.repeat(rows, kept[rows])
+    step = np.arange(len(owner)) - np.repeat(np.cumsum(kept[rows]) - kept[rows], kept[rows])
+    result[offsets[owner] + 1 + step] = rings[starts[owner] + (left_edge[owner] + 1 + step) % counts[owner]]
+    result[offsets[rows] + 1 + kept[rows]] = right[rows]
+    outline = bases[rows, None] + (radius * np.column_stack([np.cos(cap), np.sin(cap)])) @ np.stack(
+        [axis[rows], side[rows]], axis=1)
+    result[((offsets[rows] + 2 + kept[rows])[:, None] + np.arange(len(cap))).ravel()] = outline.reshape(-1, 2)
+    return result, sizes, unresolved
+
+
+def tree_shadows(crowns, height, crown_ratio, azimuth, altitude):
+    """
+    Batched equivalent of `Trees.tree_shade`.
+
+    crowns is an array of crown polygons, height and crown_ratio 1D arrays,
+    all in a metric CRS (EPSG:3857 for `Trees`). Convex crowns are worked
+    out on their vertices: the inner tree along the corner bisectors, the
+    hull of the crown layers and the union with the trunk. Anything else
+    goes through shapely, like `tree_shade`.
+    """
+    crowns = np.asarray(crowns, dtype=object)
+    height = np.asarray(height, dtype=float)
+    crown_ratio = np.asarray(crown_ratio, dtype=float)
+    n = len(crowns)
+
+    # inner tree is the crown shrunk by 0.2 * distance from bbox centre to corner
+    bounds = shapely.bounds(crowns)
+    shrink = 0.1 * np.hypot(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+    unit = sun_offset(azimuth, altitude)
+    top, middle, bottom = (h[:, None] * unit for h in (
+        height, (1 - crown_ratio / 2) * height, (1 - crown_ratio) * height))
+
+    simple = np.flatnonzero((shapely.get_type_id(crowns) == 3)
+                            & (shapely.get_num_interior_rings(crowns) == 0)
+                            & (shapely.area(crowns) > 0))
+    outline, inner, ring, before, after, centroids, convex = crown_rings(crowns[simple], shrink[simple])
+    base = np.empty((n, 2))
+    base[simple] = centroids
+    exact = convex[ring]
+    tree = simple[ring[exact]]
+    layers = np.stack([outline[exact] + middle[tree], inner[exact] + top[tree], inner[exact] + bottom[tree]], axis=1)
+    hulls, vertex = layer_hulls(layers, before[exact], after[exact])
+
+    hulled = simple[convex]
+    counts = np.bincount(tree[vertex], minlength=n)[hulled]
+    rings, counts, unresolved = trunk_unions(hulls, counts, base[hulled], base[hulled] + top[hulled])
+    shades = np.empty(n, dtype=object)
+    shades[hulled] = shapely.from_ragged_array(
+        shapely.GeometryType.POLYGON, rings, (np.r_[0, np.cumsum(counts)], np.arange(len(hulled) + 1)))
+
+    # any other crown shape goes through shapely, like tree_shade
+    other = np.setdiff1d(np.arange(n), hulled)
+    if len(other):
+        base[other] = shapely.get_coordinates(shapely.centroid(crowns[other]))
+        inner_trees = shapely.buffer(crowns[other], -shrink[other], quad_segs=16)
+        shades[other] = shapely.convex_hull(shapely.union(shapely.union(
+            translate(inner_trees, top[other]),
+            translate(crowns[other], middle[other])),
+            translate(inner_trees, bottom[other])))
+
+    rows = np.union1d(hulled[unresolved], other)
+    if len(rows):
+        trunks = shapely.buffer(
+            shapely.linestrings(np.stack([base[rows], base[rows] + top[rows]], axis=1)),
+            TRUNK_RADIUS, quad_segs=TRUNK_SEGMENTS)
+        shades[rows] = shapely.union(shades[rows], trunks)
+    return shades
+
+
+def trees_shadows(gdf, azimuth, altitude):
+    """
+    Shadows for a GeoDataFrame of tree crowns (as produced by `Trees`).
+    """
+    crowns = gdf.geometry.values
+    shades = [
+        tree_shadows(
+            crowns[chunk],
+            gdf.height.values[chunk],
+            gdf.crown_ratio.values[chunk],
+            azimuth,
+            altitude)
+        for chunk in (slice(start, start + TREE_CHUNK) for start in range(0, len(gdf), TREE_CHUNK))
+    ]
+    shades = np.concatenate(shades) if shades else np.empty(0, dtype=object)
+    return gpd.GeoSeries(shades, index=gdf.index, crs=gdf.crs)
+
+
+def building_shadows(gdf, azimuth, altitude, height="height"):
+    """
+    Ground shadows of extruded building footprints for a given sun position.
+
+    Same result as `pybdshadow.bdshadow_sunlight` (roof=False,
+    include_building=True), which derives the sun position from a date
+    instead. Expects a `building_id` column and polygon footprints in WGS84.
+    """
+    gdf = gdf[gdf[height] > 0]
+    if gdf.empty:
+        return gpd.GeoDataFrame({
+            "building_id": pd.Series(dtype=object),
+            "geometry": gpd.GeoSeries(),
+            "height": pd.Series(dtype=int),
+            "type": pd.Series(dtype=object),
+        }, geometry="geometry")
+    rings = [np.asarray(geom.exterior.coords)[:, :2] for geom in gdf.geometry]
+    counts = np.array([len(ring) - 1 for ring in rings])
+
+    # every ring vertex except the closing one starts a wall
+    coords = np.concatenate(rings)
+    is_start = np.ones(len(coords), dtype=bool)
+    is_start[np.cumsum(counts + 1) - 1] = False
+    wall_starts = np.flatnonzero(is_start)
+    walls = np.stack([coords[wall_starts], coords[wall_starts + 1]], axis=1)
+
+    wall_heights = np.repeat(gdf[height].values, counts)
+    sun_position = {"azimuth": azimuth, "altitude": altitude}
+    quads = pybdshadow.calSunShadow_vector(walls, wall_heights, sun_position)
+
+    parts = gpd.GeoDataFrame({
+        "building_id": np.concatenate([np.repeat(gdf.building_id.values, counts), gdf.building_id.values]),
+        "geometry": np.concatenate([shapely.polygons(quads), np.array(gdf.geometry.values, dtype=object)]),
+    }, geometry="geometry")
+
+    ground_shadow = parts.dissolve(by="building_id").reset_index()
+    ground_shadow["height"] = 0
+    ground_shadow["type"] = "ground"
+    return ground_shadow
+
+
+def morton_order(x, y, bits=16):
+    """
+    Permutation sorting points along a Z-order curve, so that consecutive
+    points are spatially close.
+    """
+    def quantize(v):
+        span = v.max() - v.min()
+        scaled = (v - v.min()) / span if span > 0 else np.zeros_like(v)
+        return (scaled * ((1 << bits) - 1)).astype(np.uint64)
+
+    def spread(v):
+        code = np.zeros_like(v)
+        for bit in range(bits):
+            code |= ((v >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        return code
+
+    codes = spread(quantize(np.asarray(x, dtype=float))) | (spread(quantize(np.asarray(y, dtype=float))) << np.uint64(1))
+    return np.argsort(codes, kind="stable")
+
+
+def spatial_chunks(gdf, n_chunks):
+    minx, miny, maxx, maxy = gdf.bounds.values.T
+    order = morton_order((minx + maxx) / 2, (miny + maxy) / 2)
+    return [gdf.iloc[part] for part in np.array_split(order, n_chunks) if len(part)]
+
+
+def building_shadows_parallel(gdf, azimuth, altitude, processes=None, chunks_per_process=4, height="height"):
+    """
+    `building_shadows` over spatially coherent chunks of the footprints,
+    projected across a process pool and concatenated again. Each chunk is
+    projected around its own centre, which moves vertices by well under a
+    centimetre compared to a single-process run.
+    """
+    processes = processes if processes else os.cpu_count()
+    # chunks without a building of positive height cast no shadow
+    chunks = [chunk for chunk in spatial_chunks(gdf, processes * chunks_per_process)
+              if (chunk[height] > 0).any()]
+    if not chunks:
+        return building_shadows(gdf, azimuth, altitude, height)
+    with ProcessPoolExecutor(processes) as pool:
+        parts = list(pool.map(
+            building_shadows,
+            chunks,
+            repeat(azimuth),
+            repeat(altitude),
+            repeat(height)))
+    return gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), geometry="geometry")
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+METRIC_CRS = 25832
+
+
+class SnapIndex(object):
+    """
+    Nearest edge / nearest node lookups for a network GeoDataFrame (columns
+    u, v, osmid, geometry with lines running from u to v). Built once per
+    loaded network; queries go through STRtrees in EPSG:25832.
+    """
+    def __init__(self, gdf):
+        self.gdf = gdf
+        self.crs = gdf.crs
+        self.lines = np.asarray(gdf.to_crs(METRIC_CRS).geometry.values)
+        self.edge_tree = shapely.STRtree(self.lines)
+
+        starts = shapely.get_point(self.lines, 0)
+        ends = shapely.get_point(self.lines, -1)
+        node_ids = np.concatenate([gdf["u"].values, gdf["v"].values])
+        node_points = np.concatenate([starts, ends])
+        self.node_ids, first = np.unique(node_ids, return_index=True)
+        self.node_points = node_points[first]
+        self.node_tree = shapely.STRtree(self.node_points)
+
+    def _to_metric(self, points, crs=None):
+        points = gpd.GeoSeries(points, crs=crs if crs else self.crs)
+        return np.asarray(points.to_crs(METRIC_CRS).values)
+
+    def nearest_edges(self, points, crs=None):
+        """
+        Snaps points (in the network CRS unless `crs` is given) onto their
+        nearest edge. Returns one row per point with the edge row in the
+        GeoDataFrame, its (u, v, osmid), the distance to it, and the
+        projected position along the edge in meters from u (`position`), as
+        a fraction of its length and as a point in EPSG:25832.
+        """
+        points = self._to_metric(points, crs)
+        (point_idx, edge_idx), distance = self.edge_tree.query_nearest(
+            points, return_distance=True, all_matches=False)
+
+        order = np.argsort(point_idx)
+        edge_idx, distance = edge_idx[order], distance[order]
+        lines = self.lines[edge_idx]
+        position = shapely.line_locate_point(lines, points)
+        length = shapely.length(lines)
+
+        edges = self.gdf.iloc[edge_idx]
+        return pd.DataFrame({
+            "edge": edge_idx,
+            "u": edges["u"].values,
+            "v": edges["v"].values,
+            "osmid": edges["osmid"].values,
+            "distance": distance,
+            "position": position,
+            "fraction": np.divide(position, length, out=np.zeros_like(position), where=length > 0),
+            "point": shapely.line_interpolate_point(lines, position),
+        })
+
+    def nearest_edge(self, point, crs=None):
+        return self.nearest_edges([point], crs).iloc[0]
+
+    def nearest_nodes(self, points, crs=None):
+        """
+        Node ids of the closest network nodes, and the distances to them.
+        """
+        points = self._to_metric(points, crs)
+        (point_idx, node_idx), distance = self.node_tree.query_nearest(
+            points, return_distance=True, all_matches=False)
+        order = np.argsort(point_idx)
+        return self.node_ids[node_idx[order]], distance[order]
+
+    def nearest_node(self, point, crs=None):
+        nodes, _ = self.nearest_nodes([point], crs)
+        return nodes[0]
+
+    def snap_to_node(self, points, crs=None):
+        """
+        Snaps onto the nearest edge and returns the edge endpoint closer
+        along that edge.
+        """
+        snapped = self.nearest_edges(points, crs)
+        return np.where(snapped["fraction"] <= 0.5, snapped["u"], snapped["v"])
@@ -0,0 +1,62 @@
+import math
+import numpy as np
+from suncalc import get_position
+
+
+def angular_distance(azimuth1, altitude1, azimuth2, altitude2):
+    """
+    Great-circle distance between two sun positions (radians in, radians out).
+    """
+    h = (np.sin((altitude2 - altitude1) / 2) ** 2
+         + np.cos(altitude1) * np.cos(altitude2) * np.sin((azimuth2 - azimuth1) / 2) ** 2)
+    return 2 * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+class SunLattice(object):
+    """
+    Regular (azimuth, altitude) grid that sun positions are snapped onto,
+    so shadows can be computed once per cell and reused for every timestamp
+    falling into it. Steps are given in degrees.
+    """
+    def __init__(self, azimuth_step=2.0, altitude_step=1.0):
+        self.azimuth_step = math.radians(azimuth_step)
+        self.altitude_step = math.radians(altitude_step)
+
+    def cell(self, azimuth, altitude):
+        return (int(math.floor(azimuth / self.azimuth_step)),
+                int(math.floor(altitude / self.altitude_step)))
+
+    def center(self, cell):
+        i, j = cell
+        return (i + 0.5) * self.azimuth_step, (j + 0.5) * self.altitude_step
+
+    def snap(self, azimuth, altitude):
+        """
+        Returns the cell, its centre (azimuth, altitude) and the angular error
+        in degrees introduced by using the centre instead of the exact position.
+        """
+        cell = self.cell(azimuth, altitude)
+        cell_azimuth, cell_altitude = self.center(cell)
+        error = angular_distance(azimuth, altitude, cell_azimuth, cell_altitude)
+        return cell, cell_azimuth, cell_altitude, math.degrees(error)
+
+    @property
+    def error_bound(self):
+        """
+        Largest angular error (degrees) of any snapped position. Cells are
+        widest at the horizon, so the bound is the half-diagonal of the
+        lowest cell.
+        """
+        return math.degrees(angular_distance(
+            0, self.altitude_step / 2,
+            self.azimuth_step / 2, 0))
+
+
+def position(date, lon, lat):
+    """
+    Sun (azimuth, altitude) in radians, as used throughout `coolroutes`.
+    """
+    sun_position = get_position(date, lon, lat)
+    if sun_position["altitude"] < 0:
+        raise ValueError("Given time before sunrise or after sunset")
+    return sun_position["azimuth"], sun_position["altitude"]
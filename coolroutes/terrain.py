@@ -1,39 +1,155 @@
 import glob
+import json
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import rasterio
-from rasterio.merge import merge
-
-def merge_files(dirpath, search_criteria):
-    q = os.path.join(dirpath, search_criteria)
-
-    files = glob.glob(q)
-    rasters = [rasterio.open(file) for file in files]
-    dest_raster, transform = merge(rasters) # adjust output resolution
-
-    meta = rasters[0].meta.copy()
-    meta.update({
-        "driver": "GTiff",
-        "height": dest_raster.shape[1],
-        "width": dest_raster.shape[2],
-        "transform": transform,
-        })
-    
-    return dest_raster, meta
-
-def save_geotiff():
-    dsm_raster, dsm_meta = merge_files(r"./data/DHM/DSM_617_72_TIF_UTM32-ETRS89",  "DSM*.tif")
-    dtm_raster, dtm_meta = merge_files(r"./data/DHM/DTM_617_72_TIF_UTM32-ETRS89",  "DTM*.tif")
-
-    with rasterio.open(r"./data/GeoTIFF/DSM.tiff", "w", **dsm_meta) as f:
-        f.write(dsm_raster)
-
-    with rasterio.open(r"./data/GeoTIFF/DTM.tiff", "w", **dtm_meta) as f:
-        f.write(dtm_raster)
-
-    if dsm_meta == dtm_meta:
-        chm_raster = dsm_raster - dtm_raster
-        chm_meta = dsm_meta
-        with rasterio.open(r"./data/GeoTIFF/CHM.tif", "w", **chm_meta) as f:
-            f.write(chm_raster)
-    else:
-        raise Exception("Unmatching metadata of subtracted files")   
\ No newline at end of file
+import rasterio.shutil
+from rasterio.windows import Window
+from coolroutes.cache import file_stamp
+
+BLOCK_SIZE = 512
+NODATA = -9999.0
+
+def tile_key(path):
+    """
+    Tile id shared by the DSM and DTM tile of a cell, e.g. '1km_6174_726'.
+    """
+    return re.sub(r"^(DSM|DTM)_", "", os.path.splitext(os.path.basename(path))[0])
+
+def paired_tiles(dsm_dir, dtm_dir, pattern="*.tif"):
+    dsm = {tile_key(p): p for p in glob.glob(os.path.join(dsm_dir, "DSM" + pattern))}
+    dtm = {tile_key(p): p for p in glob.glob(os.path.join(dtm_dir, "DTM" + pattern))}
+    return {key: (dsm[key], dtm[key]) for key in sorted(dsm.keys() & dtm.keys())}
+
+def mosaic_grid(paths):
+    """
+    Output grid (transform, width, height, crs, resolution) covering the
+    tiles, read from their headers only.
+    """
+    bounds, res, crs = [], None, None
+    for path in paths:
+        with rasterio.open(path) as src:
+            bounds.append(src.bounds)
+            res = res or src.res
+            crs = crs or src.crs
+    bounds = np.array(bounds)
+    left, top = bounds[:, 0].min(), bounds[:, 3].max()
+    width = int(round((bounds[:, 2].max() - left) / res[0]))
+    height = int(round((top - bounds[:, 1].min()) / res[1]))
+    transform = rasterio.transform.from_origin(left, top, res[0], res[1])
+    return transform, width, height, crs, res
+
+def tile_blocks(dsm_path, dtm_path, transform, block_size=BLOCK_SIZE):
+    """
+    Block windows of a tile, with their offset in the output grid.
+    """
+    with rasterio.open(dsm_path) as dsm, rasterio.open(dtm_path) as dtm:
+        if dsm.transform != dtm.transform or dsm.shape != dtm.shape:
+            raise Exception("Unmatching metadata of subtracted files")
+        col, row = ~transform * (dsm.bounds.left, dsm.bounds.top)
+        if abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6:
+            raise Exception("Tile is not aligned with the mosaic grid")
+        col, row = int(round(col)), int(round(row))
+        return [(Window(c, r, min(block_size, dsm.width - c), min(block_size, dsm.height - r)),
+                 Window(col + c, row + r, min(block_size, dsm.width - c), min(block_size, dsm.height - r)))
+                for r in range(0, dsm.height, block_size) for c in range(0, dsm.width, block_size)]
+
+def read_block(job):
+    """
+    DSM, DTM and CHM (DSM - DTM) for one block of a tile, NODATA where
+    either input has no data.
+    """
+    dsm_path, dtm_path, window, target = job
+    with rasterio.open(dsm_path) as dsm, rasterio.open(dtm_path) as dtm:
+        dsm_block = dsm.read(1, window=window, masked=True).astype(np.float32)
+        dtm_block = dtm.read(1, window=window, masked=True).astype(np.float32)
+    chm_block = dsm_block - dtm_block
+    return target, [block.filled(NODATA) for block in (dsm_block, dtm_block, chm_block)]
+
+def open_outputs(paths, grid, update):
+    transform, width, height, crs, _ = grid
+    profile = {
+        "driver": "GTiff", "width": width, "height": height, "count": 1,
+        "dtype": "float32", "crs": crs, "transform": transform, "nodata": NODATA,
+        "tiled": True, "blockxsize": BLOCK_SIZE, "blockysize": BLOCK_SIZE,
+        "compress": "deflate", "predictor": 3, "BIGTIFF": "IF_SAFER", "SPARSE_OK": True,
+    }
+    if update:
+        return [rasterio.open(path, "r+") for path in paths]
+    for path in paths:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return [rasterio.open(path, "w", **profile) for path in paths]
+
+def write_blocks(files, results):
+    for target, blocks in results:
+        for f, block in zip(files, blocks):
+            f.write(block, 1, window=target)
+
+def build_terrain(dsm_dir, dtm_dir, dsm_path, dtm_path, chm_path, manifest_path=None,
+                  processes=None, block_size=BLOCK_SIZE, cog=False, force=False):
+    """
+    Writes the DSM and DTM mosaics and CHM = DSM - DTM of paired 1 km tiles
+    block by block, so memory depends on the block size and not the city.
+
+    Blocks are read and differenced on a process pool and written by this
+    process into tiled GeoTIFFs. A manifest of input file stamps lets
+    later runs rewrite only the tiles whose DSM or DTM changed, as long as
+    the set of tiles (and so the grid) is the same. With `cog`, the outputs
+    are also copied to cloud optimized GeoTIFFs next to them (*.cog.tif).
+    Returns the keys of the tiles that were (re)built.
+    """
+    tiles = paired_tiles(dsm_dir, dtm_dir)
+    if not tiles:
+        raise FileNotFoundError(f"No paired DSM/DTM tiles in {dsm_dir} and {dtm_dir}")
+    manifest_path = manifest_path or os.path.splitext(chm_path)[0] + ".manifest.json"
+    outputs = [dsm_path, dtm_path, chm_path]
+
+    # as lists, to compare equal to the manifest read back from JSON
+    stamps = {key: [list(file_stamp(dsm)), list(file_stamp(dtm))] for key, (dsm, dtm) in tiles.items()}
+    previous = {}
+    if not force and os.path.exists(manifest_path) and all(map(os.path.exists, outputs)):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+    update = bool(previous) and set(previous["tiles"]) == set(stamps)
+    changed = [key for key in tiles if not update or previous["tiles"][key] != stamps[key]]
+    if not changed:
+        return []
+
+    grid = mosaic_grid([dsm for dsm, _ in tiles.values()])
+    jobs = [(tiles[key][0], tiles[key][1], window, target)
+            for key in changed for window, target in tile_blocks(*tiles[key], grid[0], block_size)]
+
+    files = open_outputs(outputs, grid, update)
+    try:
+        if processes == 1:
+            write_blocks(files, map(read_block, jobs))
+        else:
+            processes = processes if processes else os.cpu_count()
+            # submit a bounded number of blocks at a time to bound memory
+            batch = 4 * processes
+            with ProcessPoolExecutor(processes) as pool:
+                for start in range(0, len(jobs), batch):
+                    write_blocks(files, pool.map(read_block, jobs[start:start + batch]))
+    finally:
+        for f in files:
+            f.close()
+
+    with open(manifest_path, "w") as f:
+        json.dump({"tiles": stamps}, f)
+
+    if cog:
+        for path in outputs:
+            rasterio.shutil.copy(path, os.path.splitext(path)[0] + ".cog.tif", driver="COG", compress="deflate")
+    return changed
+
+def save_geotiff(processes=None, force=False):
+    return build_terrain(
+        r"./data/DHM/DSM_617_72_TIF_UTM32-ETRS89",
+        r"./data/DHM/DTM_617_72_TIF_UTM32-ETRS89",
+        r"./data/GeoTIFF/DSM.tiff",
+        r"./data/GeoTIFF/DTM.tiff",
+        r"./data/GeoTIFF/CHM.tif",
+        processes=processes,
+        force=force)
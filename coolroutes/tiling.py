@@ -0,0 +1,130 @@
+import math
+import os
+from collections import namedtuple
+import geopandas as gpd
+from shapely.geometry import box
+from coolroutes import sun
+
+METRIC_CRS = 25832
+
+Tile = namedtuple("Tile", ["row", "col", "core"])
+
+
+def bbox_to_metric(bbox):
+    corners = gpd.GeoSeries(
+        [box(bbox["x_min"], bbox["y_min"], bbox["x_max"], bbox["y_max"])], crs=4326)
+    return corners.to_crs(METRIC_CRS).total_bounds
+
+
+def tile_grid(bbox, tile_size=2000):
+    """
+    Cuts a WGS84 bbox (as in `Geometry.bbox`) into square tiles of
+    `tile_size` meters in EPSG:25832.
+    """
+    minx, miny, maxx, maxy = bbox_to_metric(bbox)
+    cols = max(1, math.ceil((maxx - minx) / tile_size))
+    rows = max(1, math.ceil((maxy - miny) / tile_size))
+    return [
+        Tile(row, col, box(
+            minx + col * tile_size,
+            miny + row * tile_size,
+            minx + (col + 1) * tile_size,
+            miny + (row + 1) * tile_size))
+        for row in range(rows) for col in range(cols)
+    ]
+
+
+def halo_margin(max_height, altitude, extra=0.0):
+    """
+    Distance (meters) a shadow can reach beyond the object casting it.
+    `extra` covers the footprint size, e.g. the largest crown radius.
+    """
+    return max_height / math.tan(altitude) + extra
+
+
+def owned(gdf, tile):
+    """
+    Mask of objects whose bbox centre falls into the tile core. Intervals
+    are half-open, so every object is owned by exactly one tile.
+    """
+    minx, miny, maxx, maxy = gdf.to_crs(METRIC_CRS).bounds.values.T
+    x, y = (minx + maxx) / 2, (miny + maxy) / 2
+    tx0, ty0, tx1, ty1 = tile.core.bounds
+    return (x >= tx0) & (x < tx1) & (y >= ty0) & (y < ty1)
+
+
+class TiledShadows(object):
+    """
+    Streams shadow computation for `Trees` or `Buildings` over a tiled bbox,
+    so only one tile (plus its halo) is held in memory at a time.
+
+    Objects are read straight from `path` with a bbox filter. Every tile
+    loads all objects within the halo margin around its core, so shadows
+    cast across tile edges are complete within the core.
+    """
+    def __init__(self, geometry_cls, path, bbox=None, tile_size=2000, cache=None):
+        self.geometry_cls = geometry_cls
+        self.path = path
+        self.bbox = geometry_cls(bbox).bbox
+        self.tile_size = tile_size
+        self.cache = cache
+
+    def sun_position(self, date):
+        lon = (self.bbox["x_min"] + self.bbox["x_max"]) / 2
+        lat = (self.bbox["y_min"] + self.bbox["y_max"]) / 2
+        return sun.position(date, lon, lat)
+
+    def max_height(self):
+        heights = gpd.read_file(self.path, columns=["height"], ignore_geometry=True)
+        return float(heights["height"].max())
+
+    def load_tile(self, tile, margin):
+        halo = gpd.GeoSeries([tile.core.buffer(margin, join_style=2)], crs=METRIC_CRS)
+        crs = gpd.read_file(self.path, rows=0).crs
+        # feature ids as index keep ids (e.g. building_id) stable across tiles
+        return gpd.read_file(self.path, bbox=tuple(halo.to_crs(crs).total_bounds), fid_as_index=True)
+
+    def iter_shadows(self, date, max_height=None, extra=50.0, clip=False, **params):
+        """
+        Yields (tile, shadows) per tile. By default only shadows of objects
+        owned by the tile are returned, so shadows crossing a seam appear
+        once. With `clip=True` shadows of all objects in the halo are cut to
+        the tile core instead, which partitions the shade between tiles.
+        """
+        azimuth, altitude = self.sun_position(date)
+        max_height = max_height if max_height is not None else self.max_height()
+        margin = halo_margin(max_height, altitude, extra)
+
+        for tile in tile_grid(self.bbox, self.tile_size):
+            gdf = self.load_tile(tile, margin)
+            if not clip:
+                gdf = gdf[owned(gdf, tile)]
+            if gdf.empty:
+                continue
+
+            geometry = self.geometry_cls(self.bbox, self.cache)
+            geometry.gdf = gdf
+            geometry.azimuth, geometry.altitude = azimuth, altitude
+            shadows = geometry.cached_shadows(lambda: geometry.compute_shadows(**params), **params)
+
+            if clip:
+                core = gpd.GeoSeries([tile.core], crs=METRIC_CRS).to_crs(shadows.crs).iloc[0]
+                shadows = shadows.clip(core)
+                shadows = shadows[~shadows.is_empty]
+            shadows = shadows.assign(tile=f"{tile.row}_{tile.col}")
+            yield tile, shadows
+
+    def save(self, output_path, date, **kwargs):
+        """
+        Writes shadows tile by tile into a single layer at `output_path`
+        (GeoPackage), appending as tiles finish.
+        """
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        n = 0
+        for _, shadows in self.iter_shadows(date, **kwargs):
+            shadows = shadows.reset_index(drop=True)
+            shadows.to_file(output_path, driver="GPKG", mode="a" if os.path.exists(output_path) else "w")
+            n += len(shadows)
+        return n
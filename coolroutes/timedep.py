@@ -0,0 +1,117 @@
+import heapq
+import numpy as np
+import pandas as pd
+from coolroutes.graph import segment_weight, MIN_WEIGHT
+
+CYCLING_SPEED = 4.5  # m/s, about 16 km/h
+
+
+def hour_of_day(time):
+    """
+    Hours since midnight (float) for a timestamp, a number of hours or a
+    time bin label such as '13' or '13:30'.
+    """
+    if isinstance(time, (int, float, np.number)):
+        return float(time)
+    if isinstance(time, str) and len(time) <= 5:
+        hours, _, minutes = time.partition(":")
+        return int(hours) + int(minutes or 0) / 60
+    time = pd.Timestamp(time)
+    return time.hour + time.minute / 60 + time.second / 3600
+
+
+class ShadeProfile(object):
+    """
+    Per-edge shaded fraction over the time bins of a `ShadeMatrix`, kept
+    in memory and linearly interpolated between bins. Times outside the
+    table take the value of the first / last bin.
+    """
+    def __init__(self, hours, fraction):
+        self.hours = np.asarray(hours, dtype=np.float64)
+        self.fraction = fraction
+
+    @classmethod
+    def from_matrix(cls, shade, source="total"):
+        hours = [hour_of_day(t) for t in shade.times]
+        order = np.argsort(hours)
+        length = np.asarray(shade.edges["length"], dtype=np.float32)
+        covered = np.asarray(shade.data[:, :, shade.sources.index(source)])[:, order]
+        fraction = np.divide(covered, length[:, None], out=np.zeros_like(covered),
+                             where=length[:, None] > 0)
+        return cls(np.asarray(hours)[order], np.clip(fraction, 0, 1))
+
+    def at(self, edges, hours):
+        """
+        Shaded fraction of edges[i] at hours[i].
+        """
+        hours = np.clip(hours, self.hours[0], self.hours[-1])
+        right = np.clip(np.searchsorted(self.hours, hours, side="right"), 1, len(self.hours) - 1)
+        left = right - 1
+        span = self.hours[right] - self.hours[left]
+        t = np.divide(hours - self.hours[left], span, out=np.zeros_like(hours), where=span > 0)
+        a = self.fraction[edges, left]
+        b = self.fraction[edges, right]
+        return a + (b - a) * t
+
+
+def time_dependent_route(graph, profile, source, target, departure, alpha=0.0,
+                         speed=CYCLING_SPEED):
+    """
+    Cheapest route between two node ids of a `CSRGraph` when the shade on
+    each edge is taken at the time the rider enters it, leaving at
+    `departure` and riding at `speed` (m/s).
+
+    A label-setting search: every label carries the time its path reaches
+    the node, and the arcs leaving a settled node are weighted with the
+    shade interpolated at that time. Travel times do not depend on shade, so
+    arrival times are FIFO and every route's weights are taken at its own
+    times. Only the cheapest label per node is kept, though, so a dearer
+    path that would reach a node at a shadier time is not followed further:
+    the route is exact for its own timing, but not guaranteed to be the
+    cheapest of all time-dependent routes.
+
+    Returns (edge rows, entry hour of each edge), or None if unreachable.
+    """
+    source, target = graph.node_index([source, target])
+    start = hour_of_day(departure)
+    length = graph.length.astype(np.float64)
+    indptr, pair_start, arc_edge = graph.indptr, graph.pair_start, graph.arc_edge
+    arc_target = np.repeat(graph.indices, np.diff(pair_start))
+
+    cost = [np.inf] * graph.n_nodes
+    ridden = [0.0] * graph.n_nodes
+    parent = [-1] * graph.n_nodes
+    parent_edge = [-1] * graph.n_nodes
+    settled = [False] * graph.n_nodes
+    cost[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        label, node = heapq.heappop(heap)
+        if settled[node]:
+            continue
+        settled[node] = True
+        if node == target:
+            break
+
+        arcs = slice(pair_start[indptr[node]], pair_start[indptr[node + 1]])
+        edges = arc_edge[arcs]
+        hour = start + ridden[node] / speed / 3600
+        covered = length[edges] * profile.at(edges, np.full(len(edges), hour))
+        weights = np.maximum(segment_weight(length[edges], covered, alpha), MIN_WEIGHT)
+        for edge, neighbour, weight in zip(edges.tolist(), arc_target[arcs].tolist(), weights.tolist()):
+            if label + weight < cost[neighbour] and not settled[neighbour]:
+                cost[neighbour] = label + weight
+                ridden[neighbour] = ridden[node] + length[edge]
+                parent[neighbour] = node
+                parent_edge[neighbour] = edge
+                heapq.heappush(heap, (label + weight, neighbour))
+
+    if not settled[target]:
+        return None
+    route, node = [], target
+    while node != source:
+        route.append(parent_edge[node])
+        node = parent[node]
+    route = np.array(route[::-1], dtype=np.int32)
+    entry = np.concatenate([[0.0], np.cumsum(length[route])[:-1]])
+    return route, start + entry / speed / 3600
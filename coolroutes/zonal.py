@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import shapely
+from rasterio import features, windows
+from rasterio.errors import WindowError
+from coolroutes.raster import open_raster
+
+BLOCK_SIZE = 2048
+
+
+def group_percentiles(labels, values, n_labels, percentiles):
+    """
+    Percentiles (numpy's linear interpolation) of `values` per label in
+    0..n_labels-1, in one sort. Labels without values get NaN.
+    """
+    order = np.lexsort((values, labels))
+    values = values[order]
+    counts = np.bincount(labels, minlength=n_labels)
+    starts = np.cumsum(counts) - counts
+    has = counts > 0
+
+    result = np.full((n_labels, len(percentiles)), np.nan)
+    for i, q in enumerate(percentiles):
+        position = starts[has] + (counts[has] - 1) * q / 100
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        weight = position - lower
+        result[has, i] = values[lower] * (1 - weight) + values[upper] * weight
+    return result
+
+
+def zonal_percentiles(raster_path, gdf, percentiles=(50,), block_size=BLOCK_SIZE):
+    """
+    Percentiles of the raster values inside each polygon of `gdf`, as a
+    DataFrame with one column per percentile, aligned with `gdf`.
+
+    Polygons are grouped by the raster block holding their centroid. Each
+    group is rasterized into a label raster over the window covering its
+    polygons, and the window is read once through the shared block cache.
+    Pixels are assigned by centre (a pixel under overlapping polygons goes
+    to the later one). Polygons that cover no pixel centre take the value
+    at their representative point. Nodata and NaN pixels are ignored.
+    """
+    with open_raster(raster_path) as src:
+        geoms = np.asarray(gdf.to_crs(src.crs).geometry.values)
+        bounds = shapely.bounds(geoms)
+        inverse = ~src.transform
+        cols, rows = inverse * shapely.get_coordinates(shapely.centroid(geoms)).T
+        height, width = src.shape
+        block = (np.floor(rows / block_size).astype(np.int64) * (width // block_size + 1)
+                 + np.floor(cols / block_size).astype(np.int64))
+
+        full = windows.Window(0, 0, width, height)
+        result = np.full((len(geoms), len(percentiles)), np.nan)
+        order = np.argsort(block, kind="stable")
+        _, first = np.unique(block[order], return_index=True)
+        for members in np.split(order, first[1:]):
+            left, bottom = bounds[members, :2].min(axis=0)
+            right, top = bounds[members, 2:].max(axis=0)
+            window = src.window_from_bounds(left, bottom, right, top)
+            try:
+                window = window.intersection(full)
+            except WindowError:
+                continue
+
+            transform = src.window_transform(window)
+            data = src.read_window(window, masked=True).astype(np.float64).filled(np.nan)
+            labels = features.rasterize(
+                zip(geoms[members], range(1, len(members) + 1)),
+                out_shape=data.shape, transform=transform, fill=0, dtype="int32")
+
+            valid = (labels > 0) & ~np.isnan(data)
+            values = group_percentiles(labels[valid] - 1, data[valid], len(members), percentiles)
+
+            # polygons smaller than a pixel: value under the representative point
+            empty = np.isnan(values[:, 0])
+            if empty.any():
+                points = shapely.get_coordinates(shapely.point_on_surface(geoms[members[empty]]))
+                c, r = ~transform * points.T
+                r = np.clip(np.floor(r).astype(np.int64), 0, data.shape[0] - 1)
+                c = np.clip(np.floor(c).astype(np.int64), 0, data.shape[1] - 1)
+                values[empty] = data[r, c][:, None]
+            result[members] = values
+
+    return pd.DataFrame(result, index=gdf.index, columns=list(percentiles))
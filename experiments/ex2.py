@@ -7,9 +7,9 @@ import seaborn as sns
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FormatStrFormatter
+from coolroutes.shadematrix import ShadeMatrix
 
-sidewalks = gpd.read_file('./data/backup/sidewalks_small.geojson')
-sidewalks = gpd.read_file('./data/backup/sidewalks_hourly_06_18_01072022.geojson')
+shade = ShadeMatrix('./data/backup/sidewalks_shade_01072022')
 
 hours = ['{:02d}'.format(num) for num in range(6, 19)]
 
@@ -18,9 +18,9 @@ tree_shade_percentages = []
 building_shade_percentages = []
 
 for h in hours:
-    tree = sidewalks[h].apply(lambda x: x['tree'], 1)
-    total = sidewalks[h].apply(lambda x: x['total'], 1)
-    total_length = sidewalks['length'].sum()
+    tree = shade.column(h, 'tree')
+    total = shade.column(h, 'total')
+    total_length = shade.edges['length'].sum()
 
     total_percent = total.sum()/total_length
     total_shade_percentages.append(total_percent*100)
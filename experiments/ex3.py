@@ -8,27 +8,29 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FormatStrFormatter
 import networkx as nx
+from coolroutes.shadematrix import ShadeMatrix
+from coolroutes.graph import CSRGraph
+from coolroutes import batch
 
 import importlib
 importlib.reload(routing)
 
 small = gpd.read_file('./data/backup/sidewalks_small.geojson')
-sidewalks = gpd.read_file('./data/backup/sidewalks_hourly_06_18_01072022.geojson')
+sidewalks = gpd.read_file('./data/cph/sidewalks.geojson')
+shade = ShadeMatrix('./data/backup/sidewalks_shade_01072022')
 nodes = list(pd.concat([sidewalks['u'], sidewalks['v']]).unique())
 
 sidewalk_segments = geometries.get_sidewalk_segments(small)
 
 
-def get_routes(sidewalks_gdf, endpoints, hour='06', alpha=0.0):
-    sidewalks_weighted = sidewalks_gdf
-    sidewalks_weighted['meters_covered'] = sidewalks_gdf[hour].apply(lambda x: x['total'], 1)
-    G = nx.from_pandas_edgelist(sidewalks_weighted.reset_index(), 'u', 'v', edge_attr=True, edge_key='osmid')
-    routes = []
-    for i, (start_point, end_point) in enumerate(endpoints):
-        print(i)
-        route = routing.route(G, start_point, end_point, alpha)
-        routes.append(route)
-    return routes
+graph = CSRGraph.from_gdf(sidewalks)
+
+
+def get_routes(endpoints, hour='06', alpha=0.0, processes=1):
+    origins, destinations = np.array(endpoints).T
+    length, covered = batch.route_pairs(graph, origins, destinations, alpha,
+                                        shade.column(hour, 'total'), processes)
+    return list(zip(length, covered))
 
 
 # ----------------------------------------------------------------
@@ -38,8 +40,7 @@ hours = ['{:02d}'.format(num) for num in range(6, 19)]
 mean_shade_cover = []
 for hour in hours:
     print(f'Hour: {hour}')
-    routes = get_routes(sidewalks, endpoints, hour, 0.0)
-    length_list = [(r['length'].sum(), r['meters_covered'].sum()) for r in routes]
+    length_list = get_routes(endpoints, hour, 0.0)
     sc = np.array([cover/length*100 for length, cover in length_list]).mean()
     print("Mean length")
     print(np.array([length for length, cover in length_list]).mean())
@@ -76,8 +77,7 @@ stats = {'09': {'mean_shade_cover': [], 'mean_length': []},
 for hour in ['09', '13', '17']:
     for alpha in alphas:
         print(f'Alpha: {alpha}')
-        routes = get_routes(sidewalks, endpoints, hour, alpha)
-        length_list = [(r['length'].sum(), r['meters_covered'].sum()) for r in routes]
+        length_list = get_routes(endpoints, hour, alpha)
         shade_coverage = np.array([cover/length*100 for length, cover in length_list]).mean()
         mean_length = np.array([length for length, cover in length_list]).mean()
         stats[hour]['mean_shade_cover'].append(shade_coverage)
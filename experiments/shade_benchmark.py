@@ -0,0 +1,69 @@
+import sys
+sys.path.append('..')
+import time
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.features import rasterize
+from rasterio.warp import transform_bounds
+from coolroutes import geometry, raymarch, sun
+
+# -----------------------------------------------
+# Polygon path (pybdshadow-style buildings + tree crowns)
+# vs. raster ray marching over the DSM
+# -----------------------------------------------
+
+dsm_path = "./data/GeoTIFF/DSM.tiff"
+timestamp = pd.Timestamp('2022-07-01 15:00:00')
+resolution = 1.0 # meters
+
+with rasterio.open(dsm_path) as src:
+    left, bottom, right, top = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+    dsm_crs = src.crs
+
+bbox = {"y_min": bottom, "y_max": top, "x_max": right, "x_min": left}
+azimuth, altitude = sun.position(timestamp, (left + right) / 2, (bottom + top) / 2)
+
+# -----------------------------------------------
+# Raster path
+# -----------------------------------------------
+
+t0 = time.time()
+raymarch.shade_raster(dsm_path, "./data/GeoTIFF/shade.tif", azimuth, altitude, resolution=resolution)
+raster_seconds = time.time() - t0
+
+with rasterio.open("./data/GeoTIFF/shade.tif") as src:
+    raster_shade = src.read(1).astype(bool)
+    shape, transform = src.shape, src.transform
+
+# -----------------------------------------------
+# Polygon path
+# -----------------------------------------------
+
+t0 = time.time()
+buildings = geometry.Buildings(bbox).load_geojson(None)
+trees = geometry.Trees(bbox).load_geojson(None)
+for g in (buildings, trees):
+    g.azimuth, g.altitude = azimuth, altitude
+shadows = pd.concat([
+    buildings.compute_shadows().geometry,
+    trees.compute_shadows().geometry
+    ]).to_crs(dsm_crs)
+polygon_seconds = time.time() - t0
+
+polygon_shade = rasterize(
+    ((geom, 1) for geom in shadows if not geom.is_empty),
+    out_shape=shape, transform=transform, dtype="uint8").astype(bool)
+
+# -----------------------------------------------
+# Comparison
+# -----------------------------------------------
+
+intersection = np.logical_and(raster_shade, polygon_shade).sum()
+union = np.logical_or(raster_shade, polygon_shade).sum()
+
+print(f"Raster path:  {raster_seconds:.2f} s, {raster_shade.mean()*100:.1f}% shaded")
+print(f"Polygon path: {polygon_seconds:.2f} s, {polygon_shade.mean()*100:.1f}% shaded")
+print(f"Agreement (IoU): {intersection/union:.3f}")
+print(f"Shaded only in raster path (e.g. vegetation/structures missing in OSM): "
+      f"{np.logical_and(raster_shade, ~polygon_shade).mean()*100:.1f}%")
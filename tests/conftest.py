@@ -0,0 +1,31 @@
+import numpy as np
+import geopandas as gpd
+import pytest
+import shapely
+
+ORIGIN = (723000.0, 6175000.0) # central Copenhagen, EPSG:25832
+
+
+def grid_network(n=12, spacing=50.0, seed=0):
+    """
+    Network GeoDataFrame (u, v, osmid, length, meters_covered, geometry in
+    EPSG:4326) of an n x n street grid, with a few parallel edges.
+    """
+    rng = np.random.default_rng(seed)
+    node = np.arange(n * n).reshape(n, n) + 1000
+    u = np.concatenate([node[:, :-1].ravel(), node[:-1, :].ravel()])
+    v = np.concatenate([node[:, 1:].ravel(), node[1:, :].ravel()])
+    parallel = rng.choice(len(u), n, replace=False)
+    u, v = np.concatenate([u, u[parallel]]), np.concatenate([v, v[parallel]])
+
+    xy = {node[i, j]: (ORIGIN[0] + j * spacing, ORIGIN[1] + i * spacing) for i in range(n) for j in range(n)}
+    lines = [shapely.LineString([xy[a], xy[b]]) for a, b in zip(u, v)]
+    gdf = gpd.GeoDataFrame({"u": u, "v": v, "osmid": np.arange(len(u))}, geometry=lines, crs=25832)
+    gdf["length"] = gdf.length * rng.uniform(1.0, 1.6, len(gdf)) + 0.01
+    gdf["meters_covered"] = gdf["length"] * rng.uniform(0, 1, len(gdf))
+    return gdf.to_crs(4326)
+
+
+@pytest.fixture(scope="session")
+def network_gdf():
+    return grid_network()
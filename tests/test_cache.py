@@ -0,0 +1,26 @@
+import os
+from coolroutes.cache import ShadowCache
+
+
+def test_corrupt_entry_is_a_miss(network_gdf, tmp_path):
+    shadows = ShadowCache(str(tmp_path))
+    key = shadows.key(network_gdf, 1.0, 0.5)
+    shadows.put(key, network_gdf)
+    assert shadows.get(key) is not None
+
+    with open(shadows._file(key), "r+b") as f:
+        f.truncate(100)
+    assert shadows.get(key) is None
+    assert not os.path.exists(shadows._file(key))
+    assert shadows.stats()["misses"] == 1
+
+
+def test_in_place_edit_is_a_miss(network_gdf, tmp_path):
+    shadows = ShadowCache(str(tmp_path))
+    gdf = network_gdf.copy()
+    key = shadows.key(gdf, 1.0, 0.5)
+    shadows.put(key, gdf)
+
+    gdf["length"] *= 3
+    assert shadows.key(gdf, 1.0, 0.5) != key
+    assert shadows.get(shadows.key(gdf, 1.0, 0.5)) is None
@@ -0,0 +1,53 @@
+import time
+import numpy as np
+import pytest
+from coolroutes import cch, graph
+from tests.conftest import grid_network
+
+
+@pytest.fixture(scope="module")
+def csr(network_gdf):
+    return graph.CSRGraph.from_gdf(network_gdf)
+
+
+@pytest.mark.parametrize("alpha", [0.0, 0.7])
+def test_queries_match_dijkstra(csr, alpha):
+    hierarchy = cch.CCH.build(csr, leaf_size=8).customize(csr.edge_weights(alpha))
+    weights = csr.edge_weights(alpha)
+    rng = np.random.default_rng(2)
+    for source, target in rng.choice(csr.node_ids, (30, 2)):
+        rows, cost = hierarchy.query(source, target)
+        expected = csr.shortest_path(source, target, alpha)
+        assert cost == pytest.approx(weights[expected].sum(), rel=1e-6)
+        assert weights[rows].sum() == pytest.approx(cost, rel=1e-6)
+
+
+def test_query_before_customize(csr):
+    with pytest.raises(ValueError, match="customize"):
+        cch.CCH.build(csr).query(*csr.node_ids[:2])
+
+
+def test_load_checks_graph(csr, tmp_path):
+    path = str(tmp_path / "cch.npz")
+    cch.CCH.build(csr).save(path)
+    assert cch.CCH.load(path, csr).customize(csr.edge_weights()).query(*csr.node_ids[:2])[0] is not None
+
+    with pytest.raises(ValueError):
+        cch.CCH.load(path, graph.CSRGraph.from_gdf(grid_network(n=10)))
+
+
+def test_queries_faster_than_full_search():
+    csr = graph.CSRGraph.from_gdf(grid_network(n=80))
+    hierarchy = cch.CCH.build(csr).customize(csr.edge_weights(0.5))
+    pairs = np.random.default_rng(3).choice(csr.node_ids, (20, 2))
+
+    def best_time(route):
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            for source, target in pairs:
+                route(source, target)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    assert best_time(hierarchy.query) < best_time(lambda s, t: csr.shortest_path(s, t, 0.5))
@@ -0,0 +1,130 @@
+import networkx as nx
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+from coolroutes import batch, graph
+from coolroutes.geometry import Network
+from coolroutes.shadematrix import ShadeMatrix
+
+PAIRS = [(1000, 1143), (1005, 1130), (1077, 1012), (1140, 1003)]
+
+
+def route_cost(gdf, rows, alpha):
+    edges = gdf.iloc[rows]
+    return graph.segment_weight(edges["length"], edges["meters_covered"], alpha).sum()
+
+
+@pytest.mark.parametrize("alpha", [0.0, 0.4, 1.0])
+def test_csr_routes_match_networkx(network_gdf, alpha):
+    csr = graph.CSRGraph.from_gdf(network_gdf)
+    G = nx.MultiGraph()
+    weights = np.maximum(graph.segment_weight(network_gdf["length"], network_gdf["meters_covered"], alpha),
+                         graph.MIN_WEIGHT)
+    G.add_weighted_edges_from(zip(network_gdf["u"], network_gdf["v"], weights))
+
+    for source, target in PAIRS:
+        rows = csr.shortest_path(source, target, alpha)
+        expected = nx.dijkstra_path_length(G, source, target)
+        assert route_cost(network_gdf, rows, alpha) == pytest.approx(expected, rel=1e-5)
+
+        # consecutive edges share a node and the route runs source -> target
+        ends = network_gdf.iloc[rows][["u", "v"]].values
+        assert source in ends[0] and target in ends[-1]
+        assert all(set(a) & set(b) for a, b in zip(ends[:-1], ends[1:]))
+
+
+def test_load_graph_without_gdf(network_gdf, tmp_path):
+    path = tmp_path / "graph.npz"
+    network = Network()
+    network.gdf = network_gdf
+    network.save_graph(path)
+
+    loaded = Network().load_graph(path)
+    assert loaded.gdf is None
+    assert loaded.get_graph() is loaded._graph
+    assert np.array_equal(loaded.get_graph().shortest_path(*PAIRS[0]),
+                          network.get_graph().shortest_path(*PAIRS[0]))
+
+
+def test_graph_follows_in_place_edits(network_gdf):
+    network = Network()
+    network.gdf = network_gdf.copy()
+    built = network.get_graph()
+    assert network.get_graph() is built
+
+    network.gdf.loc[network.gdf.index[0], "length"] *= 2
+    network.gdf["meters_covered"] *= 0.5
+    rebuilt = network.get_graph()
+    assert rebuilt is not built
+    assert rebuilt.length[0] == pytest.approx(2 * built.length[0])
+    assert np.allclose(rebuilt.meters_covered, 0.5 * built.meters_covered)
+
+
+def test_batch_routes_in_worker_processes(network_gdf):
+    csr = graph.CSRGraph.from_gdf(network_gdf)
+    origins, destinations = np.array(PAIRS).T
+    serial = batch.route_pairs(csr, origins, destinations, 0.5, processes=1)
+    pooled = batch.route_pairs(csr, origins, destinations, 0.5, processes=2, origins_per_chunk=1)
+    assert np.allclose(serial, pooled)
+    assert not batch._worker
+
+
+def test_shade_rows_must_match_edges(network_gdf, tmp_path):
+    ShadeMatrix.create(str(tmp_path), network_gdf.iloc[::-1], times=[12])
+    network = Network()
+    network.gdf = network_gdf
+    with pytest.raises(ValueError):
+        network.load_shade(str(tmp_path))
+
+    ShadeMatrix.create(str(tmp_path), network_gdf, times=[12])
+    assert network.load_shade(str(tmp_path)).get_meters_covered(12) is not None
+
+
+@pytest.mark.parametrize("alpha", [0.0, 0.6])
+def test_routes_between_points_on_edges(network_gdf, alpha):
+    csr = graph.CSRGraph.from_gdf(network_gdf)
+    weights = csr.edge_weights(alpha)
+    G = nx.MultiGraph()
+    G.add_weighted_edges_from(zip(network_gdf["u"], network_gdf["v"], weights))
+
+    rng = np.random.default_rng(5)
+    ends = [tuple(rng.integers(len(network_gdf), size=2)) for _ in range(8)] + [(17, 17)]
+    for source_edge, target_edge in ends:
+        source_at, target_at = rng.uniform(size=2)
+        su, sv = network_gdf["u"].iloc[source_edge], network_gdf["v"].iloc[source_edge]
+        tu, tv = network_gdf["u"].iloc[target_edge], network_gdf["v"].iloc[target_edge]
+        edges, head, tail = csr.shortest_path_between(
+            (su, sv, source_edge, source_at), (tu, tv, target_edge, target_at), alpha)
+
+        stretch = np.ones(len(edges))
+        stretch[-1] = abs(tail[1] - tail[0])
+        stretch[0] = abs(head[1] - head[0])
+        cost = np.sum(weights[edges] * stretch)
+        candidates = [
+            weights[source_edge] * (source_at if a == su else 1 - source_at)
+            + nx.dijkstra_path_length(G, a, b)
+            + weights[target_edge] * (target_at if b == tu else 1 - target_at)
+            for a in (su, sv) for b in (tu, tv)]
+        if source_edge == target_edge:
+            candidates.append(weights[source_edge] * abs(source_at - target_at))
+        assert cost == pytest.approx(min(candidates), rel=1e-5)
+        assert head[0] == source_at and tail[1] == target_at
+
+
+def test_shortest_route_starts_mid_edge(network_gdf):
+    network = Network()
+    network.gdf = network_gdf.copy()
+    lines = network_gdf.to_crs(25832).geometry
+    start = shapely.line_interpolate_point(lines.iloc[3], 0.25, normalized=True)
+    end = shapely.line_interpolate_point(lines.iloc[150], 0.6, normalized=True)
+    points = gpd.GeoSeries([start, end], crs=25832).to_crs(network_gdf.crs)
+
+    route = network.get_shortest_route(points.iloc[0], points.iloc[1])
+    metric = route.to_crs(25832)
+    assert metric.geometry.iloc[0].distance(start) < 1e-6
+    assert metric.geometry.iloc[-1].distance(end) < 1e-6
+    # the first edge is travelled from the point to one of its ends
+    share = route["length"].iloc[0] / network_gdf["length"].iloc[3]
+    assert min(abs(share - 0.25), abs(share - 0.75)) < 1e-6
+    assert metric.geometry.iloc[0].length == pytest.approx(share * lines.iloc[3].length)
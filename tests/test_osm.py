@@ -0,0 +1,43 @@
+from coolroutes import osm
+
+# a street of three nodes running east out of the bbox, a building inside it
+# and one far outside
+EXTRACT = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lon="12.570" lat="55.680"/>
+  <node id="2" lon="12.571" lat="55.680"/>
+  <node id="3" lon="12.580" lat="55.680"/>
+  <node id="10" lon="12.5700" lat="55.6801"/>
+  <node id="11" lon="12.5702" lat="55.6801"/>
+  <node id="12" lon="12.5702" lat="55.6803"/>
+  <node id="20" lon="12.600" lat="55.700"/>
+  <node id="21" lon="12.601" lat="55.700"/>
+  <node id="22" lon="12.601" lat="55.701"/>
+  <node id="30" lon="12.600" lat="55.690"/>
+  <node id="31" lon="12.601" lat="55.690"/>
+  <way id="100"><nd ref="1"/><nd ref="2"/><nd ref="3"/><tag k="highway" v="residential"/></way>
+  <way id="101"><nd ref="30"/><nd ref="31"/><tag k="highway" v="residential"/></way>
+  <way id="200"><nd ref="10"/><nd ref="11"/><nd ref="12"/><nd ref="10"/><tag k="building" v="yes"/></way>
+  <way id="201"><nd ref="20"/><nd ref="21"/><nd ref="22"/><nd ref="20"/><tag k="building" v="yes"/></way>
+</osm>
+"""
+BBOX = {"x_min": 12.569, "x_max": 12.575, "y_min": 55.679, "y_max": 55.685}
+
+
+def test_bbox_filters_while_streaming(tmp_path):
+    path = str(tmp_path / "extract.osm")
+    with open(path, "w") as f:
+        f.write(EXTRACT)
+
+    assert list(osm.nodes_in_bbox(path, BBOX)) == [1, 2, 10, 11, 12]
+    way_ids, _, _ = osm.collect_ways(path, osm.is_routable, osm.nodes_in_bbox(path, BBOX))
+    assert list(way_ids) == [100]
+
+    # the street keeps its edge leaving the bbox, with the outside node
+    edges = osm.network_edges(path, bbox=BBOX)
+    assert list(edges["u"]) == [1] and list(edges["v"]) == [3]
+    assert sorted(osm.network_edges(path, largest_component=False)["osmid"]) == [100, 101]
+
+    buildings = osm.building_footprints(path, BBOX)
+    assert list(buildings.index) == [200]
+    assert len(osm.building_footprints(path)) == 2
@@ -0,0 +1,25 @@
+import numpy as np
+import geopandas as gpd
+import pytest
+import shapely
+from coolroutes import overlay
+
+
+def test_meters_covered_on_loop_edge():
+    # a closed edge starts and ends at the origin, the shadow covers both ends
+    loop = shapely.LineString([(0, 0), (100, 0), (100, 100), (0, 100), (0, 0)])
+    straight = shapely.LineString([(200, 0), (300, 0)])
+    edges = gpd.GeoSeries([loop, straight], crs=overlay.METRIC_CRS)
+    shadows = gpd.GeoSeries([shapely.box(-5, -5, 5, 4), shapely.box(240, -1, 250, 1)], crs=overlay.METRIC_CRS)
+
+    covered = overlay.meters_covered(edges, shadows)
+    assert covered.values == pytest.approx([9.0, 10.0])
+
+
+def test_overlapping_shadows_count_once():
+    edge = shapely.LineString([(0, 0), (50, 0), (50, 50)])
+    edges = gpd.GeoSeries([edge], crs=overlay.METRIC_CRS)
+    shadows = gpd.GeoSeries([shapely.box(40, -1, 60, 20), shapely.box(45, 10, 55, 30)], crs=overlay.METRIC_CRS)
+
+    covered = overlay.meters_covered(edges, shadows)
+    assert covered.values == pytest.approx([40.0])
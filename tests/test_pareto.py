@@ -0,0 +1,58 @@
+import networkx as nx
+import numpy as np
+import pytest
+from coolroutes import graph, pareto
+from coolroutes.geometry import Network
+from coolroutes.shadematrix import ShadeMatrix
+from tests.conftest import grid_network
+
+
+def brute_force_front(gdf, source, target):
+    G = nx.MultiGraph()
+    exposed = np.maximum(gdf["length"] - gdf["meters_covered"], 0)
+    for row, (u, v) in enumerate(zip(gdf["u"], gdf["v"])):
+        G.add_edge(u, v, key=row)
+    costs = sorted({(gdf["length"].values[rows].sum(), exposed.values[rows].sum())
+                    for rows in ([key for _, _, key in path] for path in nx.all_simple_edge_paths(G, source, target))})
+    front = []
+    for length, cost in costs:
+        if not front or cost < front[-1][1]:
+            front.append((length, cost))
+    return front
+
+
+def test_front_matches_brute_force():
+    gdf = grid_network(n=4, seed=3)
+    csr = graph.CSRGraph.from_gdf(gdf)
+    source, target = 1000, 1015
+    front = pareto.pareto_front(csr, source, target)
+
+    exposed = np.maximum(gdf["length"] - gdf["meters_covered"], 0).values
+    for route in front:
+        assert gdf["length"].values[route.edges].sum() == pytest.approx(route.length)
+        assert exposed[route.edges].sum() == pytest.approx(route.exposed)
+
+    # shortest first, and no route dominates another
+    assert all(a.length < b.length and a.exposed > b.exposed for a, b in zip(front[:-1], front[1:]))
+    assert np.allclose([(r.length, r.exposed) for r in front], brute_force_front(gdf, source, target))
+
+    assert pareto.route_for_alpha(front, 0.0) is front[0]
+    assert pareto.route_for_alpha(front, 1.0) is front[-1]
+
+
+def test_network_front_at_hour(tmp_path):
+    gdf = grid_network(n=4, seed=3)
+    shade = ShadeMatrix.create(str(tmp_path), gdf, times=[12, 15])
+    covered = gdf["length"].values * np.random.default_rng(0).uniform(0, 1, len(gdf))
+    shade.write(15, "total", covered)
+    shade.flush()
+    network = Network()
+    network.gdf = gdf
+    network.load_shade(str(tmp_path))
+
+    start, end = gdf.geometry.iloc[[0, -1]].to_crs(25832).centroid.to_crs(4326)
+    front = network.get_pareto_routes(start, end, hour=15)
+    source, target = network.get_snap_index().snap_to_node([start, end])
+    expected = pareto.pareto_front(network.get_graph(), source, target, covered)
+    assert [list(r.edges) for r in front] == [list(r.edges) for r in expected]
+    assert [r.exposed for r in front] != [r.exposed for r in network.get_pareto_routes(start, end)]
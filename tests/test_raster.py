@@ -0,0 +1,96 @@
+import os
+import numpy as np
+import pytest
+import geopandas as gpd
+import rasterio
+import shapely
+from rasterio.mask import mask
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from coolroutes.raster import BlockCache, open_raster
+from coolroutes.zonal import zonal_percentiles
+
+
+def write(path, data, **options):
+    profile = dict(driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+                   dtype=data.dtype, crs=25832, transform=from_origin(720000, 6180000, 0.4, 0.4))
+    profile.update(options)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data, 1)
+
+
+@pytest.fixture
+def data():
+    return np.random.default_rng(0).random((300, 200)).astype(np.float32)
+
+
+@pytest.mark.parametrize("endianness", ["LITTLE", "BIG"])
+def test_mmap_follows_byte_order(tmp_path, data, endianness):
+    path = str(tmp_path / "chm.tif")
+    write(path, data, ENDIANNESS=endianness)
+    with open_raster(path, cache=BlockCache(), mmap=True) as src:
+        assert src.array is not None
+        assert np.array_equal(src.read_window(Window(0, 0, 200, 300)), data)
+
+
+def test_strips_are_grouped(tmp_path, data):
+    path = str(tmp_path / "chm.tif")
+    write(path, data, blockysize=1)
+    with open_raster(path, cache=BlockCache()) as src:
+        assert src.block_height > 1
+        window = Window(13, 57, 120, 200)
+        assert np.array_equal(src.read_window(window), data[57:257, 13:133])
+        assert np.array_equal(src.sample([720000.2 + 0.4 * 150], [6180000 - 0.4 * 299.5]), data[299:300, 150])
+
+
+def test_rewritten_file_is_not_served_from_cache(tmp_path, data):
+    path = str(tmp_path / "chm.tif")
+    cache = BlockCache()
+    write(path, data)
+    with open_raster(path, cache=cache) as src:
+        src.read_window(Window(0, 0, 200, 300))
+
+    write(path, data + 1)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    with open_raster(path, cache=cache) as src:
+        assert np.array_equal(src.read_window(Window(0, 0, 200, 300)), data + 1)
+
+def test_mask_matches_rasterio(tmp_path, data):
+    path = str(tmp_path / "chm.tif")
+    write(path, data)
+    # one shape reaching past the top left corner of the raster
+    shapes = [shapely.Point(720001, 6179999).buffer(3), shapely.box(720020, 6179950, 720035, 6179900)]
+    with rasterio.open(path) as src:
+        expected, expected_transform = mask(src, shapes, crop=True, filled=False, all_touched=True)
+    with open_raster(path, cache=BlockCache()) as src:
+        masked, transform = src.mask(shapes, all_touched=True)
+    assert transform == expected_transform
+    assert np.array_equal(np.ma.getmaskarray(masked), np.ma.getmaskarray(expected[0]))
+    assert np.array_equal(masked.compressed(), expected[0].compressed())
+
+
+def test_zonal_percentiles_match_masked_pixels(tmp_path, data):
+    path = str(tmp_path / "chm.tif")
+    data = data.copy()
+    data[100:140, 50:90] = -9999
+    write(path, data, nodata=-9999)
+
+    # crowns of 0.1 to 4.5 m radius on a 10 m lattice, so none overlap
+    x, y = np.meshgrid(720005 + 10 * np.arange(8), 6179995 - 10 * np.arange(12))
+    radius = np.random.default_rng(1).uniform(0.1, 4.5, x.size)
+    crowns = gpd.GeoDataFrame(geometry=shapely.buffer(shapely.points(x.ravel(), y.ravel()), radius), crs=25832)
+
+    percentiles = (10, 50, 95)
+    result = zonal_percentiles(path, crowns, percentiles, block_size=32)
+    with rasterio.open(path) as src:
+        for index, geom in crowns.geometry.items():
+            masked, _ = mask(src, [geom], crop=True, filled=False)
+            values = masked.compressed()
+            if len(values):
+                expected = np.percentile(values, percentiles)
+            else:
+                # no pixel centre inside: the pixel under the polygon
+                value = data[src.index(*geom.point_on_surface().coords[0])]
+                expected = np.full(len(percentiles), np.nan if value == -9999 else value)
+            assert np.allclose(result.loc[index], expected, equal_nan=True)
@@ -0,0 +1,61 @@
+import asyncio
+import numpy as np
+import pytest
+from coolroutes.cache import RouteCache
+from coolroutes.geometry import Network
+from coolroutes.shadematrix import ShadeMatrix
+from coolroutes.service import HTTPError, RoutingService
+
+ROUTE = [("from", "12.5465,55.6695"), ("to", "12.5550,55.6742")]
+
+
+@pytest.fixture
+def service(network_gdf):
+    network = Network()
+    network.gdf = network_gdf.copy()
+    return RoutingService(network, workers=2).warm()
+
+
+def test_route(service):
+    result = asyncio.run(service.dispatch("GET", "/route", ROUTE, b""))
+    assert result["length"] > 0
+    assert 0 <= result["meters_covered"] <= result["length"]
+
+
+def test_time_without_shade_table(service):
+    with pytest.raises(HTTPError) as error:
+        asyncio.run(service.dispatch("GET", "/route", ROUTE + [("time", "13")], b""))
+    assert error.value.status == 400
+    assert str(error.value) == "no shade table loaded"
+
+    body = b'{"pairs": [[[12.5465, 55.6695], [12.555, 55.6742]]], "time": 13}'
+    with pytest.raises(HTTPError) as error:
+        asyncio.run(service.dispatch("POST", "/batch-route", [], body))
+    assert error.value.status == 400
+
+
+def test_time_bucketed_once(service, network_gdf, tmp_path):
+    gdf = service.network.gdf
+    shade = ShadeMatrix.create(str(tmp_path), gdf, times=range(24))
+    rng = np.random.default_rng(1)
+    for time in shade.times:
+        shade.write(time, "total", gdf["length"].values * rng.uniform(0, 1, len(gdf)))
+        shade.write(time, "tree", 0)
+    shade.flush()
+    service.network.load_shade(str(tmp_path))
+    service.network.route_cache = RouteCache(time_step=1.0)
+    service.warm()
+
+    results = [asyncio.run(service.dispatch("GET", "/route", ROUTE + [("time", t)], b""))
+               for t in ("13:10", "13:40")]
+    assert list(service._covered) == ["13.0"]
+    assert results[0] == results[1]
+
+
+def test_route_without_shade_column(network_gdf):
+    network = Network()
+    network.gdf = network_gdf.drop(columns="meters_covered")
+    service = RoutingService(network, workers=2).warm()
+    result = asyncio.run(service.dispatch("GET", "/route", ROUTE, b""))
+    assert result["length"] > 0
+    assert result["meters_covered"] == 0
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import geopandas as gpd
+import shapely
+from coolroutes import shadows
+from coolroutes.geometry import Trees
+
+
+def footprints(heights):
+    boxes = [shapely.box(12.55 + i * 0.001, 55.68, 12.5503 + i * 0.001, 55.6803) for i in range(len(heights))]
+    return gpd.GeoDataFrame({"building_id": range(len(heights)), "height": heights}, geometry=boxes, crs=4326)
+
+
+def test_building_shadows_without_positive_heights():
+    result = shadows.building_shadows(footprints([np.nan, 0.0]), 1.0, 0.5)
+    assert result.empty
+    assert list(result.columns) == ["building_id", "geometry", "height", "type"]
+
+
+def test_parallel_building_shadows_with_empty_chunks():
+    # the western half has no heights, so some spatial chunks are all NaN
+    heights = [np.nan] * 8 + [10.0, 0.0, 5.0, 12.0, 7.0, 3.0, 8.0, 4.0]
+    gdf = footprints(heights)
+    serial = shadows.building_shadows(gdf, 1.0, 0.5)
+    parallel = shadows.building_shadows_parallel(gdf, 1.0, 0.5, processes=4)
+    assert sorted(parallel.building_id) == sorted(serial.building_id) == [8, 10, 11, 12, 13, 14, 15]
+
+    assert shadows.building_shadows_parallel(footprints([np.nan] * 8), 1.0, 0.5, processes=4).empty
+
+
+@pytest.mark.parametrize("resolution", [2, 16])
+@pytest.mark.parametrize("azimuth, altitude", [(2.4, 0.6), (0.3, 0.15), (4.0, 1.3)])
+def test_tree_shadows_match_tree_shade(resolution, azimuth, altitude):
+    # extraction crowns are buffered with resolution=2, municipality crowns with the default
+    rng = np.random.default_rng(3)
+    n = 60
+    x, y = rng.uniform(1.39e6, 1.40e6, n), rng.uniform(7.49e6, 7.50e6, n)
+    radius = rng.uniform(0.2, 6, n) * 2.5
+    crowns = shapely.buffer(shapely.points(x, y), radius, quad_segs=resolution)
+    # a few crowns that are not convex
+    bulges = shapely.buffer(shapely.points(x[:3] + radius[:3] + 1, y[:3]), 3, quad_segs=resolution)
+    crowns[:3] = shapely.union(crowns[:3], bulges)
+    trees = Trees()
+    trees.gdf = gpd.GeoDataFrame({"height": rng.uniform(1, 25, n), "crown_ratio": rng.uniform(0.2, 0.9, n)},
+                                 geometry=crowns, crs=3857)
+    trees.azimuth, trees.altitude = azimuth, altitude
+
+    vectorized = shadows.trees_shadows(trees.gdf, trees.azimuth, trees.altitude)
+    reference = trees.gdf.apply(trees.tree_shade, axis=1).values
+    assert shapely.is_valid(vectorized.values).all()
+    difference = shapely.area(shapely.symmetric_difference(vectorized, reference))
+    assert np.all(difference <= 1e-6 * shapely.area(reference))
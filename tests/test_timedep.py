@@ -0,0 +1,47 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+from coolroutes import graph, timedep
+from tests.conftest import ORIGIN
+
+PAIRS = [(1000, 1143), (1077, 1012)]
+
+
+def test_constant_profile_matches_static_route(network_gdf):
+    csr = graph.CSRGraph.from_gdf(network_gdf)
+    fraction = (network_gdf["meters_covered"] / network_gdf["length"]).values
+    profile = timedep.ShadeProfile([9, 12, 15], np.repeat(fraction[:, None], 3, axis=1))
+
+    for source, target in PAIRS:
+        path, hours = timedep.time_dependent_route(csr, profile, source, target, "10:00", alpha=0.7)
+        static = csr.shortest_path(source, target, 0.7)
+        edges, expected = network_gdf.iloc[path], network_gdf.iloc[static]
+        assert graph.segment_weight(edges["length"], edges["meters_covered"], 0.7).sum() == pytest.approx(
+            graph.segment_weight(expected["length"], expected["meters_covered"], 0.7).sum(), rel=1e-5)
+
+        ridden = np.concatenate([[0.0], np.cumsum(edges["length"].values)[:-1]])
+        assert hours == pytest.approx(10 + ridden / timedep.CYCLING_SPEED / 3600)
+
+
+def test_shade_taken_at_arrival_time():
+    # two routes 1000 -> 1001 -> 1003 and 1000 -> 1002 -> 1003; the shade on
+    # the second edges swaps sides between 12:00 and 13:00
+    xy = {1000: (0, 0), 1001: (1, 0), 1002: (0, 1), 1003: (1, 1)}
+    u, v = [1000, 1001, 1000, 1002], [1001, 1003, 1002, 1003]
+    lines = [shapely.LineString([np.add(ORIGIN, xy[a]), np.add(ORIGIN, xy[b])]) for a, b in zip(u, v)]
+    gdf = gpd.GeoDataFrame({"u": u, "v": v, "length": 450.0}, geometry=lines, crs=25832)
+    profile = timedep.ShadeProfile([12, 13], np.array([[0, 0], [0.8, 0], [0, 0], [0, 1.0]]))
+    csr = graph.CSRGraph.from_gdf(gdf)
+
+    # riding at 0.25 m/s the second edge is entered at 12:30, when the
+    # 1002 -> 1003 edge is the shadier one
+    path, hours = timedep.time_dependent_route(csr, profile, 1000, 1003, 12, alpha=1.0, speed=0.25)
+    assert list(path) == [2, 3]
+    assert hours == pytest.approx([12, 12.5])
+
+    # leaving at 13:00 both second edges are read at the last bin
+    path, _ = timedep.time_dependent_route(csr, profile, 1000, 1003, 13, alpha=1.0, speed=0.25)
+    assert list(path) == [2, 3]
+    path, _ = timedep.time_dependent_route(csr, profile, 1000, 1003, 11, alpha=1.0, speed=100.0)
+    assert list(path) == [0, 1]
@@ -1,270 +1,263 @@
-
 from utils import satellite_imagery
+from utils.transformer_model import BATCH_SIZE, VegetationSegmenter
+from utils import crown_segmentation
 from PIL import Image
-import matplotlib.pyplot as plt
 from rasterio.transform import from_origin
 import numpy as np
-import pickle
 import sys
 import os
 import rasterio
+sys.path.append('..')
+from coolroutes.zonal import group_percentiles
+from coolroutes.raster import open_raster
 import pyproj
 import rasterio.features
-import fiona
 from shapely.geometry import shape
-from shapely.geometry import MultiPoint, Point
-from itertools import combinations
-from rasterio.mask import mask
+from rasterio.windows import Window
+import pandas as pd
 import geopandas as gpd
 
-# ----------------------------------------------
-# Load CHM Raster (tile)
-# ----------------------------------------------
-chm_path = "../data/DHM/CHM_617_72_TIF_UTM32-ETRS89/CHM_1km_6174_726.tif"
-chm_path = sys.argv[1]
-
-chm = rasterio.open(chm_path)
-bounds = chm.bounds
-
-# ----------------------------------------------
-# Get Aerial Image Tile
-# ----------------------------------------------
-
-padding = 30 # meters
-
-# Convert bounds to WGS84 (without using transformer_model)
-bounds_wgs84 = pyproj.transform(
-    pyproj.Proj(chm.crs),
-    pyproj.Proj(init='epsg:4326'),
-    [bounds.left-padding, bounds.right+padding],
-    [bounds.top+padding, bounds.bottom-padding]
-)
-
-
-bounds_si = [(bounds_wgs84[1][0], bounds_wgs84[0][0]),
-             (bounds_wgs84[1][1], bounds_wgs84[0][1])]
-
-tile_path = satellite_imagery.get_tile(bounds_si, output_dir="./data/si_tiles/")
-
-# ----------------------------------------------
-# Extract Vegetetion Mask
-# ----------------------------------------------
-
-image = Image.open(tile_path, mode='r')
-image = image.convert("RGB")
+PADDING = 30 # meters
+SPLITS = 5
+
+# Every stage writes one file into the tile's work directory and is skipped
+# when that file already exists, so an interrupted tile resumes where it
+# stopped. Files are written under a temporary name and renamed when done.
+STAGES = ["imagery", "mask", "clip", "canopy"]
+OUTPUTS = {
+    "imagery": "imagery.png",
+    "mask": "mask.geojson",
+    "clip": "cchm.tif",
+    "canopy": "canopy.geojson",
+}
 
-# Split the image in 5x5 parts
-splits = 5 
-w, h = image.size
-w, h = w // splits, h // splits
-crop_bounds = [(i*w, j*h, (i+1)*w, (j+1)*h) for j in range(splits) for i in range(splits)]
-images = [image.crop(bounds) for bounds in crop_bounds]
+_segmenter = None
 
 
-if not os.path.exists("./temp/images"):
-    os.makedirs("./temp/images")
+def tile_name(chm_path):
+    return os.path.splitext(os.path.basename(chm_path))[0]
 
-# remove all files in ./temp/images
-for f in os.listdir("./temp/images"):
-    os.remove(os.path.join("./temp/images", f))
 
-for i, img in enumerate(images):
-    with open(f"./temp/images/sub_image_{i}.pkl", "wb") as f:
-        pickle.dump(img, f)
+def stage_path(tile_dir, stage):
+    return os.path.join(tile_dir, OUTPUTS[stage])
 
-if not os.path.exists("./temp/masks"):
-    os.makedirs("./temp/masks")
 
-# remove all files in ./temp/masks
-for f in os.listdir("./temp/masks"):
-    os.remove(os.path.join("./temp/masks", f))
+def partial(path):
+    root, ext = os.path.splitext(path)
+    return root + ".part" + ext
 
-masks = []
-for i, image in enumerate(images):
-    print(f"Processing image {i + 1} of {len(images)}")
-    sub_image_path = os.path.join(os.getcwd(), f"./temp/images/sub_image_{i}.pkl")
-    os.system(f'python ./utils/transformer_model.py "{sub_image_path}"')
-    mask_t = np.load(f"./temp/masks/mask_{i}.npy")
-    masks.append(mask_t)
 
-# Merge the 4x4 parts into a single image
-mask_full = np.zeros((h * splits, w * splits), dtype=np.uint8)
-for i, predicted_mask in enumerate(masks):
-    x, y = i % splits, i // splits
-    mask_full[y * h : (y + 1) * h, x * w : (x + 1) * w] = predicted_mask
+def get_segmenter(batch_size=BATCH_SIZE):
+    # the model is loaded once per process
+    global _segmenter
+    if _segmenter is None:
+        _segmenter = VegetationSegmenter(batch_size=batch_size)
+    return _segmenter
 
-mask_full[mask_full > 1] = 0
 
+def padded_bounds(chm, crs):
+    bounds = chm.bounds
+    return pyproj.transform(
+        pyproj.Proj(chm.crs),
+        pyproj.Proj(init=crs),
+        [bounds.left-PADDING, bounds.right+PADDING],
+        [bounds.top+PADDING, bounds.bottom-PADDING]
+    )
 
 # ----------------------------------------------
-# Export vegetation mask as GeoTIFF
+# Get Aerial Image Tile
 # ----------------------------------------------
 
-# Convert bounds to web mercator (epsg:900913)
-bounds_wm = pyproj.transform(
-    pyproj.Proj(chm.crs),
-    pyproj.Proj(init='epsg:900913'),
-    [bounds.left-padding, bounds.right+padding],
-    [bounds.top+padding, bounds.bottom-padding]
-)
-
-top_left_x = bounds_wm[0][0]
-top_left_y = bounds_wm[1][0]
-bottom_right_x = bounds_wm[0][1]
-bottom_right_y = bounds_wm[1][1]
-
-mask_full = mask_full*255
-
-# define the metadata for the output raster
-meta = {
-    'driver': 'GTiff',
-    'dtype': 'uint8',
-    'nodata': None,
-    'width': mask_full.shape[1],
-    'height': mask_full.shape[0],
-    'count': 1,
-    'crs': 'EPSG:900913',
-    'transform': from_origin(top_left_x, top_left_y, (bottom_right_x-top_left_x)/mask_full.shape[1], -(bottom_right_y-top_left_y)/mask_full.shape[0])
-}
+def fetch_imagery(chm_path, tile_dir):
+    with open_raster(chm_path) as chm:
+        # Convert bounds to WGS84 (without using transformer_model)
+        bounds_wgs84 = padded_bounds(chm, 'epsg:4326')
 
-# write the binary array to a new GeoTIFF file
-if not os.path.exists("./data/masks"):
-    os.makedirs("./data/masks")
+    bounds_si = [(bounds_wgs84[1][0], bounds_wgs84[0][0]),
+                 (bounds_wgs84[1][1], bounds_wgs84[0][1])]
 
-mask_path = './data/masks/mask_' + '_'.join([str(int(x)) for x in list(bounds)]) + '.tif'
-with rasterio.open(mask_path, 'w', **meta) as dst:
-    dst.write(mask_full, 1)
+    tile_path = satellite_imagery.get_tile(bounds_si, output_dir=tile_dir)
+    os.replace(tile_path, stage_path(tile_dir, "imagery"))
 
 # ----------------------------------------------
-# Export vegetation mask as Shapefile
+# Extract Vegetetion Mask
 # ----------------------------------------------
 
-with rasterio.open(mask_path) as src:
-    veg_mask = src.read(1)
-    veg_meta = src.meta
-
-shapes = list(rasterio.features.shapes(veg_mask, transform=veg_meta['transform']))
-
-shapes_gdf = gpd.GeoDataFrame([{'geometry': shape(s[0]), 'value': s[1]} for s in shapes], crs=veg_meta['crs'])
-shapes_gdf = shapes_gdf[shapes_gdf.area != shapes_gdf.area.max()]['geometry']
-
-schema = {'geometry': 'Polygon', 'properties': {}}
-crs = veg_meta['crs']
-mask_poly_path = './data/masks/mask_' + '_'.join([str(int(x)) for x in list(bounds)]) + '.geojson'
-shapes_gdf.to_file(mask_poly_path, driver='GeoJSON', schema=schema, crs=crs)
+def vegetation_mask(chm_path, tile_dir, batch_size=BATCH_SIZE):
+    image = Image.open(stage_path(tile_dir, "imagery"), mode='r')
+    image = image.convert("RGB")
 
+    # Split the image in 5x5 parts
+    w, h = image.size
+    w, h = w // SPLITS, h // SPLITS
+    crop_bounds = [(i*w, j*h, (i+1)*w, (j+1)*h) for j in range(SPLITS) for i in range(SPLITS)]
+    images = [image.crop(bounds) for bounds in crop_bounds]
 
-# ----------------------------------------------
-# Clip CHM with vegetation mask
-# ----------------------------------------------
+    mask_full = np.zeros((h * SPLITS, w * SPLITS), dtype=np.uint8)
+    get_segmenter(batch_size).predict_into(images, mask_full, crop_bounds)
 
-mask_geom = shapes_gdf.to_crs('epsg:25832').geometry
+    mask_full[mask_full > 1] = 0
+    mask_full = mask_full*255
 
-# Mask the CHM raster with the vegetation mask
-masked_chm, out_transform = mask(chm, mask_geom, crop=True, all_touched=True, invert=False, nodata=0)
+    # Export vegetation mask as GeoTIFF, in web mercator (epsg:900913)
+    with open_raster(chm_path) as chm:
+        bounds_wm = padded_bounds(chm, 'epsg:900913')
 
-# Cut everything below 1.5m in the masked CHM raster
-masked_chm[masked_chm < 1.5] = 0
+    top_left_x = bounds_wm[0][0]
+    top_left_y = bounds_wm[1][0]
+    bottom_right_x = bounds_wm[0][1]
+    bottom_right_y = bounds_wm[1][1]
 
-# Export the masked CHM raster
-out_meta = chm.meta.copy()
-out_meta.update({"driver": "GTiff",
-                "height": masked_chm.shape[1],
-                "width": masked_chm.shape[2],
-                "transform": out_transform})
+    meta = {
+        'driver': 'GTiff',
+        'dtype': 'uint8',
+        'nodata': None,
+        'width': mask_full.shape[1],
+        'height': mask_full.shape[0],
+        'count': 1,
+        'crs': 'EPSG:900913',
+        'transform': from_origin(top_left_x, top_left_y, (bottom_right_x-top_left_x)/mask_full.shape[1], -(bottom_right_y-top_left_y)/mask_full.shape[0])
+    }
 
-# write the binary array to a new GeoTIFF file
-if not os.path.exists("./data/clipped_chm"):
-    os.makedirs("./data/clipped_chm")
+    mask_path = os.path.join(tile_dir, "mask.tif")
+    with rasterio.open(mask_path, 'w', **meta) as dst:
+        dst.write(mask_full, 1)
 
-masked_chm_path = './data/clipped_chm/cchm_' + '_'.join([str(int(x)) for x in list(bounds)]) + '.tif'
-with rasterio.open(masked_chm_path, "w", **out_meta) as dest:
-    dest.write(masked_chm)
+    # Export vegetation mask as polygons
+    shapes = list(rasterio.features.shapes(mask_full, transform=meta['transform']))
 
+    shapes_gdf = gpd.GeoDataFrame([{'geometry': shape(s[0]), 'value': s[1]} for s in shapes], crs=meta['crs'])
+    shapes_gdf = shapes_gdf[shapes_gdf.area != shapes_gdf.area.max()][['geometry']]
 
+    out_path = stage_path(tile_dir, "mask")
+    shapes_gdf.to_file(partial(out_path), driver='GeoJSON')
+    os.replace(partial(out_path), out_path)
 
 # ----------------------------------------------
-# Segment trees using R
+# Clip CHM with vegetation mask
 # ----------------------------------------------
 
-if not os.path.exists("./temp/tree_segments"):
-    os.makedirs("./temp/tree_segments")
+def clip_chm(chm_path, tile_dir):
+    mask_geom = gpd.read_file(stage_path(tile_dir, "mask")).to_crs('epsg:25832').geometry
 
-# remove all files in ./temp/tree_segments
-for f in os.listdir("./temp/tree_segments"):
-    os.remove(os.path.join("./temp/tree_segments", f))
+    with open_raster(chm_path) as chm:
+        # Mask the CHM raster with the vegetation mask
+        masked_chm, out_transform = chm.mask(list(mask_geom), all_touched=True)
+        out_meta = chm.meta.copy()
+    masked_chm = masked_chm.filled(0).astype(out_meta["dtype"])
 
-# get filename of masked_chm_path (OUTPUT path)
-segment_fn = os.path.basename(masked_chm_path) \
-                    .replace(".tif", ".geojson") \
-                    .replace("cchm", "segments_raw")
+    # Cut everything below 1.5m in the masked CHM raster
+    masked_chm[masked_chm < 1.5] = 0
 
-segment_path = os.path.join(os.getcwd(), f"temp/tree_segments/{segment_fn}")
+    out_meta.update({"driver": "GTiff",
+                    "height": masked_chm.shape[0],
+                    "width": masked_chm.shape[1],
+                    "transform": out_transform})
 
-# Run tree segmentation R script
-os.system(f'Rscript ./utils/tree_detection.r "{masked_chm_path}" "{segment_path}"')
+    out_path = stage_path(tile_dir, "clip")
+    with rasterio.open(partial(out_path), "w", **out_meta) as dest:
+        dest.write(masked_chm, 1)
+    os.replace(partial(out_path), out_path)
 
+# ----------------------------------------------
+# Segment trees
+# ----------------------------------------------
+
+def read_clipped_chm(tile_dir):
+    """
+    Clipped CHM (NaN = no data), its transform and CRS.
+    """
+    with open_raster(stage_path(tile_dir, "clip")) as src:
+        height, width = src.shape
+        chm = src.read_window(Window(0, 0, width, height), masked=True).astype(np.float32).filled(np.nan)
+        return chm, src.transform, src.crs
 
 # ----------------------------------------------
 # Clean tree segmentation
 # ----------------------------------------------
 
-# tree_seg = gpd.read_file('/Users/edibegovic/Desktop/crowns_w_height.geojson')
+def crown_statistics(labels, chm, transform, percentiles=(95,)):
+    """
+    Height (max and percentiles), area and equivalent diameter of every
+    crown of a label raster over the CHM, in one pass over its pixels.
+    Rows are indexed by label; labels without data pixels get NaN heights.
+    """
+    n = labels.max() + 1
+    valid = (labels > 0) & ~np.isnan(chm)
+    heights = group_percentiles(labels[valid], chm[valid].astype(np.float64), n, (100,) + tuple(percentiles))
 
-# Load geojson file with tree segmentation
-tree_seg = gpd.read_file(segment_path)
-tree_seg['geometry'] = tree_seg['geometry'].convex_hull
+    area = np.bincount(labels.ravel(), minlength=n) * abs(transform.a * transform.e)
+    stats = pd.DataFrame(heights, columns=['height'] + [f'height_p{q}' for q in percentiles])
+    stats['crown_area'] = area
+    stats['diameter'] = 2 * np.sqrt(area / np.pi)
+    return stats.iloc[1:]
 
-tree_seg = tree_seg[tree_seg.area > 1.2]
 
-# all geometries whose area:perimeter ratio is less than 3.5 are removed
-tree_seg['perimeter'] = tree_seg['geometry'].boundary.length
-tree_seg['area'] = tree_seg['geometry'].area
+def clean_segments(chm_path, tile_dir):
+    chm, transform, crs = read_clipped_chm(tile_dir)
+    labels, tree_seg = crown_segmentation.segment_crowns(chm, transform, crs)
+    tree_seg['geometry'] = tree_seg['geometry'].convex_hull
 
-# Ignore non-dense trees (false positives)
-tree_seg['ratio'] = (tree_seg['area']*4)/(tree_seg['perimeter']**2)
-tree_seg = tree_seg[tree_seg['ratio'] > 0.15]
+    tree_seg = tree_seg[tree_seg.area > 1.2]
 
-def calculate_diameter(polygon):
-    vertices = MultiPoint(polygon.exterior.coords)
-    min_rotated_rect = vertices.minimum_rotated_rectangle
-    diameter = max(Point(v1).distance(Point(v2)) for v1, v2 in combinations(min_rotated_rect.exterior.coords, 2))
-    return diameter
+    # all geometries whose area:perimeter ratio is less than 3.5 are removed
+    tree_seg['perimeter'] = tree_seg['geometry'].boundary.length
+    tree_seg['area'] = tree_seg['geometry'].area
 
-tree_seg['diameter'] = tree_seg['geometry'].apply(calculate_diameter)
-tree_seg['centroid'] = tree_seg['geometry'].centroid
+    # Ignore non-dense trees (false positives)
+    tree_seg['ratio'] = (tree_seg['area']*4)/(tree_seg['perimeter']**2)
+    tree_seg = tree_seg[tree_seg['ratio'] > 0.15]
 
-# Get tree height from masked CHM
-chm_masked = rasterio.open(masked_chm_path)
-def get_highest_value(masked_chm, polygon):
-    masked_array, _ = rasterio.mask.mask(masked_chm, [polygon], crop=True, filled=False)
-    highest_value = np.nanmax(masked_array)
-    return highest_value
+    # Get tree height and diameter from the crown pixels of the masked CHM
+    tree_seg = tree_seg.join(crown_statistics(labels, chm, transform), on='treeID')
 
-tree_seg['height'] = tree_seg['geometry'].apply(lambda polygon: get_highest_value(chm_masked, polygon))
+    # Make tree_seg_round with replacing polygons geometry (in tree_seg) with circles based on centriod and diameter
+    tree_seg_round = tree_seg.copy()
+    tree_seg_round['geometry'] = tree_seg.centroid.buffer(tree_seg['diameter'].values/2)
 
-# Make tree_seg_round with replacing polygons geometry (in tree_seg) with circles based on centriod and diameter
-tree_seg_round = tree_seg.copy()
-tree_seg_round['geometry'] = tree_seg_round.apply(lambda x: Point(x['centroid']).buffer(x['diameter']/2), axis=1)
-tree_seg_round = tree_seg_round.drop(columns=['centroid'])
+    # Misc. cleaning
+    tree_seg_round = tree_seg_round[tree_seg_round['height'] > 2.6]
+    tree_seg_round = tree_seg_round[~((tree_seg_round['area'] < 10) & (tree_seg_round['height'] > 16))]
+    tree_seg_round = tree_seg_round[~((tree_seg_round['area'] < 6) & (tree_seg_round['height'] > 12))]
 
-# Misc. cleaning
-tree_seg_round = tree_seg_round[tree_seg_round['height'] > 2.6]
-tree_seg_round = tree_seg_round[~((tree_seg_round['area'] < 10) & (tree_seg_round['height'] > 16))]
-tree_seg_round = tree_seg_round[~((tree_seg_round['area'] < 6) & (tree_seg_round['height'] > 12))]
+    # Export canopies
+    out_path = stage_path(tile_dir, "canopy")
+    cols = ['geometry', 'height', 'diameter']
+    tree_seg_round[cols].to_file(partial(out_path), driver='GeoJSON')
+    os.replace(partial(out_path), out_path)
 
 # ----------------------------------------------
-# Export canopies
+# Run stages
 # ----------------------------------------------
-if not os.path.exists("./data/canopies"):
-    os.makedirs("./data/canopies")
 
-# export tree segmentation as geojson
-canopy_fn = os.path.basename(masked_chm_path) \
-            .replace(".tif", ".geojson") \
-            .replace("cchm", "canopy")
+STAGE_FUNCTIONS = {
+    "imagery": fetch_imagery,
+    "mask": vegetation_mask,
+    "clip": clip_chm,
+    "canopy": clean_segments,
+}
 
-canopy_path = "./data/canopies/" + canopy_fn
 
-cols = ['geometry', 'height', 'diameter']
-tree_seg_round[cols].to_file(canopy_path, driver='GeoJSON')
+def run_stages(chm_path, tile_dir, stages=STAGES, batch_size=BATCH_SIZE):
+    """
+    Runs the given stages of one CHM tile in its own work directory,
+    skipping stages whose output exists. Returns the canopy path.
+    """
+    os.makedirs(tile_dir, exist_ok=True)
+    for stage in stages:
+        if os.path.exists(stage_path(tile_dir, stage)):
+            continue
+        if stage == "mask":
+            vegetation_mask(chm_path, tile_dir, batch_size)
+        else:
+            STAGE_FUNCTIONS[stage](chm_path, tile_dir)
+    return stage_path(tile_dir, "canopy")
+
+
+if __name__ == "__main__":
+    # single tile: python main.py <CHM tile> [batch size] [work dir]
+    chm_path = sys.argv[1]
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else BATCH_SIZE
+    work_dir = sys.argv[3] if len(sys.argv) > 3 else "./data/tiles"
+    canopy_path = run_stages(chm_path, os.path.join(work_dir, tile_name(chm_path)), batch_size=batch_size)
+    print(f'Saved canopies as {canopy_path}')
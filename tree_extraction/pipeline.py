@@ -0,0 +1,151 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import pandas as pd
+import geopandas as gpd
+import main
+from utils.transformer_model import BATCH_SIZE
+from coolroutes.cache import file_stamp # importable once main extended sys.path
+
+WORK_DIR = "./data/tiles"
+OUTPUT_PATH = "./data/canopies.geojson"
+
+
+def find_tiles(source):
+    """
+    CHM tiles of a directory (*.tif) or a glob pattern, sorted.
+    """
+    pattern = os.path.join(source, "*.tif") if os.path.isdir(source) else source
+    return sorted(glob.glob(pattern))
+
+
+class Manifest(object):
+    """
+    JSON record of the finished tiles (CHM stamp and canopy path), written
+    atomically after every tile so an interrupted run keeps its progress.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tiles = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.tiles = json.load(f)["tiles"]
+
+    def is_done(self, name, chm_path):
+        entry = self.tiles.get(name)
+        return entry is not None and entry["chm"] == list(file_stamp(chm_path)) \
+            and os.path.exists(entry["canopy"])
+
+    def finish(self, name, chm_path, canopy_path):
+        self.tiles[name] = {"chm": list(file_stamp(chm_path)), "canopy": canopy_path}
+        tmp = self.path + ".part"
+        with open(tmp, "w") as f:
+            json.dump({"tiles": self.tiles}, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+def init_worker(threads):
+    import torch
+    torch.set_num_threads(threads)
+
+
+def fetch(chm_path, tile_dir):
+    return main.run_stages(chm_path, tile_dir, stages=["imagery"])
+
+
+def process(chm_path, tile_dir, batch_size):
+    return main.run_stages(chm_path, tile_dir, batch_size=batch_size)
+
+
+def merge_canopies(canopy_paths, output_path):
+    """
+    Concatenates the tile canopies into one layer with a `tile` column.
+    """
+    frames = []
+    for name, path in sorted(canopy_paths.items()):
+        gdf = gpd.read_file(path)
+        gdf["tile"] = name
+        frames.append(gdf)
+    merged = gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    merged.to_file(output_path)
+    return merged
+
+
+def run(source, work_dir=WORK_DIR, output_path=OUTPUT_PATH, processes=None,
+        downloads=4, batch_size=BATCH_SIZE, force=False):
+    """
+    Extracts the canopies of every CHM tile in `source` and merges them.
+
+    Each tile runs in its own directory under `work_dir`. Imagery is
+    fetched on a thread pool ahead of the CPU stages (mask, clip,
+    segmentation, cleaning), which run on a process pool with the model
+    loaded once per worker. Tiles in the manifest whose CHM is unchanged
+    are skipped, and unfinished tiles resume from their last completed
+    stage. Failed tiles are reported and retried on the next run.
+    """
+    tiles = {main.tile_name(path): path for path in find_tiles(source)}
+    if not tiles:
+        raise FileNotFoundError(f"No CHM tiles found for {source}")
+    os.makedirs(work_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(work_dir, "manifest.json"))
+    tile_dirs = {name: os.path.join(work_dir, name) for name in tiles}
+    todo = [name for name in tiles if force or not manifest.is_done(name, tiles[name])]
+
+    processes = processes or os.cpu_count()
+    threads = max(1, os.cpu_count() // processes)
+    failed = {}
+    with ThreadPoolExecutor(downloads) as fetchers, \
+            ProcessPoolExecutor(processes, initializer=init_worker, initargs=(threads,)) as workers:
+        pending = {}
+        for name in todo:
+            if force:
+                for stage in main.STAGES:
+                    if os.path.exists(main.stage_path(tile_dirs[name], stage)):
+                        os.remove(main.stage_path(tile_dirs[name], stage))
+            pending[fetchers.submit(fetch, tiles[name], tile_dirs[name])] = (name, "imagery")
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, stage = pending.pop(future)
+                try:
+                    canopy_path = future.result()
+                except Exception:
+                    failed[name] = traceback.format_exc()
+                    print(f"{name}: {stage} failed", file=sys.stderr)
+                    continue
+                if stage == "imagery":
+                    future = workers.submit(process, tiles[name], tile_dirs[name], batch_size)
+                    pending[future] = (name, "process")
+                else:
+                    manifest.finish(name, tiles[name], canopy_path)
+                    print(f"{name}: done ({len(manifest.tiles)}/{len(tiles)})")
+
+    for name, error in failed.items():
+        print(f"--- {name}\n{error}", file=sys.stderr)
+
+    finished = {name: manifest.tiles[name]["canopy"] for name in tiles if manifest.is_done(name, tiles[name])}
+    if finished:
+        merge_canopies(finished, output_path)
+    return finished, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract tree canopies from CHM tiles")
+    parser.add_argument("source", help="directory or glob of CHM tiles")
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--downloads", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--force", action="store_true", help="rebuild finished tiles")
+    args = parser.parse_args()
+
+    _, failed = run(args.source, args.work_dir, args.output, args.processes,
+                    args.downloads, args.batch_size, args.force)
+    sys.exit(1 if failed else 0)
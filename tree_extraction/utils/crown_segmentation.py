@@ -0,0 +1,118 @@
+import numpy as np
+import geopandas as gpd
+import rasterio.features
+from scipy import ndimage
+from shapely.geometry import shape
+
+# lidR's locate_trees(chm, lmf(7)) and dalponte2016(th_tree = 1.5,
+# th_seed = 0.28, th_cr = 0.50) as used by the former tree_detection.r
+WINDOW_SIZE = 7 # meters
+MIN_HEIGHT = 2
+TH_TREE = 1.5
+TH_SEED = 0.28
+TH_CR = 0.5
+MAX_CR = 10 # pixels
+
+
+def disk_maximum(a, radius):
+    """
+    Maximum over a disk of `radius` pixels around every pixel, as the
+    maximum of the separable rectangle filters whose union is the disk.
+    """
+    out = None
+    widths = [int(np.sqrt(radius**2 - dy**2)) for dy in range(radius + 1)]
+    for dy, w in enumerate(widths):
+        if dy < radius and widths[dy + 1] == w:
+            continue
+        rect = ndimage.maximum_filter(a, size=(2 * dy + 1, 2 * w + 1), mode="constant")
+        out = rect if out is None else np.maximum(out, rect, out=out)
+    return out
+
+
+def local_maxima(chm, resolution, ws=WINDOW_SIZE, hmin=MIN_HEIGHT):
+    """
+    Tree tops (rows, cols): pixels of at least `hmin` that are the highest
+    in a circular window of diameter `ws` (map units) around them. Flat
+    tops give one seed per connected plateau.
+    """
+    radius = max(int(ws / 2 / resolution), 1)
+    tops = (chm >= hmin) & (chm == disk_maximum(chm, radius))
+
+    plateaus, n = ndimage.label(tops)
+    _, first = np.unique(plateaus.ravel(), return_index=True)
+    return np.unravel_index(first[1:], chm.shape) if n else (np.array([], int), np.array([], int))
+
+
+def dalponte(chm, rows, cols, th_tree=TH_TREE, th_seed=TH_SEED, th_cr=TH_CR, max_cr=MAX_CR):
+    """
+    Seeded region growing (Dalponte & Coomes 2016, as in lidR). Crowns grow
+    from their seeds into 4-neighbours higher than `th_tree`, than
+    `th_seed` times the seed height and `th_cr` times the crown's mean
+    height, at most 5% above the seed and less than `max_cr` pixels from it.
+    All crowns grow one ring per iteration. Returns a label array (0 = no
+    crown, i = crown of seed i - 1).
+    """
+    height, width = chm.shape
+    labels = np.zeros(chm.shape, dtype=np.int32)
+    n = len(rows)
+    labels[rows, cols] = np.arange(1, n + 1)
+    seed_height = np.r_[0, chm[rows, cols]]
+    seed_row, seed_col = np.r_[0, rows], np.r_[0, cols]
+    sums = np.r_[0, chm[rows, cols]].astype(np.float64)
+    counts = np.r_[0, np.ones(n)]
+    free = ((chm > th_tree) & (labels == 0)).ravel()
+
+    # only free pixels next to a crown can join one: the neighbours of the
+    # pixels grown in the last iteration and the ones rejected before
+    grown_r, grown_c = np.asarray(rows), np.asarray(cols)
+    flat = np.array([], dtype=np.int64)
+    while len(grown_r):
+        mean = sums / np.maximum(counts, 1)
+        nr = np.concatenate([grown_r + 1, grown_r - 1, grown_r, grown_r])
+        nc = np.concatenate([grown_c, grown_c, grown_c + 1, grown_c - 1])
+        inside = (nr >= 0) & (nr < height) & (nc >= 0) & (nc < width)
+        flat = np.unique(np.concatenate([flat, nr[inside] * width + nc[inside]]))
+        flat = flat[free[flat]]
+        r, c = np.divmod(flat, width)
+        h = chm[r, c]
+
+        joined = np.zeros(len(flat), dtype=bool)
+        for dr, dc in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            # pixels (r, c) claimed by the crown of their neighbour (r - dr, c - dc)
+            nr, nc = r - dr, c - dc
+            inside = (nr >= 0) & (nr < height) & (nc >= 0) & (nc < width) & ~joined
+            crown = np.zeros(len(flat), dtype=np.int32)
+            crown[inside] = labels[nr[inside], nc[inside]]
+            ok = ((crown > 0) & (h > seed_height[crown] * th_seed) & (h > mean[crown] * th_cr)
+                  & (h <= seed_height[crown] * 1.05)
+                  & (np.abs(seed_row[crown] - r) < max_cr) & (np.abs(seed_col[crown] - c) < max_cr))
+            labels[r[ok], c[ok]] = crown[ok]
+            sums += np.bincount(crown[ok], h[ok], n + 1)
+            counts += np.bincount(crown[ok], minlength=n + 1)
+            joined |= ok
+
+        free[flat[joined]] = False
+        grown_r, grown_c = r[joined], c[joined]
+        flat = flat[~joined]
+    return labels
+
+
+def crown_polygons(labels, transform, crs):
+    """
+    One (dissolved) polygon per crown label, with its `treeID`.
+    """
+    shapes = rasterio.features.shapes(labels, mask=labels > 0, transform=transform)
+    gdf = gpd.GeoDataFrame([{'geometry': shape(s), 'treeID': int(v)} for s, v in shapes],
+                           columns=['geometry', 'treeID'], geometry='geometry', crs=crs)
+    return gdf.dissolve(by='treeID').reset_index()
+
+
+def segment_crowns(chm, transform, crs, ws=WINDOW_SIZE, hmin=MIN_HEIGHT, th_tree=TH_TREE,
+                   th_seed=TH_SEED, th_cr=TH_CR, max_cr=MAX_CR):
+    """
+    Crown label array and crown polygons of a CHM array (NaN = no data).
+    """
+    chm = np.nan_to_num(np.asarray(chm, dtype=np.float32))
+    rows, cols = local_maxima(chm, abs(transform.a), ws, hmin)
+    labels = dalponte(chm, rows, cols, th_tree, th_seed, th_cr, max_cr)
+    return labels, crown_polygons(labels, transform, crs)
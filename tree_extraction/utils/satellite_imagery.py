@@ -1,20 +1,30 @@
-
 import os
+import hashlib
 import requests
 import numpy as np
 import threading
-import json
-import re
 import cv2
-from datetime import datetime
-
-def download_tile(url, headers, channels):
-    response = requests.get(url, headers=headers)
-    arr =  np.asarray(bytearray(response.content), dtype=np.uint8)
-
-    if channels == 3:
-        return cv2.imdecode(arr, 1)
-    return cv2.imdecode(arr, -1)
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# XYZ template of the imagery source; point it to a local tile server for
+# tests and offline runs
+DEFAULT_URL = os.environ.get("SATELLITE_TILE_URL", "https://mt.google.com/vt/lyrs=s&x={x}&y={y}&z={z}")
+CACHE_DIR = "./data/xyz_cache"
+
+HEADERS = {
+    "cache-control": "max-age=0",
+    "sec-ch-ua": "\" Not A;Brand\";v=\"99\", \"Chromium\";v=\"99\", \"Google Chrome\";v=\"99\"",
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": "\"Windows\"",
+    "sec-fetch-dest": "document",
+    "sec-fetch-mode": "navigate",
+    "sec-fetch-site": "none",
+    "sec-fetch-user": "?1",
+    "upgrade-insecure-requests": "1",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.4844.82 Safari/537.36"
+}
 
 
 def project_with_scale(lat, lon, scale):
@@ -25,62 +35,165 @@ def project_with_scale(lat, lon, scale):
     return x, y
 
 
-def download_image(lat1: float, lon1: float, lat2: float, lon2: float,
-                   zoom: int, url: str, headers: dict, tile_size: int = 256, channels: str = 3) -> np.ndarray:
-    scale = 1 << zoom
-
-    # Find the pixel coordinates and tile coordinates of the corners
-    tl_proj_x, tl_proj_y = project_with_scale(lat1, lon1, scale)
-    br_proj_x, br_proj_y = project_with_scale(lat2, lon2, scale)
-
-    tl_pixel_x = int(tl_proj_x * tile_size)
-    tl_pixel_y = int(tl_proj_y * tile_size)
-    br_pixel_x = int(br_proj_x * tile_size)
-    br_pixel_y = int(br_proj_y * tile_size)
-
-    tl_tile_x = int(tl_proj_x)
-    tl_tile_y = int(tl_proj_y)
-    br_tile_x = int(br_proj_x)
-    br_tile_y = int(br_proj_y)
-
-    img_w = abs(tl_pixel_x - br_pixel_x)
-    img_h = br_pixel_y - tl_pixel_y
-    img = np.ndarray((img_h, img_w, channels), np.uint8)
-
-    def build_row(row_number):
-        for j in range(tl_tile_x, br_tile_x + 1):
-            tile = download_tile(url.format(x=j, y=row_number, z=zoom), headers, channels)
+class TileFetcher(object):
+    """
+    XYZ tile source with a persistent on-disk cache.
+
+    Tiles are downloaded over one pooled HTTP session (retrying with
+    exponential backoff on connection errors, 429 and 5xx) by a bounded
+    thread pool shared by all mosaics, and stored as the raw encoded bytes
+    under cache_dir/<hash of url>/z/x/y, so overlapping and repeated
+    requests read them from disk. Use as a context manager (or call
+    `close`) to release the pool and session.
+    """
+    def __init__(self, url=DEFAULT_URL, cache_dir=CACHE_DIR, headers=HEADERS, workers=8,
+                 retries=5, backoff=0.5, timeout=30):
+        self.url = url
+        self.cache_dir = os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest()[:12]) \
+            if cache_dir else None
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(workers)
+
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["GET"])
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def tile_path(self, x, y, z):
+        return os.path.join(self.cache_dir, str(z), str(x), str(y))
+
+    def fetch(self, x, y, z):
+        """
+        Encoded bytes of one tile, from the cache or the server.
+        """
+        path = self.tile_path(x, y, z) if self.cache_dir else None
+        if path and os.path.exists(path):
+            with self._lock:
+                self.hits += 1
+            with open(path, "rb") as f:
+                return f.read()
+
+        with self._lock:
+            self.misses += 1
+        response = self.session.get(self.url.format(x=x, y=y, z=z), timeout=self.timeout)
+        response.raise_for_status()
+        data = response.content
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.part"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return data
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def discard(self, x, y, z):
+        """
+        Removes a cached tile (e.g. one that cannot be decoded).
+        """
+        if self.cache_dir:
+            try:
+                os.remove(self.tile_path(x, y, z))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """
+        Stops the download threads and closes the HTTP session.
+        """
+        self._pool.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def download_image(self, lat1, lon1, lat2, lon2, zoom, tile_size=256, channels=3):
+        """
+        Mosaic of the tiles covering the corners, decoded tile by tile
+        straight into one preallocated image.
+        """
+        scale = 1 << zoom
+
+        # Find the pixel coordinates and tile coordinates of the corners
+        tl_proj_x, tl_proj_y = project_with_scale(lat1, lon1, scale)
+        br_proj_x, br_proj_y = project_with_scale(lat2, lon2, scale)
+
+        tl_pixel_x = int(tl_proj_x * tile_size)
+        tl_pixel_y = int(tl_proj_y * tile_size)
+        br_pixel_x = int(br_proj_x * tile_size)
+        br_pixel_y = int(br_proj_y * tile_size)
+
+        tl_tile_x = int(tl_proj_x)
+        tl_tile_y = int(tl_proj_y)
+        br_tile_x = int(br_proj_x)
+        br_tile_y = int(br_proj_y)
+
+        img_w = abs(tl_pixel_x - br_pixel_x)
+        img_h = br_pixel_y - tl_pixel_y
+        img = np.zeros((img_h, img_w, channels), np.uint8)
+
+        def place_tile(tile_xy):
+            x, y = tile_xy
+            arr = np.frombuffer(self.fetch(x, y, zoom), dtype=np.uint8)
+            tile = cv2.imdecode(arr, cv2.IMREAD_COLOR if channels == 3 else cv2.IMREAD_UNCHANGED)
+            if tile is None:
+                # do not serve the broken tile from the cache again
+                self.discard(x, y, zoom)
+                raise ValueError(f"Could not decode tile {zoom}/{x}/{y}")
 
             # Find the pixel coordinates of the new tile relative to the image
-            tl_rel_x = j * tile_size - tl_pixel_x
-            tl_rel_y = row_number * tile_size - tl_pixel_y
+            tl_rel_x = x * tile_size - tl_pixel_x
+            tl_rel_y = y * tile_size - tl_pixel_y
             br_rel_x = tl_rel_x + tile_size
             br_rel_y = tl_rel_y + tile_size
 
             # Define where the tile will be placed on the image
             i_x_l = max(0, tl_rel_x)
-            i_x_r = min(img_w + 1, br_rel_x)
+            i_x_r = min(img_w, br_rel_x)
             i_y_l = max(0, tl_rel_y)
-            i_y_r = min(img_h + 1, br_rel_y)
+            i_y_r = min(img_h, br_rel_y)
 
             # Define how border tiles are cropped
             cr_x_l = max(0, -tl_rel_x)
-            cr_x_r = tile_size + min(0, img_w - br_rel_x)
             cr_y_l = max(0, -tl_rel_y)
-            cr_y_r = tile_size + min(0, img_h - br_rel_y)
 
-            img[i_y_l:i_y_r, i_x_l:i_x_r] = tile[cr_y_l:cr_y_r, cr_x_l:cr_x_r]
+            img[i_y_l:i_y_r, i_x_l:i_x_r] = tile[cr_y_l:cr_y_l + i_y_r - i_y_l, cr_x_l:cr_x_l + i_x_r - i_x_l]
+
+        tiles = [(x, y) for y in range(tl_tile_y, br_tile_y + 1) for x in range(tl_tile_x, br_tile_x + 1)]
+        # list() re-raises the first failed tile
+        list(self._pool.map(place_tile, tiles))
+        return img
 
-    threads = []
-    for i in range(tl_tile_y, br_tile_y + 1):
-        thread = threading.Thread(target=build_row, args=[i])
-        thread.start()
-        threads.append(thread)
 
-    for thread in threads:
-        thread.join()
+_fetchers = {}
+_fetchers_lock = threading.Lock()
 
-    return img
+
+def get_fetcher(url=DEFAULT_URL, cache_dir=CACHE_DIR, headers=HEADERS):
+    """
+    Shared fetcher (session, thread pool and cache) per url, cache and headers.
+    """
+    key = (url, cache_dir, tuple(sorted(headers.items())))
+    with _fetchers_lock:
+        if key not in _fetchers:
+            _fetchers[key] = TileFetcher(url, cache_dir, headers)
+        return _fetchers[key]
+
+
+def download_image(lat1: float, lon1: float, lat2: float, lon2: float,
+                   zoom: int, url: str, headers: dict, tile_size: int = 256, channels: str = 3) -> np.ndarray:
+    return get_fetcher(url, headers=headers).download_image(lat1, lon1, lat2, lon2, zoom, tile_size, channels)
 
 
 def image_size(lat1: float, lon1: float, lat2: float,
@@ -112,12 +225,14 @@ def take_input(messages):
     return inputs
 
 
-def get_tile(bounds:[tuple], zoom:int=19, output_dir:str="./images") -> str:
+def get_tile(bounds:[tuple], zoom:int=19, output_dir:str="./images", url:str=None,
+             fetcher:TileFetcher=None) -> str:
     """
     Downloads a satellite image of the given bounds and saves it to the given directory.
 
     :bounds: A list of tuples containing the top-left and bottom-right coordinates of the image.
     CRS: WGS84
+    :url: XYZ template of the imagery source (default `DEFAULT_URL`), used when no fetcher is given.
     """
 
     # Check if output directory exists
@@ -133,29 +248,12 @@ def get_tile(bounds:[tuple], zoom:int=19, output_dir:str="./images") -> str:
     lat2 = float(lat2)
     lon2 = float(lon2)
     channels = 3
-    url = "https://mt.google.com/vt/lyrs=s&x={x}&y={y}&z={z}"
-
-    headers = {
-        "cache-control": "max-age=0",
-        "sec-ch-ua": "\" Not A;Brand\";v=\"99\", \"Chromium\";v=\"99\", \"Google Chrome\";v=\"99\"",
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": "\"Windows\"",
-        "sec-fetch-dest": "document",
-        "sec-fetch-mode": "navigate",
-        "sec-fetch-site": "none",
-        "sec-fetch-user": "?1",
-        "upgrade-insecure-requests": "1",
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.4844.82 Safari/537.36"
-    }
-
-    img = download_image(lat1, lon1, lat2, lon2, zoom, url,
-                         headers, 256, channels)
-
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+
+    fetcher = fetcher or get_fetcher(url or DEFAULT_URL)
+    img = fetcher.download_image(lat1, lon1, lat2, lon2, zoom, 256, channels)
+
     name = f'tile_{int(lat1*1000)}_{int(lon1*1000)}_{int(lat2*1000)}_{int(lon2*1000)}.png'
     path = os.path.join(output_dir, name)
     cv2.imwrite(path, img)
     print(f'Saved as {name}')
-    return path 
-
-
+    return path
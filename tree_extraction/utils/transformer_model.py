@@ -1,34 +1,60 @@
-import pickle
-from transformers import AutoFeatureExtractor, MaskFormerForInstanceSegmentation, AutoImageProcessor
-from PIL import Image
+from transformers import AutoFeatureExtractor, MaskFormerForInstanceSegmentation
 import numpy as np
 import torch
 import pickle
 import sys
 import os
 
-# read first sys argument as image path
-fn = sys.argv[1]
-with open(fn, "rb") as f:
-    image = pickle.load(f)
-
-print("Image loaded")
-
-extractor = AutoFeatureExtractor.from_pretrained("thiagohersan/maskformer-satellite-trees", use_auth_token=True)
-model = MaskFormerForInstanceSegmentation.from_pretrained("thiagohersan/maskformer-satellite-trees")
-
-inputs = extractor(images=image, return_tensors="pt")
-outputs = model(**inputs)
-
-class_queries_logits = outputs.class_queries_logits
-masks_queries_logits = outputs.masks_queries_logits
-
-predicted_mask = extractor.post_process_semantic_segmentation(
-    outputs, target_sizes=[image.size[::-1]]
-)[0]
-
-# extract the number from the filename
-num = int(fn.split("_")[-1].split(".")[0])
-
-
-np.save(f"./temp/masks/mask_{num}.npy", predicted_mask)
+MODEL_NAME = "thiagohersan/maskformer-satellite-trees"
+BATCH_SIZE = 5 # images per forward pass
+
+
+class VegetationSegmenter(object):
+    """
+    MaskFormer vegetation segmentation, loaded once and run in-process on
+    batches of PIL images (CPU by default).
+    """
+    def __init__(self, model_name=MODEL_NAME, batch_size=BATCH_SIZE, device="cpu", threads=None):
+        if threads:
+            torch.set_num_threads(threads)
+        self.batch_size = batch_size
+        self.device = device
+        self.extractor = AutoFeatureExtractor.from_pretrained(model_name, use_auth_token=True)
+        self.model = MaskFormerForInstanceSegmentation.from_pretrained(model_name).to(device).eval()
+
+    def predict(self, images):
+        """
+        Yields the semantic mask (class per pixel, uint8) of every image.
+        """
+        for start in range(0, len(images), self.batch_size):
+            batch = images[start:start + self.batch_size]
+            with torch.inference_mode():
+                inputs = self.extractor(images=batch, return_tensors="pt").to(self.device)
+                outputs = self.model(**inputs)
+                masks = self.extractor.post_process_semantic_segmentation(
+                    outputs, target_sizes=[image.size[::-1] for image in batch])
+            for mask in masks:
+                yield mask.cpu().numpy().astype(np.uint8)
+
+    def predict_into(self, images, out, boxes):
+        """
+        Writes the masks straight into `out` at the (left, top, right,
+        bottom) pixel boxes the images were cropped from.
+        """
+        for (left, top, right, bottom), mask in zip(boxes, self.predict(images)):
+            out[top:bottom, left:right] = mask
+        return out
+
+
+if __name__ == "__main__":
+    # single pickled image -> ./temp/masks/mask_<n>.npy (the old per-image interface)
+    fn = sys.argv[1]
+    with open(fn, "rb") as f:
+        image = pickle.load(f)
+
+    predicted_mask = next(VegetationSegmenter(batch_size=1).predict([image]))
+
+    # extract the number from the filename
+    num = int(fn.split("_")[-1].split(".")[0])
+    os.makedirs("./temp/masks", exist_ok=True)
+    np.save(f"./temp/masks/mask_{num}.npy", predicted_mask)